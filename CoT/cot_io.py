@@ -3,6 +3,10 @@ import argparse
 from tqdm import tqdm
 from utils import *
 from prompt_list import *
+from llm_cache import add_llm_cache_args, init_llm_cache, report_llm_cache
+from llm_client import add_llm_client_args, init_llm_client, report_llm_client
+from checkpoint import skip_answered
+from result_writer import add_result_writer_args, init_result_writer, get_result_writer, close_result_writers
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -18,14 +22,28 @@ if __name__ == '__main__':
                         default="gpt-3.5-turbo", help="base LLM model.")
     parser.add_argument("--opeani_api_keys", type=int,
                         default="", help="if the LLM_type is gpt-3.5-turbo or gpt-4, you need add your own openai api keys.")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip the questions already in the output file.")
+    add_llm_cache_args(parser)
+    add_llm_client_args(parser)
+    add_result_writer_args(parser)
     args = parser.parse_args()
+    init_llm_cache(args)
+    init_llm_client(args)
+    init_result_writer(args)
 
-with open("cot_{}.jsonl".format(args.dataset), 'a+', encoding="UTF-8") as out:
-    datas, question_string = prepare_dataset(args.dataset)
-    for i in tqdm(datas, total=len(datas)):
-        if args.prompt_methods == "cot":
-            prompt = cot_prompt + "\n\nQ: " + i[question_string] + "\nA: "
-        else:
-            prompt = io_prompt + "\n\nQ: " + i[question_string] + "\nA: "
-        results = run_llm(prompt, args.temperature, args.max_length, args.opeani_api_keys, args.LLM_type)
-        out.write(json.dumps({"question": i[question_string], "{}_result".format(args.prompt_methods): results})+'\n')
+out = get_result_writer("cot_{}.jsonl".format(args.dataset))
+datas, question_string = prepare_dataset(args.dataset)
+if args.resume:
+    datas = skip_answered(datas, question_string, out.path)
+for i in tqdm(datas, total=len(datas)):
+    if args.prompt_methods == "cot":
+        prompt = cot_prompt + "\n\nQ: " + i[question_string] + "\nA: "
+    else:
+        prompt = io_prompt + "\n\nQ: " + i[question_string] + "\nA: "
+    results = run_llm(prompt, args.temperature, args.max_length, args.opeani_api_keys, args.LLM_type)
+    out.write({"question": i[question_string], "{}_result".format(args.prompt_methods): results})
+
+close_result_writers()
+report_llm_cache()
+report_llm_client()
@@ -1,34 +1,27 @@
-import openai
-import time
 import json
+import os
+import sys
 
-def run_llm(prompt, temperature, max_tokens, opeani_api_keys, engine="gpt-3.5-turbo"):
-    if "llama" not in engine.lower():
-        openai.api_key = "EMPTY"
-        openai.api_base = "http://localhost:8000/v1"  # your local llama server port
-        engine = openai.Model.list()["data"][0]["id"]
-    else:
-        openai.api_key = opeani_api_keys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ToG"))  # shared helpers live in ToG/
+from llm_cache import get_llm_cache
+from llm_client import get_llm_client
 
+def run_llm(prompt, temperature, max_tokens, opeani_api_keys, engine="gpt-3.5-turbo"):
     messages = [{"role":"system","content":"You are an AI assistant that helps people find information."}]
     message_prompt = {"role":"user","content":prompt}
     messages.append(message_prompt)
+    cache = get_llm_cache()
+    if cache is not None:
+        # key on the requested engine so replay works without the server
+        result = cache.get(engine, messages, temperature, max_tokens)
+        if result is not None:
+            return result
+
     print("start openai")
-    while(f == 0):
-        try:
-            response = openai.ChatCompletion.create(
-                    model=engine,
-                    messages = messages,
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    frequency_penalty=0,
-                    presence_penalty=0)
-            result = response["choices"][0]['message']['content']
-            f = 1
-        except:
-            print("openai error, retry")
-            time.sleep(2)
+    result = get_llm_client(engine, opeani_api_keys).chat(messages, temperature, max_tokens)
     print("end openai")
+    if cache is not None:
+        cache.put(engine, messages, temperature, max_tokens, result)
     return result
 
 def prepare_dataset(dataset_name):
@@ -0,0 +1,160 @@
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from llm_client import get_llm_client
+
+_STOP = object()
+
+
+class MicroBatcher:
+    """
+    Collects items submitted by many threads into batches for one handler call.
+
+    A batch is sent once it holds max_batch_size items or max_wait_ms after its first
+    item arrived, whichever comes first. handler(items, contexts) returns one result
+    per item, which is routed back to the Future returned by submit(); if it raises,
+    every item of the batch gets the exception. contexts[i] is a copy of the context
+    item i was submitted in, so the handler can do the accounting of each item in
+    the trace spans of its caller (as concurrency.fan_out does). Up to
+    max_concurrent_batches batches are handled at the same time while the next one
+    is being collected. A handler with a close() method is closed with the batcher.
+
+    Parameters:
+    - handler (callable): (list of items, list of contexts) -> list of results, in the same order.
+    - max_batch_size (int): max number of items per batch.
+    - max_wait_ms (float): max time the first item of a batch waits for others.
+    - max_concurrent_batches (int): max number of batches handled at the same time.
+    """
+
+    def __init__(self, handler, max_batch_size=8, max_wait_ms=20, max_concurrent_batches=4):
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix="batch")
+        self._thread = threading.Thread(target=self._collect, name="batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self._queue.put((item, future, contextvars.copy_context()))
+        return future
+
+    def _collect(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    entry = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    stopping = True
+                    break
+                batch.append(entry)
+            self.batches += 1
+            self.items += len(batch)
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        items = [item for item, _, _ in batch]
+        contexts = [context for _, _, context in batch]
+        try:
+            results = self.handler(items, contexts)
+        except Exception as error:
+            for _, future, _ in batch:
+                future.set_exception(error)
+            return
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
+
+    def close(self):
+        """Send the pending items and wait for every batch to be handled."""
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+        close = getattr(self.handler, "close", None)
+        if close is not None:
+            close()
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+_batch_options = {"max_batch_size": 1, "max_wait_ms": 20, "mode": "completions"}
+
+
+def add_batching_args(parser):
+    parser.add_argument("--llm_batch_size", type=int,
+                        default=1, help="max number of relation-prune prompts sent to the LLM as one batch, 1 disables batching.")
+    parser.add_argument("--llm_batch_wait_ms", type=float,
+                        default=20, help="max time a relation-prune prompt waits for others to fill its batch.")
+    parser.add_argument("--llm_batch_mode", type=str,
+                        default="completions", help="completions (one /completions request with a list of prompts) or concurrent (parallel chat requests).")
+
+
+def init_batching(args):
+    _batch_options["max_batch_size"] = args.llm_batch_size
+    _batch_options["max_wait_ms"] = args.llm_batch_wait_ms
+    _batch_options["mode"] = args.llm_batch_mode
+
+
+def batch_mode():
+    return _batch_options["mode"]
+
+
+def _make_handler(client, temperature, max_tokens):
+    if _batch_options["mode"] == "completions":
+        def handler(batch, contexts):
+            return client.complete_batch(batch, temperature, max_tokens, contexts)
+        return handler
+
+    executor = ThreadPoolExecutor(max_workers=_batch_options["max_batch_size"], thread_name_prefix="batch_chat")
+
+    def handler(batch, contexts):
+        # each chat counts its tokens in the context of the question that sent it
+        return list(executor.map(lambda messages, context: context.run(client.chat, messages, temperature, max_tokens),
+                                 batch, contexts))
+    handler.close = executor.shutdown
+    return handler
+
+
+def get_prompt_batcher(engine, opeani_api_keys, temperature, max_tokens):
+    """
+    Shared batcher of chat messages for one engine and sampling setting, None when
+    batching is disabled.
+    """
+    if _batch_options["max_batch_size"] <= 1:
+        return None
+    key = (engine, opeani_api_keys, temperature, max_tokens)
+    batcher = _batchers.get(key)
+    if batcher is None:
+        with _batchers_lock:
+            batcher = _batchers.get(key)
+            if batcher is None:
+                client = get_llm_client(engine, opeani_api_keys)
+                batcher = MicroBatcher(_make_handler(client, temperature, max_tokens),
+                                       _batch_options["max_batch_size"], _batch_options["max_wait_ms"])
+                _batchers[key] = batcher
+    return batcher
+
+
+def close_batchers():
+    with _batchers_lock:
+        for batcher in _batchers.values():
+            batcher.close()
+            print("LLM batching: %d prompts in %d batches, %.1f per batch" % (
+                batcher.items, batcher.batches, batcher.items / batcher.batches if batcher.batches else 0.0))
+        _batchers.clear()
@@ -0,0 +1,386 @@
+import argparse
+import collections
+import contextlib
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from client import MANY_METHODS, MultiServerWikidataQueryClient
+from concurrency import run_ordered, question_boundary
+from llm_client import set_llm_client
+from sparql_client import set_sparql_client
+from batcher import add_batching_args, init_batching, close_batchers
+from tracing import add_tracing_args, init_tracing, traced_question, close_tracing
+
+NS = "http://rdf.freebase.com/ns/"
+
+
+def _hash(*parts):
+    return zlib.crc32("\x1f".join(parts).encode("utf-8"))
+
+
+class MockKG:
+    """
+    In-memory knowledge graph shared by the mock Freebase and Wikidata backends.
+
+    Entity ids are used as Freebase MIDs and as Wikidata QIDs, relation names as
+    Freebase relations and as Wikidata property labels. Only entities whose id
+    starts with "m." are returned by the Freebase entity queries, as on Virtuoso.
+    """
+
+    def __init__(self):
+        self.names = {}
+        self.out_edges = collections.defaultdict(lambda: collections.defaultdict(list))  # head -> relation -> tails
+        self.in_edges = collections.defaultdict(lambda: collections.defaultdict(list))  # tail -> relation -> heads
+        self.relations = {}  # label -> pid
+
+    def add(self, head, relation, tail):
+        self.out_edges[head][relation].append(tail)
+        self.in_edges[tail][relation].append(head)
+        self.relations.setdefault(relation, "P%d" % (len(self.relations) + 1))
+
+    @classmethod
+    def load(cls, path):
+        """Read a tab-separated file of `head relation tail` triples and `id name` lines."""
+        kg = cls()
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip() or line.startswith("#"):
+                    continue
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) == 3:
+                    kg.add(*fields)
+                elif len(fields) == 2:
+                    kg.names[fields[0]] = fields[1]
+        return kg
+
+    @classmethod
+    def synthetic(cls, num_entities=2000, num_relations=50, degree=6, seed=0):
+        """Random graph with `degree` outgoing edges per entity, the same for the same seed."""
+        rng = random.Random(seed)
+        kg = cls()
+        entities = ["m.%06d" % i for i in range(num_entities)]
+        relations = ["bench.domain_%d.relation_%d" % (i % 7, i) for i in range(num_relations)]
+        for i, entity in enumerate(entities):
+            kg.names[entity] = "Entity %d" % i
+            for _ in range(degree):
+                kg.add(entity, rng.choice(relations), rng.choice(entities))
+        return kg
+
+    def name(self, entity):
+        return self.names.get(entity)
+
+    def topic_entities(self):
+        return sorted(entity for entity in self.out_edges if entity in self.names)
+
+
+class MockLLM:
+    """
+    Deterministic stand-in for LLMClient that answers every ToG prompt template
+    with a well-formed response after latency_ms.
+
+    Relation prune prompts get `width` relations of the prompt as
+    `{relation (Score: x)}` lines, entity score prompts one score per entity, and
+    reasoning prompts {Yes} for a yes_rate share of the reasoning chains.
+    """
+
+    def __init__(self, latency_ms=0, yes_rate=0.3):
+        self.latency = latency_ms / 1000.0
+        self.yes_rate = yes_rate
+        self.calls = collections.Counter()
+        self.batches = 0
+        self._lock = threading.Lock()
+
+    def chat(self, messages, temperature=0, max_tokens=256):
+        time.sleep(self.latency)
+        return self._respond("\n\n".join(message["content"] for message in messages))
+
+    def complete_batch(self, batch, temperature=0, max_tokens=256, contexts=None):
+        time.sleep(self.latency)
+        with self._lock:
+            self.batches += 1
+        return [self._respond("\n\n".join(message["content"] for message in messages)) for messages in batch]
+
+    def _respond(self, text):
+        # the question part of every template starts at its last "Q: "
+        query = text[text.rfind("Q: "):]
+        if "Please retrieve" in text:
+            kind, response = "relation_prune", self._relations(text, query)
+        elif "Please score the entities" in text:
+            kind, response = "entity_score", self._scores(query)
+        elif "answer whether it's sufficient" in text:
+            kind = "reasoning"
+            response = "{Yes}." if _hash(query) % 1000 < self.yes_rate * 1000 else "{No}."
+        else:
+            kind, response = "answer", "{Mock answer}."
+        with self._lock:
+            self.calls[kind] += 1
+        return response
+
+    def _relations(self, text, query):
+        width = int(re.search(r"Please retrieve (\d+) relations", text).group(1))
+        listed = re.search(r"Relations:(.*)A: ?$", query, re.S).group(1)
+        if listed.startswith("\n"):  # wiki: one numbered relation per line
+            relations = [re.sub(r"^\d+\. ", "", line) for line in listed.strip().split("\n")]
+        else:
+            relations = listed.strip().split("; ")
+        picked = sorted(relations, key=lambda relation: _hash(query, relation))[:width]
+        weights = [_hash(relation) % 9 + 1 for relation in picked]
+        return "\n".join("%d. {%s (Score: %.2f)}: mock." % (i, relation, weight / sum(weights))
+                         for i, (relation, weight) in enumerate(zip(picked, weights), start=1))
+
+    def _scores(self, query):
+        entities = re.search(r"Entites: (.*)\nScore: ?$", query, re.S).group(1).split("; ")
+        weights = [_hash(query, entity) % 9 + 1 for entity in entities]
+        return ", ".join("%.2f" % (weight / sum(weights)) for weight in weights)
+
+
+class _CallCounter:
+    def __init__(self, latency_ms):
+        self.latency = latency_ms / 1000.0
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+
+        self._batch = threading.local()
+
+    def _call(self, kind):
+        if getattr(self._batch, "active", False):
+            return  # part of a batched request, already counted
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls[kind] += 1
+
+
+class MockSparqlClient(_CallCounter):
+    """SparqlClient answering the queries of freebase_func from a MockKG."""
+
+    def __init__(self, kg, latency_ms=0):
+        super().__init__(latency_ms)
+        self.kg = kg
+
+    def _entities(self, sparql):
+        match = re.search(r"ns:(\S+) ns:(\S+) \?tailEntity \.", sparql)
+        if match:
+            entities = self.kg.out_edges[match.group(1)][match.group(2)]
+        else:
+            match = re.search(r"\?tailEntity ns:(\S+) ns:(\S+) \.", sparql)
+            entities = self.kg.in_edges[match.group(2)][match.group(1)]
+        entities = [entity for entity in dict.fromkeys(entities) if entity.startswith("m.")]
+        if "ORDER BY ?tailEntity" in sparql:
+            entities.sort()
+        elif "ORDER BY" in sparql:
+            entities.sort(key=lambda entity: _hash(sparql, entity))
+        limit = re.search(r"LIMIT (\d+)", sparql)
+        return entities[:int(limit.group(1))] if limit else entities
+
+    def query(self, sparql_txt):
+        if "COUNT(?tailEntity)" in sparql_txt:
+            self._call("entity_count")
+            return [{"total": {"value": str(len(self._entities(sparql_txt)))}}]
+        if "SELECT ?tailEntity" in sparql_txt:
+            self._call("entities")
+            return [{"tailEntity": {"value": NS + entity}} for entity in self._entities(sparql_txt)]
+        if "VALUES ?entity" in sparql_txt:
+            self._call("names")
+            entity_ids = [entity_id[len("ns:"):] for entity_id in re.search(r"VALUES \?entity \{ (.*) \}", sparql_txt).group(1).split()]
+            return [{"entity": {"value": NS + entity_id}, "tailEntity": {"value": self.kg.name(entity_id)}}
+                    for entity_id in entity_ids if self.kg.name(entity_id) is not None]
+        match = re.search(r"FILTER\(\?entity = ns:(\S+)\)", sparql_txt)
+        if match:
+            self._call("name")
+            name = self.kg.name(match.group(1))
+            return [{"tailEntity": {"value": name}}] if name is not None else []
+        self._call("relations")
+        entity = re.search(r"ns:(\S+) \?relation \?x", sparql_txt).group(1)
+        return ([{"relation": {"value": NS + relation}, "head": {"value": "1"}} for relation in self.kg.out_edges[entity]] +
+                [{"relation": {"value": NS + relation}, "head": {"value": "0"}} for relation in self.kg.in_edges[entity]])
+
+
+class MockWikidataServer(_CallCounter):
+    """WikidataQueryClient answering the Wikidata server RPCs from a MockKG, with the same return shapes."""
+
+    def __init__(self, kg, latency_ms=0):
+        super().__init__(latency_ms)
+        self.kg = kg
+        self.pid_to_label = {pid: label for label, pid in kg.relations.items()}
+
+    def label2pid(self, label):
+        self._call("label2pid")
+        return self.kg.relations.get(label, "Not Found!")
+
+    def qid2label(self, qid):
+        self._call("qid2label")
+        return self.kg.name(qid) or "Not Found!"
+
+    def get_all_relations_of_an_entity(self, entity_qid):
+        self._call("get_all_relations_of_an_entity")
+        return {"head": [{"pid": self.kg.relations[label], "label": label} for label in self.kg.out_edges[entity_qid]],
+                "tail": [{"pid": self.kg.relations[label], "label": label} for label in self.kg.in_edges[entity_qid]]}
+
+    def get_tail_entities_given_head_and_relation(self, head_qid, relation_pid):
+        self._call("get_tail_entities_given_head_and_relation")
+        label = self.pid_to_label[relation_pid]
+        return {"head": [{"qid": qid, "label": self.kg.name(qid) or "N/A"} for qid in self.kg.in_edges[head_qid][label]],
+                "tail": [{"qid": qid, "label": self.kg.name(qid) or "N/A"} for qid in self.kg.out_edges[head_qid][label]]}
+
+    def get_tail_values_given_head_and_relation(self, head_qid, relation_pid):
+        self._call("get_tail_values_given_head_and_relation")
+        return []
+
+    def call_many(self, method, args_list):
+        self._call(MANY_METHODS.get(method, "system.multicall"))
+        self._batch.active = True
+        try:
+            return [getattr(self, method)(*args) for args in args_list]
+        finally:
+            self._batch.active = False
+
+
+class MockWikidataClient(MultiServerWikidataQueryClient):
+    """MultiServerWikidataQueryClient over mock servers, so query_all merges their results as usual."""
+
+    def __init__(self, servers):
+        self.clients = servers
+        self.executor = ThreadPoolExecutor(max_workers=len(servers))
+        self._turn = itertools.count()
+        self.label_clients = self.link_clients = servers
+        self.shards = None
+
+
+def make_questions(kg, num_questions, seed=0):
+    rng = random.Random(seed)
+    entities = kg.topic_entities()
+    datas = []
+    for i in range(num_questions):
+        entity = rng.choice(entities)
+        datas.append({"question": "Benchmark question %d about %s?" % (i, kg.name(entity)),
+                      "topic_entity": {entity: kg.name(entity)}})
+    return datas
+
+
+def run_backend(backend, kg, datas, args):
+    """Answer every question through the solve_question of main_`backend` and return the run statistics."""
+    llm = MockLLM(args.llm_latency_ms, args.yes_rate)
+    set_llm_client(llm)
+    if backend == "freebase":
+        import main_freebase
+        kg_client = MockSparqlClient(kg, args.kg_latency_ms)
+        set_sparql_client(kg_client)
+        solve = partial(main_freebase.solve_question, question_string="question", args=args)
+    else:
+        import main_wiki
+        kg_client = MockWikidataServer(kg, args.kg_latency_ms)
+        solve = partial(main_wiki.solve_question, question_string="question", args=args,
+                        wiki_client=MockWikidataClient([kg_client]))
+    solve = question_boundary(traced_question(solve, "question"))
+
+    def timed(data):
+        start = time.perf_counter()
+        solve(data)
+        return time.perf_counter() - start
+
+    with open(os.devnull, "w") as devnull, contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        latencies = list(run_ordered(timed, datas, args.concurrency))
+        elapsed = time.perf_counter() - start
+    return {
+        "backend": backend,
+        "questions": len(datas),
+        "seconds": elapsed,
+        "questions_per_sec": len(datas) / elapsed,
+        "p50_ms": 1000 * float(np.percentile(latencies, 50)),
+        "p99_ms": 1000 * float(np.percentile(latencies, 99)),
+        "llm_calls": dict(llm.calls),
+        "llm_batches": llm.batches,
+        "kg_calls": dict(kg_client.calls),
+    }
+
+
+def report(stats):
+    print("[%s] %d questions in %.2fs, %.1f questions/s, latency p50 %.1fms p99 %.1fms" % (
+        stats["backend"], stats["questions"], stats["seconds"], stats["questions_per_sec"], stats["p50_ms"], stats["p99_ms"]))
+    for name in ("llm_calls", "kg_calls"):
+        calls = stats[name]
+        print("  %-9s %6d  (%s)" % (name, sum(calls.values()), ", ".join("%s %d" % item for item in sorted(calls.items()))))
+    if stats["llm_batches"]:
+        print("  llm_batches %4d" % stats["llm_batches"])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the ToG search loop against a mock LLM and an in-memory KG.")
+    parser.add_argument("--backend", type=str,
+                        default="both", help="flow to benchmark, can be freebase, wiki or both.")
+    parser.add_argument("--kg", type=str,
+                        default="", help="tab-separated file of head/relation/tail triples and id/name lines, empty for a synthetic KG.")
+    parser.add_argument("--kg_entities", type=int,
+                        default=2000, help="number of entities of the synthetic KG.")
+    parser.add_argument("--kg_relations", type=int,
+                        default=50, help="number of relations of the synthetic KG.")
+    parser.add_argument("--kg_degree", type=int,
+                        default=6, help="outgoing edges per entity of the synthetic KG.")
+    parser.add_argument("--questions", type=int,
+                        default=100, help="number of questions, each on a random topic entity.")
+    parser.add_argument("--llm_latency_ms", type=float,
+                        default=0, help="latency of every mock LLM call.")
+    parser.add_argument("--kg_latency_ms", type=float,
+                        default=0, help="latency of every mock SPARQL query or Wikidata RPC.")
+    parser.add_argument("--yes_rate", type=float,
+                        default=0.3, help="share of reasoning calls the mock LLM answers with {Yes}.")
+    parser.add_argument("--seed", type=int,
+                        default=0, help="seed of the synthetic KG, the questions and the seeded entity sampling.")
+    parser.add_argument("--output", type=str,
+                        default="", help="also write the statistics as JSON to this file, to compare runs.")
+    parser.add_argument("--verbose", action="store_true",
+                        help="keep the progress prints of the search.")
+    parser.add_argument("--max_length", type=int,
+                        default=256, help="the max length of LLMs output.")
+    parser.add_argument("--temperature_exploration", type=float,
+                        default=0.4, help="the temperature in exploration stage.")
+    parser.add_argument("--temperature_reasoning", type=float,
+                        default=0, help="the temperature in reasoning stage.")
+    parser.add_argument("--width", type=int,
+                        default=3, help="choose the search width of ToG.")
+    parser.add_argument("--depth", type=int,
+                        default=3, help="choose the search depth of ToG.")
+    parser.add_argument("--num_retain_entity", type=int,
+                        default=5, help="Number of entities retained during entities search.")
+    parser.add_argument("--entity_sampling", type=str,
+                        default="seeded", help="which candidates are kept for relations with many entities, can be random, seeded or ordered.")
+    parser.add_argument("--concurrency", type=int,
+                        default=1, help="number of questions searched at the same time.")
+    parser.add_argument("--fanout_workers", type=int,
+                        default=8, help="number of relation prune / entity score calls of one depth issued at the same time.")
+    add_batching_args(parser)
+    add_tracing_args(parser)
+    args = parser.parse_args()
+    # fixed settings of the search loop, the LLM is always the mock
+    args.remove_unnecessary_rel = True
+    args.LLM_type = "mock"
+    args.opeani_api_keys = ""
+    args.prune_tools = "llm"
+    init_batching(args)
+    init_tracing(args)
+
+    kg = MockKG.load(args.kg) if args.kg else MockKG.synthetic(args.kg_entities, args.kg_relations, args.kg_degree, args.seed)
+    datas = make_questions(kg, args.questions, args.seed)
+    backends = ["freebase", "wiki"] if args.backend == "both" else [args.backend]
+    results = []
+    for backend in backends:
+        stats = run_backend(backend, kg, datas, args)
+        results.append(stats)
+        report(stats)
+        close_batchers()
+
+    close_tracing()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
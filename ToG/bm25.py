@@ -0,0 +1,70 @@
+import functools
+
+import numpy as np
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a fixed corpus, scoring like rank_bm25.BM25Okapi (same tokenizer,
+    idf and epsilon floor) but with the corpus statistics precomputed as NumPy arrays.
+
+    Postings are stored term-major (CSC style): for term t, post_doc[term_ptr[t]:term_ptr[t+1]]
+    are the documents containing it and post_weight the matching idf * tf saturation,
+    so scoring a query is one bincount over the postings of its terms.
+    """
+
+    def __init__(self, corpus, k1=1.5, b=0.75, epsilon=0.25):
+        self.corpus = list(corpus)
+        n_docs = len(self.corpus)
+        self.vocab = {}
+        term_ids, doc_ids = [], []
+        doc_len = np.zeros(n_docs, dtype=np.float64)
+        for doc_id, doc in enumerate(self.corpus):
+            tokens = doc.split(" ")
+            doc_len[doc_id] = len(tokens)
+            for token in tokens:
+                term_ids.append(self.vocab.setdefault(token, len(self.vocab)))
+                doc_ids.append(doc_id)
+        n_terms = len(self.vocab)
+
+        # term frequency of every (term, doc) pair, sorted by term then doc
+        pairs, tf = np.unique(np.array(term_ids, dtype=np.int64) * max(n_docs, 1) + np.array(doc_ids, dtype=np.int64), return_counts=True)
+        post_term = pairs // max(n_docs, 1)
+        self.post_doc = pairs % max(n_docs, 1)
+        self.term_ptr = np.searchsorted(post_term, np.arange(n_terms + 1))
+
+        df = np.diff(self.term_ptr)
+        idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5)
+        if n_terms:
+            idf[idf < 0] = epsilon * idf.mean()
+        self.idf = idf
+
+        avgdl = doc_len.mean() if n_docs else 0.0
+        norm = k1 * (1 - b + b * doc_len / avgdl) if n_docs else doc_len
+        self.post_weight = idf[post_term] * tf * (k1 + 1) / (tf + norm[self.post_doc])
+
+    def _query_postings(self, query):
+        ranges = [(self.term_ptr[t], self.term_ptr[t + 1]) for t in (self.vocab.get(token) for token in query.split(" ")) if t is not None]
+        if not ranges:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(start, end) for start, end in ranges])
+
+    def get_scores(self, query):
+        postings = self._query_postings(query)
+        return np.bincount(self.post_doc[postings], weights=self.post_weight[postings], minlength=len(self.corpus))
+
+    def top_k(self, query, k):
+        """Return the indices and scores of the k best documents, best first."""
+        scores = self.get_scores(query)
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), scores[:0]
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return top, scores[top]
+
+
+@functools.lru_cache(maxsize=4096)
+def get_bm25_index(corpus):
+    """BM25Index of a corpus tuple, reused when the same candidates come back (e.g. the relations of a hub entity)."""
+    return BM25Index(corpus)
@@ -0,0 +1,68 @@
+import argparse
+import json
+import os
+
+import numpy as np
+from tqdm import tqdm
+
+from embedding import DEFAULT_MODEL, RelationIndex, get_sentence_model
+
+sparql_all_relations = """SELECT DISTINCT ?relation\nWHERE {\n  ?x ?relation ?y .\n}"""
+
+
+def freebase_relations():
+    from freebase_func import SPARQLPATH
+    from sparql_client import SparqlClient
+    client = SparqlClient(SPARQLPATH, timeout=3600)
+    results = client.query(sparql_all_relations)
+    relations = [result['relation']['value'] for result in results]
+    return [relation.replace("http://rdf.freebase.com/ns/", "") for relation in relations if relation.startswith("http://rdf.freebase.com/ns/")]
+
+
+def wikidata_relations(plabels_dir):
+    labels = []
+    for filename in sorted(os.listdir(plabels_dir)):
+        with open(os.path.join(plabels_dir, filename), encoding="utf-8") as f:
+            for line in f:
+                line = line.strip().rstrip(",")
+                if len(line) >= 3:
+                    labels.append(json.loads(line)["label"])
+    return labels
+
+
+def file_relations(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Embed a whole relation vocabulary once for the sentencebert prune tool.")
+    parser.add_argument("--source", type=str,
+                        default="freebase", help="freebase (every predicate of the SPARQL endpoint), wikidata (a plabels directory) or file (one relation per line).")
+    parser.add_argument("--input", type=str,
+                        default="", help="plabels directory for wikidata, relation list for file.")
+    parser.add_argument("--output", type=str,
+                        default="relation_index", help="file prefix of the index.")
+    parser.add_argument("--dtype", type=str,
+                        default="float32", help="float32, or int8 to quantize each row with its own scale.")
+    parser.add_argument("--batch_size", type=int,
+                        default=512, help="number of relations encoded at once.")
+    args = parser.parse_args()
+
+    if args.source == "freebase":
+        relations = freebase_relations()
+    elif args.source == "wikidata":
+        relations = wikidata_relations(args.input)
+    else:
+        relations = file_relations(args.input)
+    relations = sorted(set(relations))
+    print(f"Embedding {len(relations)} relations with {DEFAULT_MODEL}")
+
+    model = get_sentence_model(DEFAULT_MODEL)
+    embeddings = []
+    for start in tqdm(range(0, len(relations), args.batch_size)):
+        embeddings.append(np.asarray(model.encode(relations[start:start + args.batch_size]), dtype=np.float32))
+    embeddings = np.concatenate(embeddings) if embeddings else np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+
+    RelationIndex.save(args.output, relations, embeddings, DEFAULT_MODEL, args.dtype)
+    print(f"Saved {embeddings.shape} {args.dtype} index to {args.output}.npy")
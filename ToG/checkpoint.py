@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+
+from result_writer import read_lines
+
+
+def load_answered_questions(path, question_key="question"):
+    """
+    Questions already saved in a JSONL output file (plain, .gz or .zst). A truncated
+    last line (the run was killed while writing it) is ignored, so that question is
+    run again.
+    """
+    answered = set()
+    for line in read_lines(path):
+        try:
+            answered.add(json.loads(line)[question_key])
+        except (ValueError, KeyError):
+            continue
+    return answered
+
+
+class BeamCheckpoint:
+    """
+    Append-only JSONL log of the search state of unfinished questions.
+
+    After every depth that did not end the search, the state needed to start the
+    next depth (topic entities, retained relations and heads, reasoning chains so
+    far) is appended for the question; a finished question gets a "done" record.
+    Loading keeps the last state of each unfinished question, so a restarted run
+    continues at the depth it was preempted in. The log is compacted on load.
+
+    Parameters:
+    - path (str): checkpoint file.
+    - resume (bool): load the states of the previous run, False starts a new log.
+    """
+
+    def __init__(self, path, resume=True):
+        self.path = path
+        self._states = {}
+        self._lock = threading.Lock()
+        if resume and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # truncated by a crash
+                    if record.get("done"):
+                        self._states.pop(record["question"], None)
+                    else:
+                        self._states[record["question"]] = record
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            for record in self._states.values():
+                f.write(json.dumps(record, default=list) + "\n")
+        os.replace(path + ".tmp", path)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def __len__(self):
+        return len(self._states)
+
+    def get(self, question):
+        """Last saved state of a question, None when it has to start from depth 1."""
+        with self._lock:
+            return self._states.get(question)
+
+    def save(self, question, depth, topic_entity, pre_relations, pre_heads, cluster_chain_of_entities):
+        """Record the state reached after `depth`, from which depth + 1 starts."""
+        record = {"question": question, "depth": depth, "topic_entity": topic_entity, "pre_relations": pre_relations,
+                  "pre_heads": pre_heads, "cluster_chain_of_entities": cluster_chain_of_entities}
+        with self._lock:
+            self._states[question] = record
+            self._file.write(json.dumps(record, default=list) + "\n")
+            self._file.flush()
+
+    def finish(self, question):
+        """Drop the state of a question whose result has been saved."""
+        with self._lock:
+            if self._states.pop(question, None) is not None:
+                self._file.write(json.dumps({"question": question, "done": True}) + "\n")
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+_checkpoint = None
+
+
+def add_checkpoint_args(parser):
+    parser.add_argument("--resume", action="store_true",
+                        help="skip the questions already in the output file and continue unfinished ones from their last depth.")
+    parser.add_argument("--checkpoint_path", type=str,
+                        default="", help="file logging the per-depth search state, defaults to the output file with a .ckpt suffix.")
+
+
+def init_checkpoint(args, output_path):
+    """Open the beam checkpoint of a run, continuing the previous one with --resume."""
+    global _checkpoint
+    _checkpoint = BeamCheckpoint(args.checkpoint_path or output_path + ".ckpt", args.resume)
+    if args.resume:
+        print("Resuming %d unfinished questions from %s" % (len(_checkpoint), _checkpoint.path))
+    return _checkpoint
+
+
+def get_checkpoint():
+    return _checkpoint
+
+
+def skip_answered(datas, question_string, output_path):
+    """Drop the questions of a dataset already saved in output_path."""
+    answered = load_answered_questions(output_path)
+    remaining = [data for data in datas if data[question_string] not in answered]
+    print("Skipping %d answered questions, %d left" % (len(datas) - len(remaining), len(remaining)))
+    return remaining
+
+
+def close_checkpoint():
+    if _checkpoint is not None:
+        _checkpoint.close()
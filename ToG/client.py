@@ -1,12 +1,53 @@
 import itertools
+import threading
 import xmlrpc.client
+import zlib
 import typing as tp
 from concurrent.futures import ThreadPoolExecutor
 
+from tracing import count, span
+
+# Lookups keyed by an entity (or a mid) are answered by the shard owning that key
+# when the servers run a hash-partitioned index.
+KEYED_METHODS = [
+    "get_all_relations_of_an_entity",
+    "get_tail_entities_given_head_and_relation",
+    "get_tail_values_given_head_and_relation",
+    "get_external_id_given_head_and_relation",
+    "mid2qid",
+]
+# Label tables are not chunked, any one server holding them answers these.
+LABEL_METHODS = ["label2qid", "label2pid", "qid2label", "pid2label"]
+# Server-side batch variants, taking a list of keys (or of [head, pid] pairs).
+# Other methods are batched with system.multicall.
+MANY_METHODS = {
+    "qid2label": "qid2label_many",
+    "get_all_relations_of_an_entity": "get_all_relations_many",
+    "get_tail_entities_given_head_and_relation": "get_tail_entities_many",
+}
+
+
+def shard_of(key: str, num_shards: int) -> int:
+    """Same as Wikidata/simple_wikidata_db/db_deploy/partition.py."""
+    return zlib.crc32(key.encode("utf-8")) % num_shards
+
+
 class WikidataQueryClient:
     def __init__(self, url: str):
         self.url = url
-        self.server = xmlrpc.client.ServerProxy(url)
+        self._local = threading.local()
+        # methods of the server from system.listMethods, None until known
+        self.methods = None
+
+    @property
+    def server(self) -> xmlrpc.client.ServerProxy:
+        # ServerProxy keeps one connection per instance and is not thread-safe,
+        # so every thread gets its own proxy.
+        proxy = getattr(self._local, "server", None)
+        if proxy is None:
+            proxy = xmlrpc.client.ServerProxy(self.url)
+            self._local.server = proxy
+        return proxy
 
     def label2qid(self, label: str) -> str:
         return self.server.label2qid(label)
@@ -49,6 +90,29 @@ class WikidataQueryClient:
     def mid2qid(self, mid: str) -> str:
         return self.server.mid2qid(mid)
 
+    def shard_info(self) -> tp.Dict[str, tp.Any]:
+        return self.server.shard_info()
+
+    def supports(self, method: str) -> bool:
+        return self.methods is None or method in self.methods
+
+    def call_many(self, method: str, args_list: tp.List[tuple]) -> tp.List:
+        """
+        Results of method(*args) for every args in args_list, in one request when
+        the server has a *_many variant or system.multicall (servers older than
+        them get one request per args).
+        """
+        many = MANY_METHODS.get(method)
+        if many is not None and self.supports(many):
+            keys = [args[0] if len(args) == 1 else list(args) for args in args_list]
+            return getattr(self.server, many)(keys)
+        if not self.supports("system.multicall"):
+            return [getattr(self.server, method)(*args) for args in args_list]
+        multicall = xmlrpc.client.MultiCall(self.server)
+        for args in args_list:
+            getattr(multicall, method)(*args)
+        return list(multicall())
+
 
 import time
 import typing as tp
@@ -56,20 +120,29 @@ from concurrent.futures import ThreadPoolExecutor
 
 
 class MultiServerWikidataQueryClient:
-    def __init__(self, urls: tp.List[str]):
+    def __init__(self, urls: tp.List[str], max_workers: int = 0):
+        """
+        max_workers: threads sending requests to several servers at once, shared
+        by all callers, e.g. the number of questions times the fan-out workers
+        of each. At least one per server.
+        """
         self.clients = [WikidataQueryClient(url) for url in urls]
-        self.executor = ThreadPoolExecutor(max_workers=len(urls))
+        self.executor = ThreadPoolExecutor(max_workers=max(len(urls), max_workers))
         # test connections
         start_time = time.perf_counter()
         self.test_connections()
         end_time = time.perf_counter()
         print(f"Connection testing took {end_time - start_time} seconds")
+        self._turn = itertools.count()
+        self.label_clients, self.link_clients, self.shards = self.discover_shards()
+        if self.shards is not None:
+            print(f"Routing lookups to {len(self.shards)} hash partitioned shards")
 
     def test_connections(self):
         def test_url(client):
             try:
                 # Check if server provides the system.listMethods function.
-                client.server.system.listMethods()
+                client.methods = set(client.server.system.listMethods())
                 return True
             except Exception as e:
                 print(f"Failed to connect to {client.url}. Error: {str(e)}")
@@ -89,22 +162,112 @@ class MultiServerWikidataQueryClient:
         if not self.clients:
             raise Exception("Failed to connect to all URLs")
 
-    def query_all(self, method, *args):
-        start_time = time.perf_counter()
-        futures = [
-            self.executor.submit(getattr(client, method), *args)
-            for client in self.clients
+    def discover_shards(
+        self,
+    ) -> tp.Tuple[
+        tp.List[WikidataQueryClient],
+        tp.List[WikidataQueryClient],
+        tp.Optional[tp.List[tp.List[WikidataQueryClient]]],
+    ]:
+        """
+        The servers holding the label tables, the servers holding index chunks,
+        and the chunk servers of every shard of a hash-partitioned index. The
+        shards are None when the index is chunked by file order (or a shard is
+        missing) and chunk lookups have to be broadcast.
+        """
+        try:
+            infos = [
+                f.result()
+                for f in [
+                    self.executor.submit(client.shard_info) for client in self.clients
+                ]
+            ]
+        except xmlrpc.client.Fault:
+            # servers older than shard_info hold both
+            return self.clients, self.clients, None
+        label_clients = [
+            client for client, info in zip(self.clients, infos) if info.get("labels", True)
         ]
+        links = [
+            (client, info)
+            for client, info in zip(self.clients, infos)
+            if info.get("links", True)
+        ]
+        link_clients = [client for client, _ in links]
+        if not label_clients or not link_clients:
+            raise Exception("Need at least one label server and one chunk server")
+        schemes = {(info["scheme"], info["num_shards"]) for _, info in links}
+        if len(schemes) != 1:
+            return label_clients, link_clients, None
+        scheme, num_shards = schemes.pop()
+        if scheme != "crc32":
+            return label_clients, link_clients, None
+        shards = [[] for _ in range(num_shards)]
+        for client, info in links:
+            shards[info["shard"]].append(client)
+        if not all(shards):
+            print("Not every shard has a server, broadcasting queries")
+            return label_clients, link_clients, None
+        return label_clients, link_clients, shards
+
+    def _targets(self, method, args) -> tp.List[WikidataQueryClient]:
+        if method in LABEL_METHODS:
+            replicas = self.label_clients
+        elif method not in KEYED_METHODS:
+            return self.clients
+        elif self.shards is None:
+            return self.link_clients
+        else:
+            replicas = self.shards[shard_of(args[0], len(self.shards))]
+        return [replicas[next(self._turn) % len(replicas)]]
+
+    def query_all(self, method, *args):
+        targets = self._targets(method, args)
+        count(wikidata_rpcs=len(targets))
+        with span("wikidata_rpc", method=method):
+            results = self._run([(getattr(client, method), args) for client in targets])
+        return self._merge(method, results)
+
+    def _run(self, calls):
+        """Results of func(*args) for every (func, args), on the executor when there are several."""
+        if len(calls) == 1:
+            # the caller's own thread (and per-thread proxy), no executor hand-off
+            func, args = calls[0]
+            return [func(*args)]
+        futures = [self.executor.submit(func, *args) for func, args in calls]
+        return [f.result() for f in futures]
+
+    def query_many(self, method, args_list):
+        """
+        query_all(method, *args) for every args in args_list, with one request
+        per server: the keys are grouped by the servers they are routed to.
+        """
+        groups = {}
+        for i, args in enumerate(args_list):
+            for client in self._targets(method, args):
+                groups.setdefault(client, []).append(i)
+        count(wikidata_rpcs=len(groups))
+        with span("wikidata_rpc", method=method, keys=len(args_list)):
+            batches = self._run(
+                [
+                    (client.call_many, (method, [args_list[i] for i in indices]))
+                    for client, indices in groups.items()
+                ]
+            )
+            results = [[] for _ in args_list]
+            for indices, batch in zip(groups.values(), batches):
+                for i, res in zip(indices, batch):
+                    results[i].append(res)
+        return [self._merge(method, res) for res in results]
+
+    @staticmethod
+    def _merge(method, results):
         # Retrieve results and filter out 'Not Found!'
         is_dict_return = method in [
             "get_all_relations_of_an_entity",
             "get_tail_entities_given_head_and_relation",
         ]
-        results = [f.result() for f in futures]
-        end_time = time.perf_counter()
-        # print(f"HTTP Queries took {end_time - start_time} seconds")
 
-        start_time = time.perf_counter()
         real_results = set() if not is_dict_return else {"head": [], "tail": []}
         for res in results:
             if isinstance(res, str) and res == "Not Found!":
@@ -122,8 +285,6 @@ class MultiServerWikidataQueryClient:
                 real_results["tail"].extend(res["tail"])
             else:
                 real_results.add(res)
-        end_time = time.perf_counter()
-        # print(f"Querying all took {end_time - start_time} seconds")
 
         return real_results if len(real_results) > 0 else "Not Found!"
 
@@ -0,0 +1,69 @@
+import collections
+import contextvars
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run_ordered(func, items, concurrency=1):
+    """
+    Apply func to every item with up to `concurrency` calls in flight, yielding the
+    results in input order. At most 2 * concurrency items are submitted ahead of the
+    one being yielded, so long datasets are not materialised as futures all at once.
+    """
+    if concurrency <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = collections.deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= 2 * concurrency:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def question_boundary(solve):
+    """
+    Wrap a per-question function so that an exception only loses that question:
+    the traceback is printed and an empty list of records is returned instead.
+    """
+    def guarded(data):
+        try:
+            return solve(data)
+        except Exception:
+            print("question failed, skipped:\n" + traceback.format_exc())
+            return []
+    return guarded
+
+
+_fan_out_executor = None
+_fan_out_lock = threading.Lock()
+
+
+def _get_fan_out_executor(max_workers):
+    global _fan_out_executor
+    with _fan_out_lock:
+        if _fan_out_executor is None:
+            _fan_out_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fan_out")
+        return _fan_out_executor
+
+
+def fan_out(func, calls, max_workers):
+    """
+    Run func(*call) for every argument tuple in calls concurrently and return the
+    results in the order of calls.
+
+    All questions share one fan-out pool (sized by the first caller), separate from
+    the question pool of run_ordered, so a question waiting on its stage never
+    blocks the workers that serve it. func must not call fan_out itself. Each call
+    runs in a copy of the caller's context, so trace spans keep their question.
+    """
+    if max_workers <= 1 or len(calls) <= 1:
+        return [func(*call) for call in calls]
+    executor = _get_fan_out_executor(max_workers)
+    futures = [executor.submit(contextvars.copy_context().run, func, *call) for call in calls]
+    return [future.result() for future in futures]
@@ -0,0 +1,228 @@
+import collections
+import json
+import os
+import threading
+
+import numpy as np
+
+DEFAULT_MODEL = 'sentence-transformers/msmarco-distilbert-base-tas-b'
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_sentence_model(model_name=DEFAULT_MODEL):
+    """Load a SentenceTransformer once per process and share it between all callers."""
+    model = _models.get(model_name)
+    if model is None:
+        with _models_lock:
+            model = _models.get(model_name)
+            if model is None:
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(model_name)
+                _models[model_name] = model
+    return model
+
+
+class EmbeddingCache:
+    """
+    Bounded text -> embedding cache, so each relation label, entity name or question
+    is encoded at most once per run.
+
+    With a path the embeddings live in a float32 NumPy memmap of `capacity` rows
+    (plus a JSON file mapping text to row), which is reused by later runs. Once all
+    rows are taken the least recently used text gives up its row. Without a path it
+    is a plain in-memory LRU.
+
+    Parameters:
+    - model_name (str): SentenceTransformer used to encode missing texts.
+    - capacity (int): max number of cached embeddings.
+    - path (str): prefix of the persistent memmap files, empty to keep embeddings in memory only.
+    """
+
+    def __init__(self, model_name=DEFAULT_MODEL, capacity=200000, path=""):
+        self.model_name = model_name
+        self.capacity = capacity
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._rows = collections.OrderedDict()  # text -> row in the memmap, or embedding in memory
+        self._matrix = None
+        self._next_row = 0  # rows below it have been handed out, rows are reused once it reaches capacity
+        if path and os.path.exists(path + ".keys.json"):
+            with open(path + ".keys.json", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["model"] == model_name and meta["capacity"] == capacity:
+                self._matrix = np.memmap(path + ".f32", dtype=np.float32, mode="r+", shape=(capacity, meta["dim"]))
+                self._rows.update((text, row) for text, row in meta["keys"])
+                self._next_row = max(self._rows.values(), default=-1) + 1
+
+    def _ensure_matrix(self, dim):
+        if self._matrix is None and self.path:
+            self._matrix = np.memmap(self.path + ".f32", dtype=np.float32, mode="w+", shape=(self.capacity, dim))
+
+    def _store(self, text, embedding):
+        if not self.path:
+            self._rows[text] = embedding
+            self._rows.move_to_end(text)
+            if len(self._rows) > self.capacity:
+                self._rows.popitem(last=False)
+            return
+        if text in self._rows:
+            # stored by a concurrent encode of the same text since it was found missing
+            self._rows.move_to_end(text)
+            return
+        if self._next_row < self.capacity:
+            row = self._next_row
+            self._next_row += 1
+        else:
+            _, row = self._rows.popitem(last=False)
+        self._matrix[row] = embedding
+        self._rows[text] = row
+
+    def _lookup(self, text):
+        value = self._rows[text]
+        self._rows.move_to_end(text)
+        return self._matrix[value] if self.path else value
+
+    def encode(self, texts):
+        """Return a float32 matrix with one embedding row per text, encoding only the texts not cached."""
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        embeddings = {}
+        with self._lock:
+            for text in dict.fromkeys(texts):
+                if text in self._rows:
+                    embeddings[text] = np.array(self._lookup(text))
+            missing = [text for text in dict.fromkeys(texts) if text not in embeddings]
+            self.hits += len(embeddings)
+            self.misses += len(missing)
+        if missing:
+            new_embeddings = np.asarray(get_sentence_model(self.model_name).encode(missing), dtype=np.float32)
+            with self._lock:
+                self._ensure_matrix(new_embeddings.shape[1])
+                for text, embedding in zip(missing, new_embeddings):
+                    self._store(text, embedding)
+            embeddings.update(zip(missing, new_embeddings))
+        result = np.stack([embeddings[text] for text in texts])
+        return result[0] if single else result
+
+    def flush(self):
+        """Write the memmap and its text index to disk."""
+        if not self.path or self._matrix is None:
+            return
+        with self._lock:
+            self._matrix.flush()
+            meta = {"model": self.model_name, "capacity": self.capacity, "dim": self._matrix.shape[1], "keys": list(self._rows.items())}
+            with open(self.path + ".keys.json.tmp", "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(self.path + ".keys.json.tmp", self.path + ".keys.json")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+class RelationIndex:
+    """
+    Precomputed embeddings of a whole relation vocabulary, built offline by
+    build_relation_index.py and memory-mapped at run time.
+
+    Files of an index with prefix P:
+    - P.npy: (num_relations, dim) float32 or int8 matrix.
+    - P.scale.npy: per-row float32 scale of an int8 matrix (row = int8 row * scale).
+    - P.json: {"model": ..., "dtype": ..., "labels": [...]}, labels in row order.
+    """
+
+    def __init__(self, prefix):
+        with open(prefix + ".json", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.model_name = meta["model"]
+        self.dtype = meta["dtype"]
+        self.row_of = {label: row for row, label in enumerate(meta["labels"])}
+        self.matrix = np.load(prefix + ".npy", mmap_mode="r")
+        self.scale = np.load(prefix + ".scale.npy") if self.dtype == "int8" else None
+
+    @staticmethod
+    def save(prefix, labels, embeddings, model_name=DEFAULT_MODEL, dtype="float32"):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if dtype == "int8":
+            scale = np.abs(embeddings).max(axis=1) / 127.0
+            scale[scale == 0] = 1.0
+            np.save(prefix + ".npy", np.round(embeddings / scale[:, None]).astype(np.int8))
+            np.save(prefix + ".scale.npy", scale.astype(np.float32))
+        else:
+            np.save(prefix + ".npy", embeddings)
+        with open(prefix + ".json", "w", encoding="utf-8") as f:
+            json.dump({"model": model_name, "dtype": dtype, "labels": list(labels)}, f)
+
+    def score(self, query_embedding, labels, cache=None):
+        """
+        Dot product of the query embedding with every label, one matrix-vector product
+        over the indexed rows. Labels missing from the index are encoded through the
+        embedding cache.
+        """
+        scores = np.empty(len(labels), dtype=np.float32)
+        known = [i for i, label in enumerate(labels) if label in self.row_of]
+        if known:
+            rows = np.array([self.row_of[labels[i]] for i in known])
+            order = np.argsort(rows)  # ascending rows keep memmap reads sequential
+            subset = np.asarray(self.matrix[rows[order]], dtype=np.float32)
+            subset_scores = subset @ query_embedding
+            if self.scale is not None:
+                subset_scores *= self.scale[rows[order]]
+            scores[np.array(known)[order]] = subset_scores
+        unknown = [i for i, label in enumerate(labels) if label not in self.row_of]
+        if unknown:
+            cache = cache or get_embedding_cache()
+            scores[unknown] = cache.encode([labels[i] for i in unknown]) @ query_embedding
+        return scores
+
+
+_relation_index = None
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def add_embedding_cache_args(parser):
+    parser.add_argument("--embedding_cache_size", type=int,
+                        default=200000, help="max number of texts whose sentencebert embedding is cached.")
+    parser.add_argument("--embedding_cache_path", type=str,
+                        default="", help="file prefix persisting the sentencebert embeddings as a NumPy memmap, empty to disable.")
+    parser.add_argument("--relation_index", type=str,
+                        default="", help="file prefix of a relation embedding index built by build_relation_index.py, empty to disable.")
+
+
+def init_embedding_cache(args):
+    global _embedding_cache
+    global _relation_index
+    _embedding_cache = EmbeddingCache(DEFAULT_MODEL, args.embedding_cache_size, args.embedding_cache_path)
+    if args.relation_index:
+        _relation_index = RelationIndex(args.relation_index)
+        if _relation_index.model_name != DEFAULT_MODEL:
+            raise ValueError("relation index %s was built with %s, not %s" % (args.relation_index, _relation_index.model_name, DEFAULT_MODEL))
+    return _embedding_cache
+
+
+def get_embedding_cache():
+    global _embedding_cache
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                _embedding_cache = EmbeddingCache()
+    return _embedding_cache
+
+
+def get_relation_index():
+    return _relation_index
+
+
+def close_embedding_cache():
+    if _embedding_cache is not None:
+        _embedding_cache.flush()
+        stats = _embedding_cache.stats()
+        print("Embedding cache: %d hits, %d misses, hit rate %.2f%%" % (stats["hits"], stats["misses"], stats["hit_rate"] * 100))
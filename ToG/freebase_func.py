@@ -1,12 +1,23 @@
-from SPARQLWrapper import SPARQLWrapper, JSON
+from sparql_client import get_sparql_client
+from name_cache import get_name_cache
+from tracing import count
 SPARQLPATH = "http://xxx.xxx.xxx.xxx/sparql"  # depend on your own internal address and port, shown in Freebase folder's readme.md
 
 # pre-defined sparqls
-sparql_head_relations = """\nPREFIX ns: <http://rdf.freebase.com/ns/>\nSELECT ?relation\nWHERE {\n  ns:%s ?relation ?x .\n}"""
-sparql_tail_relations = """\nPREFIX ns: <http://rdf.freebase.com/ns/>\nSELECT ?relation\nWHERE {\n  ?x ?relation ns:%s .\n}"""
-sparql_tail_entities_extract = """PREFIX ns: <http://rdf.freebase.com/ns/>\nSELECT ?tailEntity\nWHERE {\nns:%s ns:%s ?tailEntity .\n}""" 
-sparql_head_entities_extract = """PREFIX ns: <http://rdf.freebase.com/ns/>\nSELECT ?tailEntity\nWHERE {\n?tailEntity ns:%s ns:%s  .\n}"""
+sparql_relations = """PREFIX ns: <http://rdf.freebase.com/ns/>\nSELECT DISTINCT ?relation ?head\nWHERE {\n  {\n    ns:%s ?relation ?x .\n    BIND(1 AS ?head)\n  }\n  UNION\n  {\n    ?x ?relation ns:%s .\n    BIND(0 AS ?head)\n  }\n%s}"""
+sparql_abandon_rels_filter = """  FILTER(?relation != ns:type.object.type && ?relation != ns:type.object.name && !STRSTARTS(STR(?relation), "http://rdf.freebase.com/ns/common.") && !STRSTARTS(STR(?relation), "http://rdf.freebase.com/ns/freebase.") && !CONTAINS(STR(?relation), "sameAs"))\n"""
+sparql_tail_entities_extract = """ns:%s ns:%s ?tailEntity ."""
+sparql_head_entities_extract = """?tailEntity ns:%s ns:%s ."""
+sparql_entities = """PREFIX ns: <http://rdf.freebase.com/ns/>\nSELECT ?tailEntity\nWHERE {\n  %s\n  FILTER(STRSTARTS(STR(?tailEntity), "http://rdf.freebase.com/ns/m."))\n}\n%s"""
+sparql_entities_count = """PREFIX ns: <http://rdf.freebase.com/ns/>\nSELECT (COUNT(?tailEntity) AS ?total)\nWHERE {\n  %s\n  FILTER(STRSTARTS(STR(?tailEntity), "http://rdf.freebase.com/ns/m."))\n}"""
+# ORDER BY clause of each entity sampling policy, seeded hashes the MIDs with the seed so the sample is reproducible
+sparql_entities_order = {
+    "random": "ORDER BY RAND()\n",
+    "seeded": "ORDER BY MD5(CONCAT(STR(?tailEntity), \"%s\"))\n",
+    "ordered": "ORDER BY ?tailEntity\n",
+}
 sparql_id = """PREFIX ns: <http://rdf.freebase.com/ns/>\nSELECT DISTINCT ?tailEntity\nWHERE {\n  {\n    ?entity ns:type.object.name ?tailEntity .\n    FILTER(?entity = ns:%s)\n  }\n  UNION\n  {\n    ?entity <http://www.w3.org/2002/07/owl#sameAs> ?tailEntity .\n    FILTER(?entity = ns:%s)\n  }\n}"""
+sparql_ids = """PREFIX ns: <http://rdf.freebase.com/ns/>\nSELECT DISTINCT ?entity ?tailEntity\nWHERE {\n  VALUES ?entity { %s }\n  {\n    ?entity ns:type.object.name ?tailEntity .\n  }\n  UNION\n  {\n    ?entity <http://www.w3.org/2002/07/owl#sameAs> ?tailEntity .\n  }\n}"""
     
 def check_end_word(s):
     words = [" ID", " code", " number", "instance of", "website", "URL", "inception", "image", " rate", " count"]
@@ -18,11 +29,28 @@ def abandon_rels(relation):
 
 
 def execurte_sparql(sparql_txt):
-    sparql = SPARQLWrapper(SPARQLPATH)
-    sparql.setQuery(sparql_txt)
-    sparql.setReturnFormat(JSON)
-    results = sparql.query().convert()
-    return results["results"]["bindings"]
+    count(sparql_queries=1)
+    return get_sparql_client(SPARQLPATH).query(sparql_txt)
+
+
+def relation_search(entity_id, remove_unnecessary_rel=True):
+    """
+    Fetch the distinct relations of an entity in both directions with one query.
+    With remove_unnecessary_rel the abandon_rels filter runs inside Virtuoso.
+
+    Returns:
+    - list of str, list of str: relations where the entity is the head, and where it is the tail.
+    """
+    rel_filter = sparql_abandon_rels_filter if remove_unnecessary_rel else ""
+    results = execurte_sparql(sparql_relations % (entity_id, entity_id, rel_filter))
+    head_relations, tail_relations = [], []
+    for result in results:
+        relation = result['relation']['value'].replace("http://rdf.freebase.com/ns/","")
+        if int(result['head']['value']):
+            head_relations.append(relation)
+        else:
+            tail_relations.append(relation)
+    return head_relations, tail_relations
 
 
 def replace_relation_prefix(relations):
@@ -33,12 +61,37 @@ def replace_entities_prefix(entities):
 
 
 def id2entity_name_or_type(entity_id):
+    name = get_name_cache().get(entity_id)
+    if name is not None:
+        return name
     sparql = sparql_id % (entity_id, entity_id)
-    sparql = SPARQLWrapper(SPARQLPATH)
-    sparql.setQuery(sparql)
-    sparql.setReturnFormat(JSON)
-    results = sparql.query().convert()
-    if len(results["results"]["bindings"])==0:
-        return "UnName_Entity"
+    results = execurte_sparql(sparql)
+    if len(results)==0:
+        name = "UnName_Entity"
     else:
-        return results["results"]["bindings"][0]['tailEntity']['value']
+        name = results[0]['tailEntity']['value']
+    get_name_cache().put_many({entity_id: name})
+    return name
+
+
+def ids2names(entity_ids, batch_size=200):
+    """
+    Resolve many MIDs with one SPARQL query per batch_size ids, using a VALUES clause.
+
+    Returns a dict mapping every given id to its name (or the first sameAs value, as
+    id2entity_name_or_type does), "UnName_Entity" when neither exists.
+    """
+    unique_ids = list(dict.fromkeys(entity_ids))
+    cached = get_name_cache().get_many(unique_ids)
+    missing_ids = [entity_id for entity_id in unique_ids if entity_id not in cached]
+    names = {}
+    for start in range(0, len(missing_ids), batch_size):
+        batch = missing_ids[start:start + batch_size]
+        results = execurte_sparql(sparql_ids % " ".join("ns:" + entity_id for entity_id in batch))
+        for result in results:
+            entity_id = result['entity']['value'].replace("http://rdf.freebase.com/ns/","")
+            names.setdefault(entity_id, result['tailEntity']['value'])
+    fetched = {entity_id: names.get(entity_id, "UnName_Entity") for entity_id in missing_ids}
+    get_name_cache().put_many(fetched)
+    cached.update(fetched)
+    return {entity_id: cached[entity_id] for entity_id in unique_ids}
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class LLMCacheMiss(KeyError):
+    """Raised in replay mode when a prompt has no cached response."""
+
+
+class LLMCache:
+    """
+    Persistent, content-addressed cache of LLM responses backed by SQLite.
+
+    Entries are keyed by a SHA-256 hash of (model, messages, temperature, max_tokens),
+    so identical prompts from any run of any dataset share one entry.
+
+    Parameters:
+    - path (str): SQLite file holding the cache.
+    - mode (str): "readwrite" stores new responses, "replay" only serves cached ones
+      and raises LLMCacheMiss for anything else.
+    - max_entries (int): evict the least recently used entries beyond this count (0 = unbounded).
+    - max_age (float): entries older than this many seconds are ignored and purged (0 = never expire).
+    """
+
+    MODES = ("readwrite", "replay")
+
+    def __init__(self, path, mode="readwrite", max_entries=0, max_age=0):
+        if mode not in self.MODES:
+            raise ValueError("unknown llm cache mode %r, pick from %s" % (mode, self.MODES))
+        self.path = path
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._puts_since_evict = 0
+        # access times of hits, written in batches instead of one commit per hit
+        self._accessed = {}
+
+        if mode == "replay":
+            if not os.path.exists(path):
+                raise FileNotFoundError("llm cache %s does not exist, nothing to replay." % path)
+            self._conn = sqlite3.connect("file:%s?mode=ro" % path, uri=True, check_same_thread=False)
+        else:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses(accessed_at)")
+            self._conn.commit()
+            self.evict()
+
+    @staticmethod
+    def make_key(model, messages, temperature, max_tokens):
+        payload = json.dumps([model, messages, float(temperature), int(max_tokens)], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, model, messages, temperature, max_tokens):
+        key = self.make_key(model, messages, temperature, max_tokens)
+        with self._lock:
+            row = self._conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.max_age and time.time() - row[1] > self.max_age:
+                row = None
+            if row is None:
+                self.misses += 1
+                if self.mode == "replay":
+                    raise LLMCacheMiss(key)
+                return None
+            self.hits += 1
+            if self.mode == "readwrite":
+                self._accessed[key] = time.time()
+                if len(self._accessed) >= 100:
+                    self._flush_accessed_locked()
+                    self._conn.commit()
+            return row[0]
+
+    def put(self, model, messages, temperature, max_tokens, response):
+        if self.mode == "replay":
+            return
+        key = self.make_key(model, messages, temperature, max_tokens)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            self._conn.commit()
+            self._puts_since_evict += 1
+            if self._puts_since_evict >= 100:
+                self._evict_locked()
+
+    def evict(self):
+        if self.mode == "replay":
+            return
+        with self._lock:
+            self._evict_locked()
+
+    def _flush_accessed_locked(self):
+        if self._accessed:
+            self._conn.executemany(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in self._accessed.items()],
+            )
+            self._accessed.clear()
+
+    def _evict_locked(self):
+        self._puts_since_evict = 0
+        # LRU eviction needs the access times of recent hits
+        self._flush_accessed_locked()
+        if self.max_age:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age,))
+        if self.max_entries:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        self._conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            if self.mode == "readwrite":
+                self._flush_accessed_locked()
+                self._conn.commit()
+            self._conn.close()
+
+
+_llm_cache = None
+
+
+def init_llm_cache(args):
+    """Open the process-wide cache from the --llm_cache* command line options (no-op if unset)."""
+    global _llm_cache
+    if getattr(args, "llm_cache", ""):
+        _llm_cache = LLMCache(args.llm_cache, args.llm_cache_mode, args.llm_cache_max_entries, args.llm_cache_max_age)
+    return _llm_cache
+
+
+def get_llm_cache():
+    return _llm_cache
+
+
+def add_llm_cache_args(parser):
+    parser.add_argument("--llm_cache", type=str,
+                        default="", help="path of the on-disk LLM response cache, empty to disable.")
+    parser.add_argument("--llm_cache_mode", type=str,
+                        default="readwrite", help="readwrite, or replay to only serve cached responses.")
+    parser.add_argument("--llm_cache_max_entries", type=int,
+                        default=0, help="max number of cached responses, 0 means unbounded.")
+    parser.add_argument("--llm_cache_max_age", type=float,
+                        default=0, help="max age in seconds of a cached response, 0 means never expire.")
+
+
+def report_llm_cache():
+    if _llm_cache is not None:
+        stats = _llm_cache.stats()
+        print("LLM cache: %d hits, %d misses, hit rate %.2f%%" % (stats["hits"], stats["misses"], stats["hit_rate"] * 100))
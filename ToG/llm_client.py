@@ -0,0 +1,367 @@
+import asyncio
+import hashlib
+import threading
+import time
+import weakref
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+from rate_limit import Backoff, CircuitBreaker, RateLimiter, RetryMetrics
+from tracing import count
+
+LOCAL_API_BASE = "http://localhost:8000/v1"  # your local llama server port
+SYSTEM_PROMPT = "You are an AI assistant that helps people find information."
+
+
+def build_messages(prompt, prefix=""):
+    """
+    Chat messages of a prompt. A static few-shot prefix goes into the leading system
+    message, so every request built from the same template starts with the same
+    tokens and the server can reuse their KV cache.
+    """
+    system = SYSTEM_PROMPT + "\n\n" + prefix if prefix else SYSTEM_PROMPT
+    return [{"role":"system","content":system}, {"role":"user","content":prompt}]
+
+
+def prefix_key(messages):
+    """Short hash of the leading message, sent with the request to tag its shared prefix."""
+    return hashlib.sha256(messages[0]["content"].encode("utf-8")).hexdigest()[:16]
+
+
+class PromptStats:
+    """
+    Prompt token accounting of one client. Tokens of a leading message that was
+    already sent before count as prefix-shared, the others as fresh (estimated at
+    ~4 characters per token). The prompt and cached tokens reported by the server
+    are summed too, when it reports them.
+    """
+
+    def __init__(self):
+        self.shared_tokens = 0
+        self.fresh_tokens = 0
+        self.server_prompt_tokens = 0
+        self.server_cached_tokens = 0
+        self._prefixes = set()
+        self._lock = threading.Lock()
+
+    def record(self, messages, usage):
+        key = prefix_key(messages)
+        prefix_tokens = len(messages[0]["content"]) // 4
+        rest_tokens = sum(len(message["content"]) for message in messages[1:]) // 4
+        with self._lock:
+            if key in self._prefixes:
+                self.shared_tokens += prefix_tokens
+            else:
+                self._prefixes.add(key)
+                self.fresh_tokens += prefix_tokens
+            self.fresh_tokens += rest_tokens
+        self.record_usage(usage)
+
+    def record_usage(self, usage):
+        """Add the prompt and cached tokens reported by the server for one request."""
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        with self._lock:
+            self.server_prompt_tokens += usage.prompt_tokens or 0
+            if details is not None:
+                self.server_cached_tokens += getattr(details, "cached_tokens", 0) or 0
+
+
+class LLMClient:
+    """
+    Reusable chat-completion client for one OpenAI-compatible endpoint.
+
+    The sync API keeps one pooled keep-alive HTTP client and the async API one per
+    event loop, the model name is discovered once (from /models, when not given),
+    and at most max_in_flight requests are sent at the same time per API (and per
+    event loop).
+
+    Parameters:
+    - api_base (str): endpoint URL, None for the OpenAI API.
+    - api_key (str): API key, "EMPTY" for local servers.
+    - model (str): model name, None to use the first model served by api_base.
+    - max_in_flight (int): max number of concurrent requests.
+    - timeout (float): request timeout in seconds.
+    - requests_per_sec (float), tokens_per_min (float): rate limits shared by all callers, 0 = unlimited.
+
+    Chat requests carry an X-Prompt-Prefix header with the hash of their leading
+    message (and a matching prompt_cache_key for the OpenAI API), so prefix-aware
+    servers and routers can send requests sharing a few-shot template to the same
+    KV cache.
+
+    Failed requests are retried with exponential backoff plus jitter (honouring
+    Retry-After), behind a circuit breaker that pauses all callers after repeated
+    failures. Client errors that a retry cannot fix (4xx other than 408/409/429) are raised.
+    """
+
+    def __init__(self, api_base=None, api_key="EMPTY", model=None, max_in_flight=16, timeout=600,
+                 requests_per_sec=0, tokens_per_min=0):
+        self.api_base = api_base
+        self.api_key = api_key
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.limiter = RateLimiter(requests_per_sec, tokens_per_min)
+        self.backoff = Backoff()
+        self.breaker = CircuitBreaker()
+        self.metrics = RetryMetrics()
+        self.prompt_stats = PromptStats()
+        self._model = model
+        self._model_lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(max_in_flight)
+        self._async_lock = threading.Lock()
+        self._async = weakref.WeakKeyDictionary()  # event loop -> (async client, semaphore)
+        limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+        self._client = OpenAI(base_url=api_base, api_key=api_key, max_retries=0, timeout=timeout,
+                              http_client=httpx.Client(limits=limits, timeout=timeout))
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self._client.models.list().data[0].id
+        return self._model
+
+    def _get_async(self):
+        # asyncio semaphores and httpx connections belong to the loop they were first used in,
+        # so every running loop (e.g. each asyncio.run) gets its own
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            pair = self._async.get(loop)
+            if pair is None:
+                limits = httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight)
+                client = AsyncOpenAI(base_url=self.api_base, api_key=self.api_key, max_retries=0, timeout=self.timeout,
+                                     http_client=httpx.AsyncClient(limits=limits, timeout=self.timeout))
+                pair = self._async[loop] = (client, asyncio.Semaphore(self.max_in_flight))
+            return pair
+
+    def _on_success(self, throttle_wait):
+        self.breaker.record_success()
+        self.metrics.record(requests=1, successes=1, throttle_wait=throttle_wait)
+
+    def _on_error(self, error, attempt, throttle_wait):
+        """Record a failed request and return how long to back off, raise if retrying cannot help."""
+        status = getattr(error, "status_code", None)
+        if status is not None and 400 <= status < 500 and status not in (408, 409, 429):
+            self.metrics.record(requests=1, error=type(error).__name__, throttle_wait=throttle_wait)
+            # the server answered, which also ends a half-open probe
+            self.breaker.record_success()
+            raise error
+        self.breaker.record_failure()
+        delay = self.backoff.delay(attempt, _retry_after(error))
+        self.metrics.record(requests=1, retries=1, error=type(error).__name__, throttle_wait=throttle_wait, backoff_wait=delay)
+        print("openai error (%s), retry in %.1fs" % (type(error).__name__, delay))
+        return delay
+
+    def _send(self, create, tokens):
+        """Call create() behind the circuit breaker and rate limits, retrying until it succeeds."""
+        attempt = 0
+        while True:
+            wait = self.breaker.wait_time()
+            if wait > 0:
+                time.sleep(wait)
+                continue
+            throttle_wait = self.limiter.reserve(tokens)
+            if throttle_wait > 0:
+                time.sleep(throttle_wait)
+            try:
+                with self._semaphore:
+                    response = create()
+            except Exception as error:
+                time.sleep(self._on_error(error, attempt, throttle_wait))
+                attempt += 1
+                continue
+            self._on_success(throttle_wait)
+            return response
+
+    def _prefix_tags(self, messages):
+        key = prefix_key(messages)
+        tags = {"extra_headers": {"X-Prompt-Prefix": key}}
+        if self.api_base is None:
+            tags["extra_body"] = {"prompt_cache_key": key}
+        return tags
+
+    def chat(self, messages, temperature, max_tokens):
+        """Send one chat completion and return the message content, retrying until it succeeds."""
+        model = self.model
+        tags = self._prefix_tags(messages)
+        response = self._send(lambda: self._client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            frequency_penalty=0,
+            presence_penalty=0,
+            **tags), estimate_tokens(messages, max_tokens))
+        self.prompt_stats.record(messages, response.usage)
+        _count_tokens(response.usage)
+        return response.choices[0].message.content
+
+    def complete_batch(self, batch, temperature, max_tokens, contexts=None):
+        """
+        Send several chat message lists as one /completions request (for servers such
+        as vLLM that accept a list of prompts) and return the completions in order.
+
+        The prompt stats are recorded like chat does. The token usage of the request
+        is split between the prompts by length and counted in contexts[i], the
+        context of the caller of prompt i, when given.
+        """
+        model = self.model
+        # /completions applies no chat template, the messages are sent as plain text
+        prompts = ["\n\n".join(message["content"] for message in messages) for messages in batch]
+        tokens = sum(len(prompt) // 4 + max_tokens for prompt in prompts)
+        response = self._send(lambda: self._client.completions.create(
+            model=model,
+            prompt=prompts,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            frequency_penalty=0,
+            presence_penalty=0), tokens)
+        texts = [None] * len(prompts)
+        for choice in response.choices:
+            texts[choice.index] = choice.text
+        for messages in batch:
+            self.prompt_stats.record(messages, None)
+        usage = response.usage
+        self.prompt_stats.record_usage(usage)
+        if usage is not None:
+            prompt_chars = sum(len(prompt) for prompt in prompts) or 1
+            text_chars = sum(len(text or "") for text in texts) or 1
+            for i, (prompt, text) in enumerate(zip(prompts, texts)):
+                counts = dict(prompt_tokens=round((usage.prompt_tokens or 0) * len(prompt) / prompt_chars),
+                              completion_tokens=round((usage.completion_tokens or 0) * len(text or "") / text_chars))
+                if contexts is not None:
+                    contexts[i].run(count, **counts)
+                else:
+                    count(**counts)
+        return texts
+
+    async def achat(self, messages, temperature, max_tokens):
+        """Async version of chat, sharing the rate limits and circuit breaker of the sync API."""
+        model = await asyncio.to_thread(lambda: self.model)
+        client, semaphore = self._get_async()
+        tags = self._prefix_tags(messages)
+        attempt = 0
+        while True:
+            wait = self.breaker.wait_time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            throttle_wait = self.limiter.reserve(estimate_tokens(messages, max_tokens))
+            if throttle_wait > 0:
+                await asyncio.sleep(throttle_wait)
+            try:
+                async with semaphore:
+                    response = await client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        frequency_penalty=0,
+                        presence_penalty=0,
+                        **tags)
+            except Exception as error:
+                await asyncio.sleep(self._on_error(error, attempt, throttle_wait))
+                attempt += 1
+                continue
+            self._on_success(throttle_wait)
+            self.prompt_stats.record(messages, response.usage)
+            _count_tokens(response.usage)
+            return response.choices[0].message.content
+
+
+def estimate_tokens(messages, max_tokens):
+    """Rough token cost of a request for the tokens/min bucket: ~4 characters per prompt token plus the completion budget."""
+    return sum(len(message["content"]) for message in messages) // 4 + max_tokens
+
+
+def _count_tokens(usage):
+    if usage is not None:
+        count(prompt_tokens=usage.prompt_tokens or 0, completion_tokens=usage.completion_tokens or 0)
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        return None  # HTTP-date form, fall back to the backoff delay
+    return None
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_client_options = {"api_base": LOCAL_API_BASE, "max_in_flight": 16, "requests_per_sec": 0, "tokens_per_min": 0}
+_client_override = None
+
+
+def add_llm_client_args(parser):
+    parser.add_argument("--llm_api_base", type=str,
+                        default=LOCAL_API_BASE, help="OpenAI-compatible endpoint of the local model server.")
+    parser.add_argument("--llm_max_in_flight", type=int,
+                        default=16, help="max number of LLM requests in flight at the same time.")
+    parser.add_argument("--llm_rps", type=float,
+                        default=0, help="max LLM requests per second, 0 means unlimited.")
+    parser.add_argument("--llm_tpm", type=float,
+                        default=0, help="max LLM tokens (prompt + completion budget) per minute, 0 means unlimited.")
+
+
+def init_llm_client(args):
+    _client_options["api_base"] = args.llm_api_base
+    _client_options["max_in_flight"] = args.llm_max_in_flight
+    _client_options["requests_per_sec"] = args.llm_rps
+    _client_options["tokens_per_min"] = args.llm_tpm
+
+
+def set_llm_client(client):
+    """Serve every engine with `client` (e.g. a mock LLM for benchmarks), None restores the real clients."""
+    global _client_override
+    _client_override = client
+
+
+def get_llm_client(engine, opeani_api_keys):
+    """
+    Shared client for an engine name: models without "llama" in their name are served
+    by the local server (model discovered from it), the others by the OpenAI API.
+    """
+    if _client_override is not None:
+        return _client_override
+    if "llama" not in engine.lower():
+        key = ("local", _client_options["api_base"])
+    else:
+        key = ("openai", engine, opeani_api_keys)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                limits = dict(max_in_flight=_client_options["max_in_flight"], requests_per_sec=_client_options["requests_per_sec"],
+                              tokens_per_min=_client_options["tokens_per_min"])
+                if key[0] == "local":
+                    client = LLMClient(_client_options["api_base"], "EMPTY", None, **limits)
+                else:
+                    client = LLMClient(None, opeani_api_keys, engine, **limits)
+                _clients[key] = client
+    return client
+
+
+def report_llm_client():
+    for client in list(_clients.values()):
+        metrics = client.metrics.snapshot()
+        print("LLM %s: %d requests, %d ok, %d retries %s, circuit opened %d times, waited %.1fs throttled / %.1fs backing off" % (
+            client.api_base or "openai", metrics["requests"], metrics["successes"], metrics["retries"], metrics["errors"],
+            client.breaker.opens, metrics["throttle_wait"], metrics["backoff_wait"]))
+        stats = client.prompt_stats
+        estimated = stats.shared_tokens + stats.fresh_tokens
+        if estimated:
+            print("LLM %s prompts: ~%d tokens prefix-shared, ~%d fresh (%.1f%% shared), server reported %d cached of %d prompt tokens" % (
+                client.api_base or "openai", stats.shared_tokens, stats.fresh_tokens, 100.0 * stats.shared_tokens / estimated,
+                stats.server_cached_tokens, stats.server_prompt_tokens))
@@ -1,11 +1,132 @@
 from tqdm import tqdm
 import argparse
 import random
+from functools import partial
 
-from Wikidata.simple_wikidata_db import db_deploy
-from Wikidata.simple_wikidata_db.db_deploy.client import WikidataQueryClient
 from wiki_func import *
 from client import *
+from concurrency import run_ordered, question_boundary, fan_out
+from llm_cache import add_llm_cache_args, init_llm_cache, report_llm_cache
+from llm_client import add_llm_client_args, init_llm_client, report_llm_client
+from batcher import add_batching_args, init_batching, close_batchers
+from checkpoint import add_checkpoint_args, init_checkpoint, get_checkpoint, skip_answered, close_checkpoint
+from result_writer import add_result_writer_args, init_result_writer, get_result_writer, close_result_writers
+from tracing import add_tracing_args, init_tracing, traced_question, span, close_tracing
+
+
+def search_and_score(question, entity, args, wiki_client, prefetched=None):
+    """Expand one retained relation and score its candidate entities or values, None if nothing was found."""
+    value_flag=False
+    with span("entity_search"):
+        if entity['head']:
+            entity_candidates_id, entity_candidates_name = entity_search(entity['entity'], entity['relation'], wiki_client, True, prefetched)
+        else:
+            entity_candidates_id, entity_candidates_name = entity_search(entity['entity'], entity['relation'], wiki_client, False, prefetched)
+
+    if len(entity_candidates_id) ==0: # values
+        value_flag=True
+        if len(entity_candidates_name) >=20:
+            entity_candidates_name = random.sample(entity_candidates_name, 10)
+        entity_candidates_id = ["[FINISH_ID]"] * len(entity_candidates_name)
+    else: # ids
+        entity_candidates_id, entity_candidates_name = del_all_unknown_entity(entity_candidates_id, entity_candidates_name)
+        if len(entity_candidates_id) >=20:
+            indices = random.sample(range(len(entity_candidates_name)), 10)
+            entity_candidates_id = [entity_candidates_id[i] for i in indices]
+            entity_candidates_name = [entity_candidates_name[i] for i in indices]
+
+    if len(entity_candidates_id) ==0:
+        return None
+
+    with span("entity_score"):
+        scores, entity_candidates, entity_candidates_id = entity_score(question, entity_candidates_id, entity_candidates_name, entity['score'], entity['relation'], args)
+    return scores, entity_candidates, entity_candidates_id, value_flag
+
+
+def solve_question(data, question_string, args, wiki_client):
+    """Run ToG on one question and return the (question, answer, chains) records to save."""
+    records = []
+    question = data[question_string]
+    topic_entity = data['topic_entity']
+    cluster_chain_of_entities = []
+    pre_relations = []
+    pre_heads= [-1] * len(topic_entity)
+    start_depth = 1
+    checkpoint = get_checkpoint()
+    state = checkpoint.get(question) if checkpoint is not None else None
+    if state is not None:
+        # continue a preempted run after its last completed depth
+        topic_entity, pre_relations, pre_heads = state["topic_entity"], state["pre_relations"], state["pre_heads"]
+        cluster_chain_of_entities = state["cluster_chain_of_entities"]
+        start_depth = state["depth"] + 1
+    flag_printed = False
+
+    for depth in range(start_depth, args.depth+1):
+        # fan out every relation prune of this depth, then every entity search + score,
+        # the Wikidata lookups of each stage are batched into one request per server
+        entity_ids = [entity for entity in topic_entity if entity!="[FINISH_ID]"]
+        with span("relation_discovery", depth=depth):
+            relations = dict(zip(entity_ids, wiki_client.query_many("get_all_relations_of_an_entity", [(entity,) for entity in entity_ids])))
+        relation_calls = [(entity, topic_entity[entity], pre_relations, pre_heads[i], question, args, wiki_client, relations[entity]) for i, entity in enumerate(topic_entity) if entity!="[FINISH_ID]"]
+        current_entity_relations_list = []
+        with span("relation_search", depth=depth):
+            for retrieve_relations_with_scores in fan_out(relation_search_prune, relation_calls, args.fanout_workers):
+                current_entity_relations_list.extend(retrieve_relations_with_scores)
+        total_candidates = []
+        total_scores = []
+        total_relations = []
+        total_entities_id = []
+        total_topic_entities = []
+        total_head = []
+
+        with span("entity_discovery", depth=depth):
+            prefetched = prefetch_entity_search([(entity['entity'], entity['relation'], entity['head']) for entity in current_entity_relations_list], wiki_client)
+        score_calls = [(question, entity, args, wiki_client, prefetched) for entity in current_entity_relations_list]
+        with span("entity_expansion", depth=depth):
+            scored_list = fan_out(search_and_score, score_calls, args.fanout_workers)
+        for entity, scored in zip(current_entity_relations_list, scored_list):
+            if scored is None:
+                continue
+            scores, entity_candidates, entity_candidates_id, value_flag = scored
+            total_candidates, total_scores, total_relations, total_entities_id, total_topic_entities, total_head = update_history(entity_candidates, entity, scores, entity_candidates_id, total_candidates, total_scores, total_relations, total_entities_id, total_topic_entities, total_head, value_flag)
+        
+        if len(total_candidates) ==0:
+            with span("answer", depth=depth):
+                answer = half_stop(question, cluster_chain_of_entities, args)
+            records.append((question, answer, cluster_chain_of_entities))
+            flag_printed = True
+            break
+            
+        with span("entity_prune", depth=depth):
+            flag, chain_of_entities, entities_id, pre_relations, pre_heads = entity_prune(total_entities_id, total_relations, total_candidates, total_topic_entities, total_head, total_scores, args, wiki_client)
+        cluster_chain_of_entities.append(chain_of_entities)
+        if flag:
+            with span("reasoning", depth=depth):
+                stop, results = reasoning(question, cluster_chain_of_entities, args)
+            if stop:
+                print("ToG stoped at depth %d." % depth)
+                records.append((question, results, cluster_chain_of_entities))
+                flag_printed = True
+                break
+            else:
+                print("depth %d still not find the answer." % depth)
+                entity_names = wiki_client.query_many("qid2label", [(entity,) for entity in entities_id])
+                topic_entity = {entity: entity_name.pop() if entity_name != "Not Found!" else "Unname_Entity" for entity, entity_name in zip(entities_id, entity_names)}
+                if checkpoint is not None:
+                    checkpoint.save(question, depth, topic_entity, pre_relations, pre_heads, cluster_chain_of_entities)
+                continue
+        else:
+            with span("answer", depth=depth):
+                answer = half_stop(question, cluster_chain_of_entities, args)
+            records.append((question, answer, cluster_chain_of_entities))
+            flag_printed = True
+            break
+    
+    if not flag_printed:
+        with span("answer"):
+            results = generate_without_explored_paths(question, args)
+        records.append((question, results, []))
+    return records
 
 
 if __name__ == '__main__':
@@ -32,86 +153,46 @@ if __name__ == '__main__':
                         default=5, help="Number of entities retained during entities search.")
     parser.add_argument("--prune_tools", type=str,
                         default="llm", help="prune tools for ToG, can be llm (same as LLM_type), bm25 or sentencebert.")
-    parser.add_argument("--addr_list", type=int,
+    parser.add_argument("--addr_list", type=str,
                         default="server_urls.txt", help="The address of the Wikidata service.")
+    parser.add_argument("--concurrency", type=int,
+                        default=1, help="number of questions searched at the same time.")
+    parser.add_argument("--fanout_workers", type=int,
+                        default=8, help="number of relation prune / entity score calls of one depth issued at the same time.")
+    add_llm_cache_args(parser)
+    add_llm_client_args(parser)
+    add_batching_args(parser)
+    add_checkpoint_args(parser)
+    add_result_writer_args(parser)
+    add_tracing_args(parser)
     args = parser.parse_args()
+    init_llm_cache(args)
+    init_llm_client(args)
+    init_batching(args)
+    init_result_writer(args)
+    init_tracing(args)
         
     datas, question_string = prepare_dataset(args.dataset)
+    output_path = "ToG_{}.jsonl".format(args.dataset)
+    checkpoint = init_checkpoint(args, output_path)
+    if args.resume:
+        datas = skip_answered(datas, question_string, get_result_writer(output_path).path)
 
-    for data in tqdm(datas):
-        question = data[question_string]
-        topic_entity = data['topic_entity']
-        cluster_chain_of_entities = []
-        pre_relations = [], 
-        pre_heads= [-1] * len(topic_entity)
-        flag_printed = False
-        addr_list = 'ToG/ToG-E/server_urls.txt'
-        with open(addr_list, "r") as f:
-            server_addrs = f.readlines()
-            server_addrs = [addr.strip() for addr in server_addrs]
-        print(f"Server addresses: {server_addrs}")
-        wiki_client =  db_deploy.client.MultiServerWikidataQueryClient(server_addrs)
-
-        for depth in range(1, args.depth+1):
-            current_entity_relations_list = []
-            i=0
-            for entity in topic_entity:
-                if entity!="[FINISH_ID]":
-                    retrieve_relations_with_scores = relation_search_prune(entity, topic_entity[entity], pre_relations, pre_heads[i], question, args, wiki_client)  # best entity triplet, entitiy_id
-                    current_entity_relations_list.extend(retrieve_relations_with_scores)
-                i+=1
-            total_candidates = []
-            total_scores = []
-            total_relations = []
-            total_entities_id = []
-            total_topic_entities = []
-            total_head = []
+    with open(args.addr_list, "r") as f:
+        server_addrs = f.readlines()
+        server_addrs = [addr.strip() for addr in server_addrs]
+    print(f"Server addresses: {server_addrs}")
+    wiki_client = MultiServerWikidataQueryClient(server_addrs, max_workers=args.concurrency * args.fanout_workers)
 
-            for entity in current_entity_relations_list:
-                value_flag=False
-                if entity['head']:
-                    entity_candidates_id, entity_candidates_name = entity_search(entity['entity'], entity['relation'], True)
-                else:
-                    entity_candidates_id, entity_candidates_name = entity_search(entity['entity'], entity['relation'], False)
+    solve = question_boundary(traced_question(partial(solve_question, question_string=question_string, args=args, wiki_client=wiki_client), question_string))
+    for records in tqdm(run_ordered(solve, datas, args.concurrency), total=len(datas)):
+        for question, answer, cluster_chain_of_entities in records:
+            save_2_jsonl(question, answer, cluster_chain_of_entities, file_name=args.dataset)
+            checkpoint.finish(question)
 
-                if len(entity_candidates_id) ==0: # values
-                    value_flag=True
-                    if len(entity_candidates_name) >=20:
-                        entity_candidates_name = random.sample(entity_candidates_name, 10)
-                    entity_candidates_id = ["[FINISH_ID]"] * len(entity_candidates_name)
-                else: # ids
-                    entity_candidates_id, entity_candidates_name = del_all_unknown_entity(entity_candidates_id, entity_candidates_name)
-                    if len(entity_candidates_id) >=20:
-                        indices = random.sample(range(len(entity_candidates_name)), 10)
-                        entity_candidates_id = [entity_candidates_id[i] for i in indices]
-                        entity_candidates_name = [entity_candidates_name[i] for i in indices]
-
-                if len(entity_candidates_id) ==0:
-                    continue
-
-                scores, entity_candidates, entity_candidates_id = entity_score(question, entity_candidates_id, entity_candidates_name, entity['score'], entity['relation'], args)
-                
-                total_candidates, total_scores, total_relations, total_entities_id, total_topic_entities, total_head = update_history(entity_candidates, entity, scores, entity_candidates_id, total_candidates, total_scores, total_relations, total_entities_id, total_topic_entities, total_head, value_flag)
-            
-            if len(total_candidates) ==0:
-                half_stop(question, cluster_chain_of_entities, args)
-                break
-                
-            flag, chain_of_entities, entities_id, pre_relations, pre_heads = entity_prune(total_entities_id, total_relations, total_candidates, total_topic_entities, total_head, total_scores, args, wiki_client)
-            cluster_chain_of_entities.append(chain_of_entities)
-            if flag:
-                stop, results = reasoning(question, cluster_chain_of_entities, args)
-                if stop:
-                    print("ToG stoped at depth %d." % depth)
-                    save_2_jsonl(question, results, cluster_chain_of_entities, file_name=args.dataset)
-                    flag_printed = True
-                else:
-                    print("depth %d still not find the answer." % depth)
-                    topic_entity = {entity: wiki_client.query_all("qid2label", entity) for entity in entities_id}
-                    continue
-            else:
-                half_stop(question, cluster_chain_of_entities, args)
-        
-        if not flag_printed:
-            results = generate_without_explored_paths(question, args)
-            save_2_jsonl(question, results, [], file_name=args.dataset)
+    close_result_writers()
+    close_checkpoint()
+    close_batchers()
+    close_tracing()
+    report_llm_cache()
+    report_llm_client()
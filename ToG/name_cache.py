@@ -0,0 +1,136 @@
+import collections
+import sqlite3
+import threading
+
+
+class NameCache:
+    """
+    Two-level cache of Freebase MID -> name lookups.
+
+    Level one is a bounded in-process LRU, level two an optional SQLite file that
+    survives across runs and can be bulk loaded from a name dump. Both levels also
+    remember "UnName_Entity" answers, so ids without a name are not queried again.
+
+    Parameters:
+    - capacity (int): max number of names kept in memory.
+    - path (str): SQLite file of the persistent level, empty to keep names in memory only.
+    """
+
+    def __init__(self, capacity=100000, path=""):
+        self.capacity = capacity
+        self.path = path
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lru = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS names (id TEXT PRIMARY KEY, name TEXT NOT NULL)")
+            self._conn.commit()
+
+    def _remember(self, entity_id, name):
+        self._lru[entity_id] = name
+        self._lru.move_to_end(entity_id)
+        if len(self._lru) > self.capacity:
+            self._lru.popitem(last=False)
+
+    def get_many(self, entity_ids):
+        """Return a dict with the cached names of entity_ids, ids not cached are left out."""
+        found = {}
+        with self._lock:
+            missing = []
+            for entity_id in entity_ids:
+                name = self._lru.get(entity_id)
+                if name is None:
+                    missing.append(entity_id)
+                else:
+                    self._lru.move_to_end(entity_id)
+                    found[entity_id] = name
+            self.memory_hits += len(found)
+            if missing and self._conn is not None:
+                for start in range(0, len(missing), 500):
+                    batch = missing[start:start + 500]
+                    rows = self._conn.execute(
+                        "SELECT id, name FROM names WHERE id IN (%s)" % ",".join("?" * len(batch)), batch
+                    ).fetchall()
+                    for entity_id, name in rows:
+                        self._remember(entity_id, name)
+                        found[entity_id] = name
+                    self.disk_hits += len(rows)
+            self.misses += len(entity_ids) - len(found)
+        return found
+
+    def get(self, entity_id):
+        return self.get_many([entity_id]).get(entity_id)
+
+    def put_many(self, names):
+        with self._lock:
+            for entity_id, name in names.items():
+                self._remember(entity_id, name)
+            if self._conn is not None and names:
+                self._conn.executemany("INSERT OR REPLACE INTO names (id, name) VALUES (?, ?)", names.items())
+                self._conn.commit()
+
+    def preload(self, dump_path, batch_size=100000):
+        """
+        Bulk load a tab-separated "mid<TAB>name" dump (full Freebase URIs are accepted
+        for the mid). Returns the number of names loaded.
+        """
+        count = 0
+        batch = {}
+        with open(dump_path, encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t", 1)
+                if len(parts) != 2:
+                    continue
+                entity_id = parts[0].strip("<>").replace("http://rdf.freebase.com/ns/", "")
+                batch[entity_id] = parts[1]
+                if len(batch) >= batch_size:
+                    self.put_many(batch)
+                    count += len(batch)
+                    batch = {}
+        self.put_many(batch)
+        return count + len(batch)
+
+    def stats(self):
+        total = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / total if total else 0.0,
+        }
+
+
+_name_cache = NameCache()
+
+
+def add_name_cache_args(parser):
+    parser.add_argument("--name_cache_size", type=int,
+                        default=100000, help="max number of entity names kept in memory.")
+    parser.add_argument("--name_cache_path", type=str,
+                        default="", help="SQLite file persisting entity names across runs, empty to disable.")
+    parser.add_argument("--name_dump", type=str,
+                        default="", help="tab-separated mid/name dump preloaded into the name cache.")
+
+
+def init_name_cache(args):
+    global _name_cache
+    _name_cache = NameCache(args.name_cache_size, args.name_cache_path)
+    if args.name_dump:
+        print("Preloaded %d entity names from %s" % (_name_cache.preload(args.name_dump), args.name_dump))
+    return _name_cache
+
+
+def get_name_cache():
+    return _name_cache
+
+
+def report_name_cache():
+    stats = _name_cache.stats()
+    print("Name cache: %d memory hits, %d disk hits, %d misses, hit rate %.2f%%" % (
+        stats["memory_hits"], stats["disk_hits"], stats["misses"], stats["hit_rate"] * 100))
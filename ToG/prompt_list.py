@@ -6,7 +6,7 @@ A: 1. {language.human_language.main_country (Score: 0.4))}: This relation is hig
 2. {language.human_language.countries_spoken_in (Score: 0.3)}: This relation is also relevant as it provides information on the countries where Brahui language is spoken, which could help narrow down the search for the president.
 3. {base.rosetta.languoid.parent (Score: 0.2)}: This relation is less relevant but still provides some context on the language family to which Brahui belongs, which could be useful in understanding the linguistic and cultural background of the country in question.
 
-Q: """
+"""
 
 score_entity_candidates_prompt = """Please score the entities' contribution to the question on a scale from 0 to 1 (the sum of the scores of all entities is 1).
 Q: The movie featured Miley Cyrus and was produced by Tobin Armbrust?
@@ -15,9 +15,7 @@ Entites: The Resident; So Undercover; Let Me In; Begin Again; The Quiet Ones; A
 Score: 0.0, 1.0, 0.0, 0.0, 0.0, 0.0
 The movie that matches the given criteria is "So Undercover" with Miley Cyrus and produced by Tobin Armbrust. Therefore, the score for "So Undercover" would be 1, and the scores for all other entities would be 0.
 
-Q: {}
-Relation: {}
-Entites: """
+"""
 
 answer_prompt = """Given a question and the associated retrieved knowledge graph triplets (entity, relation, entity), you are asked to answer the question with these triplets and your knowledge.
 Q: Find the person who said \"Taste cannot be controlled by law\", what did this person die from?
@@ -51,7 +49,6 @@ UnName_Entity, government.national_anthem_of_a_country.country, Bolivia
 Bolivia, location.country.national_anthem, UnName_Entity
 A: Based on the given knowledge triplets, we can infer that the National Anthem of Bolivia is the anthem of Bolivia. Therefore, the country with the National Anthem of Bolivia is Bolivia itself. However, the given knowledge triplets do not provide information about which nations border Bolivia. To answer this question, we need additional knowledge about the geography of Bolivia and its neighboring countries.
 
-Q: {}
 """
 
 prompt_evaluate="""Given a question and the associated retrieved knowledge graph triplets (entity, relation, entity), you are asked to answer whether it's sufficient for you to answer the question with these triplets and your knowledge (Yes or No).
@@ -116,9 +113,7 @@ In this case, we are looking for an actress who was a cast member of "Saturday N
 The relevant entities that meet these criteria are:\n- Ashley Greene\n- Cecily Strong\n- Fred Armisen\n- Gina Gershon\n- Kate Walsh\n\nTo distribute the scores, we can assign a higher score to entities that are more likely to be the correct answer. In this case, the most likely answer would be an actress who was a cast member of "Saturday Night Live" around the time the movie was released.
 Based on this reasoning, the scores could be assigned as follows:\n- Ashley Greene: 0\n- Cecily Strong: 0.4\n- Fred Armisen: 0.2\n- Gina Gershon: 0\n- Kate Walsh: 0.4
 
-Q: {}
-Relation: {}
-Entites: """
+"""
 
 prompt_evaluate_wiki="""Given a question and the associated retrieved knowledge graph triplets (entity, relation, entity), you are asked to answer whether it's sufficient for you to answer the question with these triplets and your knowledge (Yes or No).
 Q: Viscount Yamaji Motoharu was a general in the early Imperial Japanese Army which belonged to which Empire?
@@ -190,7 +185,7 @@ A: 1. {wiki.relation.affiliation (Score: 0.4)}: This relation is relevant becaus
 2. {wiki.relation.donations (Score: 0.3)}: This relation is relevant because it can provide information about the financial contributions made to the Van Andel Institute, which may include donations from the American businessman in question.
 3. {wiki.relation.educated_at (Score: 0.3)}: This relation is relevant because it can provide information about the educational background of the American businessman, which may have influenced his involvement in founding the Van Andel Institute.
 
-Q: """
+"""
 
 answer_prompt_wiki = """Given a question and the associated retrieved knowledge graph triplets (entity, relation, entity), you are asked to answer the question with these triplets and your own knowledge.
 Q: Viscount Yamaji Motoharu was a general in the early Imperial Japanese Army which belonged to which Empire?
@@ -223,5 +218,4 @@ Fort Worth Convention Center, located in the administrative territorial entity,
 Fort Worth Convention Center, occupant, San Antonio Spurs
 A: Based on the given knowledge triplets and my knowledge, Mychal George Thompson played home games with the San Antonio Spurs at the AT&T Center. Therefore, the answer to the question is {AT&T Center}.
 
-Q: {}
 """
\ No newline at end of file
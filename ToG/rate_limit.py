@@ -0,0 +1,144 @@
+import collections
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at `rate` tokens per second up to `capacity`.
+
+    reserve() never blocks: it takes the tokens (letting the bucket go negative) and
+    returns how long the caller has to wait before using them, so sync callers can
+    time.sleep and async callers asyncio.sleep on the same bucket. Reservations
+    queue in order, which keeps throughput at the rate instead of in bursts.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # a request larger than the bucket would wait forever, cap it at one full bucket
+            self._tokens -= min(amount, self.capacity)
+            return max(0.0, -self._tokens / self.rate)
+
+
+class RateLimiter:
+    """
+    Requests-per-second and tokens-per-minute limits of one LLM endpoint, 0 disables a limit.
+    """
+
+    def __init__(self, requests_per_sec=0, tokens_per_min=0):
+        self.request_bucket = TokenBucket(requests_per_sec) if requests_per_sec > 0 else None
+        self.token_bucket = TokenBucket(tokens_per_min / 60.0, tokens_per_min) if tokens_per_min > 0 else None
+
+    def reserve(self, tokens):
+        """Reserve one request of `tokens` tokens and return the seconds to wait before sending it."""
+        delay = 0.0
+        if self.request_bucket is not None:
+            delay = max(delay, self.request_bucket.reserve(1))
+        if self.token_bucket is not None:
+            delay = max(delay, self.token_bucket.reserve(tokens))
+        return delay
+
+
+class Backoff:
+    """Exponential backoff with full jitter, never shorter than a server's Retry-After."""
+
+    def __init__(self, base=1.0, cap=60.0):
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt, retry_after=None):
+        # retries are unbounded, keep 2 ** attempt from overflowing a float
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** min(attempt, 32)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests after `failure_threshold` consecutive failures.
+
+    While open, callers wait for `reset_timeout` seconds, then a single probe request
+    goes through (half-open): its success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.opens = 0
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def wait_time(self):
+        """Seconds to wait before the next request may be sent, 0 when it can go now."""
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                return remaining
+            if self._probing:
+                return min(1.0, self.reset_timeout)
+            self._probing = True
+            return 0.0
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._probing = False
+                self.opens += 1
+
+
+class RetryMetrics:
+    """Counters of one client's requests, retries (by error type) and time spent waiting."""
+
+    def __init__(self):
+        self.requests = 0
+        self.successes = 0
+        self.retries = 0
+        self.errors = collections.Counter()
+        self.throttle_wait = 0.0
+        self.backoff_wait = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, successes=0, retries=0, error=None, throttle_wait=0.0, backoff_wait=0.0, requests=0):
+        with self._lock:
+            self.requests += requests
+            self.successes += successes
+            self.retries += retries
+            if error is not None:
+                self.errors[error] += 1
+            self.throttle_wait += throttle_wait
+            self.backoff_wait += backoff_wait
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "successes": self.successes,
+                "retries": self.retries,
+                "errors": dict(self.errors),
+                "throttle_wait": self.throttle_wait,
+                "backoff_wait": self.backoff_wait,
+            }
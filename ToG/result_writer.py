@@ -0,0 +1,190 @@
+import atexit
+import gzip
+import io
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+
+COMPRESSION_SUFFIXES = {"": "", "gzip": ".gz", "zstd": ".zst"}
+
+_STOP = object()
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd output needs the zstandard package: pip install zstandard")
+    return zstandard
+
+
+def read_lines(path):
+    """
+    Complete lines of a plain, .gz or .zst JSONL file. Reading stops quietly at a
+    tail cut off by a crash, and an unterminated last line is dropped.
+    """
+    if not os.path.exists(path):
+        return
+    errors = (EOFError, OSError, zlib.error)
+    if path.endswith(".gz"):
+        f = gzip.open(path, "rt", encoding="utf-8")
+    elif path.endswith(".zst"):
+        zstandard = _zstd()
+        errors += (zstandard.ZstdError,)
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+        f = io.TextIOWrapper(reader, encoding="utf-8")
+    else:
+        f = open(path, encoding="utf-8")
+    with f:
+        try:
+            for line in f:
+                if line.endswith("\n"):
+                    yield line
+        except errors:
+            return
+
+
+class ResultWriter:
+    """
+    Single appending writer of a JSONL result file, shared by every producer thread.
+
+    write() serializes the record and queues the line, a background thread writes
+    whole lines through one open handle, flushes once the queue is drained and
+    fsyncs at most every fsync_interval seconds (and on close). A line cut off by a
+    crash is dropped when the file is opened again, so later lines are never glued
+    to it.
+
+    Parameters:
+    - path (str): output file, the compression suffix (.gz or .zst) is appended.
+    - compression (str): "" for plain text, "gzip" or "zstd" (needs the zstandard package).
+    - fsync_interval (float): max seconds between fsyncs, 0 to fsync after every flush.
+    """
+
+    def __init__(self, path, compression="", fsync_interval=5.0):
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError("unknown compression %r, expected one of %s" % (compression, list(COMPRESSION_SUFFIXES)))
+        self.path = path + COMPRESSION_SUFFIXES[compression]
+        self.compression = compression
+        self.fsync_interval = fsync_interval
+        self.lines = 0
+        self._queue = queue.Queue()
+        self._open()
+        self._thread = threading.Thread(target=self._run, name="result_writer", daemon=True)
+        self._thread.start()
+
+    def _open(self):
+        if self.compression:
+            # a compressed stream cut by a crash cannot be appended to, rewrite what is readable
+            lines = list(read_lines(self.path))
+            self._raw = open(self.path + ".tmp", "wb")
+        else:
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                with open(self.path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    torn = f.read(1) != b"\n"
+                if torn:
+                    with open(self.path, "rb+") as f:
+                        data = f.read()
+                        f.truncate(data.rfind(b"\n") + 1)
+            self._raw = open(self.path, "ab")
+        if self.compression == "gzip":
+            self._file = gzip.GzipFile(fileobj=self._raw, mode="wb")
+        elif self.compression == "zstd":
+            self._file = _zstd().ZstdCompressor().stream_writer(self._raw, closefd=False)
+        else:
+            self._file = self._raw
+        if self.compression:
+            self._file.write("".join(lines).encode("utf-8"))
+            self._flush(sync=True)
+            os.replace(self.path + ".tmp", self.path)
+
+    def write(self, record):
+        self._queue.put((json.dumps(record) + "\n").encode("utf-8"))
+
+    def _flush(self, sync):
+        self._file.flush()
+        if self._file is not self._raw:
+            self._raw.flush()
+        if sync:
+            os.fsync(self._raw.fileno())
+
+    def _run(self):
+        last_sync = time.monotonic()
+        dirty = False
+        stopping = False
+        while not stopping:
+            try:
+                line = self._queue.get(timeout=self.fsync_interval or None)
+            except queue.Empty:
+                line = None
+            # write everything queued so far in one go
+            while line is not None:
+                if line is _STOP:
+                    stopping = True
+                    break
+                self._file.write(line)
+                self.lines += 1
+                dirty = True
+                try:
+                    line = self._queue.get_nowait()
+                except queue.Empty:
+                    line = None
+            if dirty:
+                sync = stopping or time.monotonic() - last_sync >= self.fsync_interval
+                self._flush(sync)
+                if sync:
+                    last_sync = time.monotonic()
+                    dirty = False
+
+    def close(self):
+        """Write the queued lines, fsync and close the file."""
+        self._queue.put(_STOP)
+        self._thread.join()
+        if self._file is not self._raw:
+            self._file.close()  # ends the gzip member / zstd frame
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+_writer_options = {"compression": "", "fsync_interval": 5.0}
+
+
+def add_result_writer_args(parser):
+    parser.add_argument("--output_compression", type=str,
+                        default="", help="compress the result file, can be gzip or zstd (needs the zstandard package), empty for plain JSONL.")
+    parser.add_argument("--fsync_interval", type=float,
+                        default=5.0, help="max seconds between fsyncs of the result file.")
+
+
+def init_result_writer(args):
+    _writer_options["compression"] = args.output_compression
+    _writer_options["fsync_interval"] = args.fsync_interval
+
+
+def get_result_writer(path):
+    """Shared writer of the result file `path` (before its compression suffix)."""
+    writer = _writers.get(path)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(path)
+            if writer is None:
+                writer = ResultWriter(path, _writer_options["compression"], _writer_options["fsync_interval"])
+                _writers[path] = writer
+    return writer
+
+
+def close_result_writers():
+    with _writers_lock:
+        for writer in _writers.values():
+            writer.close()
+        _writers.clear()
+
+
+# queued results must not be lost when a run stops on an exception
+atexit.register(close_result_writers)
@@ -0,0 +1,93 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class SparqlClient:
+    """
+    SPARQL client that keeps a pool of keep-alive HTTP connections to one endpoint.
+
+    Every thread gets its own requests.Session, but all sessions mount the same
+    HTTPAdapter, so they share one thread-safe connection pool. Connection errors and
+    429/5xx answers are retried with exponential backoff (honouring Retry-After).
+
+    Parameters:
+    - endpoint (str): URL of the SPARQL endpoint, e.g. http://host:8890/sparql.
+    - pool_size (int): max number of pooled connections; further callers wait for a free one.
+    - timeout (float): connect/read timeout in seconds of a single attempt.
+    - retries (int): number of retries after the first attempt.
+    - backoff (float): backoff factor, the n-th retry sleeps backoff * 2 ** (n - 1) seconds.
+    """
+
+    def __init__(self, endpoint, pool_size=32, timeout=60, retries=3, backoff=0.5):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=None,  # queries are read-only, POST is safe to retry
+            respect_retry_after_header=True,
+        )
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", self._adapter)
+            session.mount("https://", self._adapter)
+            session.headers.update({"Accept": "application/sparql-results+json"})
+            self._local.session = session
+        return session
+
+    def query(self, sparql_txt):
+        """Run a SELECT query and return its JSON result bindings."""
+        response = self.session.post(self.endpoint, data={"query": sparql_txt}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["results"]["bindings"]
+
+    def close(self):
+        self._adapter.close()
+
+
+_sparql_client = None
+_sparql_client_lock = threading.Lock()
+
+
+def add_sparql_client_args(parser):
+    parser.add_argument("--sparql_pool_size", type=int,
+                        default=32, help="max number of keep-alive connections to the SPARQL endpoint.")
+    parser.add_argument("--sparql_timeout", type=float,
+                        default=60, help="timeout in seconds of a single SPARQL request.")
+    parser.add_argument("--sparql_retries", type=int,
+                        default=3, help="number of retries of a failed SPARQL request, with exponential backoff.")
+
+
+def init_sparql_client(endpoint, args):
+    """Create the shared client from the --sparql_* command line options."""
+    global _sparql_client
+    with _sparql_client_lock:
+        _sparql_client = SparqlClient(endpoint, args.sparql_pool_size, args.sparql_timeout, args.sparql_retries)
+    return _sparql_client
+
+
+def set_sparql_client(client):
+    """Replace the shared client, e.g. by an in-memory mock for benchmarks."""
+    global _sparql_client
+    with _sparql_client_lock:
+        _sparql_client = client
+
+
+def get_sparql_client(endpoint):
+    """Return the shared client, creating one with default settings on first use."""
+    global _sparql_client
+    if _sparql_client is None:
+        with _sparql_client_lock:
+            if _sparql_client is None:
+                _sparql_client = SparqlClient(endpoint)
+    return _sparql_client
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the ToG modules are flat scripts importing each other by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
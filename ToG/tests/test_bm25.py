@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from bm25 import BM25Index
+
+rank_bm25 = pytest.importorskip("rank_bm25")
+
+CORPUS = [
+    "place of birth",
+    "country of citizenship",
+    "member of sports team",
+    "place of death",
+    "spouse",
+    "educated at",
+    "country",
+]
+QUERIES = ["where was he born place", "which country", "spouse of", "unknown words only", ""]
+
+
+def _reference(corpus):
+    return rank_bm25.BM25Okapi([doc.split(" ") for doc in corpus])
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_scores_match_rank_bm25(query):
+    expected = _reference(CORPUS).get_scores(query.split(" "))
+    np.testing.assert_allclose(BM25Index(CORPUS).get_scores(query), expected)
+
+
+def test_single_document():
+    corpus = ["instance of"]
+    expected = _reference(corpus).get_scores(["instance"])
+    np.testing.assert_allclose(BM25Index(corpus).get_scores("instance"), expected)
+
+
+def test_top_k_is_best_first():
+    index = BM25Index(CORPUS)
+    scores = index.get_scores("place of birth")
+    top, top_scores = index.top_k("place of birth", 3)
+    assert list(top) == list(np.argsort(-scores, kind="stable")[:3])
+    np.testing.assert_allclose(top_scores, scores[top])
+    assert len(index.top_k("place", 100)[0]) == len(CORPUS)
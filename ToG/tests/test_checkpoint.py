@@ -0,0 +1,58 @@
+import json
+
+from checkpoint import BeamCheckpoint, load_answered_questions
+
+
+def _save(checkpoint, question, depth):
+    checkpoint.save(question, depth, {"Q%d" % depth: "entity"}, ["P31"], [True], [[["Q1", "P31", "Q5"]]])
+
+
+def test_state_survives_restart(tmp_path):
+    path = str(tmp_path / "run.ckpt")
+    checkpoint = BeamCheckpoint(path)
+    _save(checkpoint, "q1", 1)
+    _save(checkpoint, "q1", 2)
+    _save(checkpoint, "q2", 1)
+    checkpoint.finish("q2")
+    checkpoint.close()
+
+    restarted = BeamCheckpoint(path)
+    assert len(restarted) == 1
+    state = restarted.get("q1")
+    assert state["depth"] == 2
+    assert state["topic_entity"] == {"Q2": "entity"}
+    assert restarted.get("q2") is None
+    restarted.close()
+    # compacted on load: one record per unfinished question
+    with open(path) as f:
+        assert len(f.readlines()) == 1
+
+
+def test_truncated_record_is_ignored(tmp_path):
+    path = str(tmp_path / "run.ckpt")
+    checkpoint = BeamCheckpoint(path)
+    _save(checkpoint, "q1", 1)
+    checkpoint.close()
+    with open(path, "a") as f:
+        f.write('{"question": "q1", "dep')
+
+    restarted = BeamCheckpoint(path)
+    assert restarted.get("q1")["depth"] == 1
+    restarted.close()
+
+
+def test_no_resume_starts_over(tmp_path):
+    path = str(tmp_path / "run.ckpt")
+    checkpoint = BeamCheckpoint(path)
+    _save(checkpoint, "q1", 1)
+    checkpoint.close()
+
+    fresh = BeamCheckpoint(path, resume=False)
+    assert len(fresh) == 0
+    fresh.close()
+
+
+def test_load_answered_questions(tmp_path):
+    path = tmp_path / "out.jsonl"
+    path.write_text(json.dumps({"question": "q1"}) + "\n" + '{"question": "q2"')
+    assert load_answered_questions(str(path)) == {"q1"}
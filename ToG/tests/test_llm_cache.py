@@ -0,0 +1,47 @@
+import pytest
+
+from llm_cache import LLMCache, LLMCacheMiss
+
+
+def _messages(i):
+    return [{"role": "user", "content": "question %d" % i}]
+
+
+def test_hit_and_miss(tmp_path):
+    cache = LLMCache(str(tmp_path / "cache.db"))
+    assert cache.get("gpt", _messages(0), 0.0, 256) is None
+    cache.put("gpt", _messages(0), 0.0, 256, "answer")
+    assert cache.get("gpt", _messages(0), 0.0, 256) == "answer"
+    # any part of the key changing is a different entry
+    assert cache.get("gpt", _messages(0), 0.5, 256) is None
+    assert cache.get("other", _messages(0), 0.0, 256) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 3
+    cache.close()
+
+
+def test_replay_serves_saved_responses(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = LLMCache(path)
+    cache.put("gpt", _messages(0), 0.0, 256, "answer")
+    cache.close()
+
+    replay = LLMCache(path, mode="replay")
+    assert replay.get("gpt", _messages(0), 0.0, 256) == "answer"
+    with pytest.raises(LLMCacheMiss):
+        replay.get("gpt", _messages(1), 0.0, 256)
+    replay.close()
+
+
+def test_eviction_keeps_recently_used(tmp_path):
+    cache = LLMCache(str(tmp_path / "cache.db"), max_entries=2)
+    cache.put("gpt", _messages(0), 0.0, 256, "a0")
+    cache.put("gpt", _messages(1), 0.0, 256, "a1")
+    # a hit makes entry 0 the most recently used one
+    assert cache.get("gpt", _messages(0), 0.0, 256) == "a0"
+    cache.put("gpt", _messages(2), 0.0, 256, "a2")
+    cache.evict()
+    assert cache.get("gpt", _messages(1), 0.0, 256) is None
+    assert cache.get("gpt", _messages(0), 0.0, 256) == "a0"
+    assert cache.get("gpt", _messages(2), 0.0, 256) == "a2"
+    cache.close()
@@ -0,0 +1,62 @@
+import json
+import time
+
+import pytest
+
+from result_writer import ResultWriter, read_lines
+
+
+@pytest.fixture(params=["", "gzip", "zstd"])
+def compression(request):
+    if request.param == "zstd":
+        pytest.importorskip("zstandard")
+    return request.param
+
+
+def _records(path):
+    return [json.loads(line) for line in read_lines(path)]
+
+
+def test_close_writes_everything(tmp_path, compression):
+    writer = ResultWriter(str(tmp_path / "out.jsonl"), compression)
+    for i in range(100):
+        writer.write({"question": "q%d" % i})
+    writer.close()
+    assert writer.lines == 100
+    assert _records(writer.path) == [{"question": "q%d" % i} for i in range(100)]
+
+
+def test_flushed_lines_are_readable_before_close(tmp_path, compression):
+    writer = ResultWriter(str(tmp_path / "out.jsonl"), compression, fsync_interval=0)
+    writer.write({"question": "q0"})
+    writer.write({"question": "q1"})
+    deadline = time.monotonic() + 5
+    while len(_records(writer.path)) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert _records(writer.path) == [{"question": "q0"}, {"question": "q1"}]
+    writer.close()
+
+
+def test_reopen_appends(tmp_path, compression):
+    path = str(tmp_path / "out.jsonl")
+    writer = ResultWriter(path, compression)
+    writer.write({"question": "q0"})
+    writer.close()
+    writer = ResultWriter(path, compression)
+    writer.write({"question": "q1"})
+    writer.close()
+    assert _records(writer.path) == [{"question": "q0"}, {"question": "q1"}]
+
+
+def test_torn_line_is_dropped(tmp_path):
+    path = tmp_path / "out.jsonl"
+    path.write_text(json.dumps({"question": "q0"}) + "\n" + '{"quest')
+    writer = ResultWriter(str(path))
+    writer.write({"question": "q1"})
+    writer.close()
+    assert _records(writer.path) == [{"question": "q0"}, {"question": "q1"}]
+
+
+def test_unknown_compression(tmp_path):
+    with pytest.raises(ValueError):
+        ResultWriter(str(tmp_path / "out.jsonl"), "bz2")
@@ -0,0 +1,146 @@
+import collections
+import contextlib
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+
+# open spans of the current question, innermost last
+_stack = contextvars.ContextVar("trace_stack", default=())
+_count_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ("name", "attrs", "counts", "start", "duration", "thread")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.counts = collections.Counter()
+        self.start = time.time()
+        self.duration = 0.0
+        self.thread = threading.get_ident()
+
+    def to_dict(self):
+        return {"name": self.name, "start": self.start, "duration": self.duration, "thread": self.thread,
+                **self.attrs, "counts": dict(self.counts)}
+
+
+class Tracer:
+    """
+    Collects the finished spans of a run and the per-stage latency totals.
+
+    Spans nest through a context variable, so a stage span inherits the question
+    id and depth of the spans it was opened in, also when it runs on a fan-out
+    worker (concurrency.fan_out copies the context). Counts (LLM calls, tokens, KG
+    queries) are added to every open span, so a question span holds the totals of
+    its stages.
+
+    Parameters:
+    - path (str): export file, .json for the Chrome trace format (chrome://tracing,
+      Perfetto), anything else for one JSON span per line. Empty keeps the stage
+      totals only.
+    """
+
+    def __init__(self, path=""):
+        self.path = path
+        self.chrome = path.endswith(".json")
+        self.stages = collections.defaultdict(lambda: [0, 0.0, 0.0])  # name -> [count, total, max]
+        self._events = []
+        self._lock = threading.Lock()
+        self._file = open(path, "w", encoding="utf-8") if path and not self.chrome else None
+
+    def finish(self, span):
+        with self._lock:
+            stage = self.stages[span.name]
+            stage[0] += 1
+            stage[1] += span.duration
+            stage[2] = max(stage[2], span.duration)
+            if self._file is not None:
+                self._file.write(json.dumps(span.to_dict(), default=str) + "\n")
+            elif self.chrome:
+                self._events.append({"name": span.name, "ph": "X", "ts": span.start * 1e6, "dur": span.duration * 1e6,
+                                     "pid": os.getpid(), "tid": span.thread, "args": {**span.attrs, **span.counts}})
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            elif self.chrome:
+                with open(self.path, "w", encoding="utf-8") as f:
+                    json.dump({"traceEvents": self._events, "displayTimeUnit": "ms"}, f, default=str)
+
+    def report(self):
+        print("Stage latency (count, total s, mean ms, max ms):")
+        for name, (calls, total, longest) in sorted(self.stages.items(), key=lambda item: -item[1][1]):
+            print("  %-20s %8d %10.2f %10.1f %10.1f" % (name, calls, total, 1000 * total / calls, 1000 * longest))
+
+
+_tracer = None
+
+
+def question_id(question):
+    """Short stable id of a question, to group its spans."""
+    return hashlib.sha1(question.encode("utf-8")).hexdigest()[:10]
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """Time a stage; a no-op unless tracing is enabled."""
+    tracer = _tracer
+    if tracer is None:
+        yield None
+        return
+    stack = _stack.get()
+    if stack:
+        inherited = {key: stack[-1].attrs[key] for key in ("question_id", "depth") if key in stack[-1].attrs}
+        attrs = {**inherited, **attrs}
+    current = Span(name, attrs)
+    token = _stack.set(stack + (current,))
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter() - start
+        _stack.reset(token)
+        tracer.finish(current)
+
+
+def traced_question(solve, question_string):
+    """Wrap a per-question function so all its stage spans belong to one question span."""
+    def traced(data):
+        question = data[question_string]
+        with span("question", question_id=question_id(question), question=question):
+            return solve(data)
+    return traced
+
+
+def count(**counts):
+    """Add counts (e.g. llm_calls=1) to every open span of the current context."""
+    stack = _stack.get()
+    if stack:
+        with _count_lock:  # the question span is shared by its fan-out workers
+            for current in stack:
+                current.counts.update(counts)
+
+
+def add_tracing_args(parser):
+    parser.add_argument("--trace", action="store_true",
+                        help="time every search stage and print the per-stage latency breakdown.")
+    parser.add_argument("--trace_path", type=str,
+                        default="", help="export the spans, .json for the Chrome trace format, otherwise JSONL. Implies --trace.")
+
+
+def init_tracing(args):
+    global _tracer
+    if args.trace or args.trace_path:
+        _tracer = Tracer(args.trace_path)
+    return _tracer
+
+
+def close_tracing():
+    if _tracer is not None:
+        _tracer.close()
+        _tracer.report()
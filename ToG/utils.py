@@ -1,37 +1,41 @@
 from freebase_func import *
 from prompt_list import *
+from llm_cache import get_llm_cache
+from llm_client import build_messages, get_llm_client
+from batcher import batch_mode, get_prompt_batcher
+from result_writer import get_result_writer
+from tracing import count, span
 import json
 import re
-import time
-import openai
-from rank_bm25 import BM25Okapi
-from sentence_transformers import util
-from sentence_transformers import SentenceTransformer
+import numpy as np
+from bm25 import get_bm25_index
+from embedding import get_embedding_cache, get_relation_index
 
-def retrieve_top_docs(query, docs, model, width=3):
+def retrieve_top_docs(query, docs, width=3, index=None):
     """
     Retrieve the topn most relevant documents for the given query.
 
     Parameters:
     - query (str): The input query.
     - docs (list of str): The list of documents to search from.
-    - model_name (str): The name of the SentenceTransformer model to use.
     - width (int): The number of top documents to return.
+    - index (RelationIndex): precomputed document embeddings, None to encode the documents.
 
     Returns:
     - list of float: A list of scores for the topn documents.
     - list of str: A list of the topn documents.
     """
 
-    query_emb = model.encode(query)
-    doc_emb = model.encode(docs)
-
-    scores = util.dot_score(query_emb, doc_emb)[0].cpu().tolist()
-
-    doc_score_pairs = sorted(list(zip(docs, scores)), key=lambda x: x[1], reverse=True)
+    cache = get_embedding_cache()
+    query_emb = cache.encode(query)
+    if index is None:
+        scores = cache.encode(list(docs)) @ query_emb
+    else:
+        scores = index.score(query_emb, docs, cache)
 
-    top_docs = [pair[0] for pair in doc_score_pairs[:width]]
-    top_scores = [pair[1] for pair in doc_score_pairs[:width]]
+    top_indices = np.argsort(-scores, kind="stable")[:width]
+    top_docs = [docs[i] for i in top_indices]
+    top_scores = [float(scores[i]) for i in top_indices]
 
     return top_docs, top_scores
 
@@ -50,14 +54,11 @@ def compute_bm25_similarity(query, corpus, width=3):
     - list, list: topn relations with the highest similarity and their respective scores.
     """
 
-    tokenized_corpus = [doc.split(" ") for doc in corpus]
-    bm25 = BM25Okapi(tokenized_corpus)
-    tokenized_query = query.split(" ")
+    bm25 = get_bm25_index(tuple(corpus))
+    top_indices, top_scores = bm25.top_k(query, width)
 
-    doc_scores = bm25.get_scores(tokenized_query)
-    
-    relations = bm25.get_top_n(tokenized_query, corpus, n=width)
-    doc_scores = sorted(doc_scores, reverse=True)[:width]
+    relations = [corpus[i] for i in top_indices]
+    doc_scores = [float(score) for score in top_scores]
 
     return relations, doc_scores
 
@@ -93,7 +94,7 @@ def clean_relations_bm25_sent(topn_relations, topn_scores, entity_id, head_relat
     relations = []
     if if_all_zero(topn_scores):
         topn_scores = [float(1/len(topn_scores))] * len(topn_scores)
-    for relation in topn_relations:
+    for i, relation in enumerate(topn_relations):
         if relation in head_relations:
             relations.append({"entity": entity_id, "relation": relation, "score": topn_scores[i], "head": True})
         else:
@@ -101,78 +102,76 @@ def clean_relations_bm25_sent(topn_relations, topn_scores, entity_id, head_relat
     return True, relations
 
 
-def run_llm(prompt, temperature, max_tokens, opeani_api_keys, engine="gpt-3.5-turbo"):
-    if "llama" not in engine.lower():
-        openai.api_key = "EMPTY"
-        openai.api_base = "http://localhost:8000/v1"  # your local llama server port
-        engine = openai.Model.list()["data"][0]["id"]
-    else:
-        openai.api_key = opeani_api_keys
+def run_llm(prompt, temperature, max_tokens, opeani_api_keys, engine="gpt-3.5-turbo", prefix=""):
+    messages = build_messages(prompt, prefix)
+    cache = get_llm_cache()
+    if cache is not None:
+        # key on the requested engine so replay works without the server
+        result = cache.get(engine, messages, temperature, max_tokens)
+        if result is not None:
+            count(llm_cache_hits=1)
+            return result
+
+    count(llm_calls=1)
+    result = get_llm_client(engine, opeani_api_keys).chat(messages, temperature, max_tokens)
+    if cache is not None:
+        cache.put(engine, messages, temperature, max_tokens, result)
+    return result
 
-    messages = [{"role":"system","content":"You are an AI assistant that helps people find information."}]
-    message_prompt = {"role":"user","content":prompt}
-    messages.append(message_prompt)
-    print("start openai")
-    while(f == 0):
-        try:
-            response = openai.ChatCompletion.create(
-                    model=engine,
-                    messages = messages,
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    frequency_penalty=0,
-                    presence_penalty=0)
-            result = response["choices"][0]['message']['content']
-            f = 1
-        except:
-            print("openai error, retry")
-            time.sleep(2)
-    print("end openai")
+def run_llm_batched(prompt, temperature, max_tokens, opeani_api_keys, engine="gpt-3.5-turbo", prefix=""):
+    """run_llm through the cross-question micro-batcher, plain run_llm when batching is disabled."""
+    batcher = get_prompt_batcher(engine, opeani_api_keys, temperature, max_tokens)
+    if batcher is None:
+        return run_llm(prompt, temperature, max_tokens, opeani_api_keys, engine, prefix)
+    messages = build_messages(prompt, prefix)
+    # raw /completions answers differ from chat ones, keep them apart in the cache
+    cache_engine = engine if batch_mode() == "concurrent" else engine + ":completions"
+    cache = get_llm_cache()
+    if cache is not None:
+        result = cache.get(cache_engine, messages, temperature, max_tokens)
+        if result is not None:
+            count(llm_cache_hits=1)
+            return result
+
+    count(llm_calls=1)
+    result = batcher.submit(messages).result()
+    if cache is not None:
+        cache.put(cache_engine, messages, temperature, max_tokens, result)
     return result
 
 def construct_relation_prune_prompt(question, entity_name, total_relations, args):
-    return extract_relation_prompt % (args.width, args.width) + question + '\nTopic Entity: ' + entity_name + '\nRelations: '+ '; '.join(total_relations) + "\nA: "
+    """Return the static few-shot prefix and the question part of the prompt."""
+    return extract_relation_prompt % (args.width, args.width), 'Q: ' + question + '\nTopic Entity: ' + entity_name + '\nRelations: '+ '; '.join(total_relations) + "\nA: "
         
 
 def construct_entity_score_prompt(question, relation, entity_candidates):
-    return score_entity_candidates_prompt.format(question, relation) + "; ".join(entity_candidates) + '\nScore: '
+    """Return the static few-shot prefix and the question part of the prompt."""
+    return score_entity_candidates_prompt, 'Q: {}\nRelation: {}\nEntites: '.format(question, relation) + "; ".join(entity_candidates) + '\nScore: '
 
 def relation_search_prune(entity_id, entity_name, pre_relations, pre_head, question, args):
-    sparql_relations_extract_head = sparql_head_relations % (entity_id)
-    head_relations = execurte_sparql(sparql_relations_extract_head)
-    head_relations = replace_relation_prefix(head_relations)
-    
-    sparql_relations_extract_tail= sparql_tail_relations % (entity_id)
-    tail_relations = execurte_sparql(sparql_relations_extract_tail)
-    tail_relations = replace_relation_prefix(tail_relations)
-
-    if args.remove_unnecessary_rel:
-        head_relations = [relation for relation in head_relations if not abandon_rels(relation)]
-        tail_relations = [relation for relation in tail_relations if not abandon_rels(relation)]
-    
+    with span("relation_discovery"):
+        head_relations, tail_relations = relation_search(entity_id, args.remove_unnecessary_rel)
 
     if len(pre_relations) != 0 and pre_head !=-1:
-        tail_relations = [rel for rel in tail_relations if not pre head or rel not in pre_relations]
+        tail_relations = [rel for rel in tail_relations if not pre_head or rel not in pre_relations]
         head_relations = [rel for rel in head_relations if pre_head or rel not in pre_relations]
 
-    head_relations = list(set(head_relations))
-    tail_relations = list(set(tail_relations))
     total_relations = head_relations+tail_relations
     total_relations.sort()  # make sure the order in prompt is always equal
     
-    if args.prune_tools == "llm":
-        prompt = construct_relation_prune_prompt(question, entity_name, total_relations, args)
+    with span("relation_prune"):
+        if args.prune_tools == "llm":
+            prefix, prompt = construct_relation_prune_prompt(question, entity_name, total_relations, args)
 
-        result = run_llm(prompt, args.temperature_exploration, args.max_length, args.opeani_api_keys, args.LLM_type)
-        flag, retrieve_relations_with_scores = clean_relations(result, entity_id, head_relations) 
+            result = run_llm_batched(prompt, args.temperature_exploration, args.max_length, args.opeani_api_keys, args.LLM_type, prefix)
+            flag, retrieve_relations_with_scores = clean_relations(result, entity_id, head_relations) 
 
-    elif args.prune_tools == "bm25":
-        topn_relations, topn_scores = compute_bm25_similarity(question, total_relations, args.width)
-        flag, retrieve_relations_with_scores = clean_relations_bm25_sent(topn_relations, topn_scores, entity_id, head_relations) 
-    else:
-        model = SentenceTransformer('sentence-transformers/msmarco-distilbert-base-tas-b')
-        topn_relations, topn_scores = retrieve_top_docs(question, total_relations, model, args.width)
-        flag, retrieve_relations_with_scores = clean_relations_bm25_sent(topn_relations, topn_scores, entity_id, head_relations) 
+        elif args.prune_tools == "bm25":
+            topn_relations, topn_scores = compute_bm25_similarity(question, total_relations, args.width)
+            flag, retrieve_relations_with_scores = clean_relations_bm25_sent(topn_relations, topn_scores, entity_id, head_relations) 
+        else:
+            topn_relations, topn_scores = retrieve_top_docs(question, total_relations, args.width, get_relation_index())
+            flag, retrieve_relations_with_scores = clean_relations_bm25_sent(topn_relations, topn_scores, entity_id, head_relations)
 
     if flag:
         return retrieve_relations_with_scores
@@ -180,22 +179,44 @@ def relation_search_prune(entity_id, entity_name, pre_relations, pre_head, quest
         return [] # format error or too small max_length
     
     
-def entity_search(entity, relation, head=True):
+def entity_search(entity, relation, head=True, limit=None, sampling="random", seed=0, exact_count=False):
+    """
+    Fetch the MID neighbours of an entity through a relation, capped inside the SPARQL query.
+
+    Parameters:
+    - entity (str), relation (str): the topic entity MID and the relation to follow.
+    - head (bool): whether the entity is the head of the relation.
+    - limit (int): max number of entities to return, None returns all of them.
+    - sampling (str): which entities are kept when capped, "random", "seeded" (reproducible for a seed) or "ordered" (by MID).
+    - seed (int): seed of the "seeded" policy.
+    - exact_count (bool): when capped, run a COUNT query for the exact total instead of reporting the limit.
+
+    Returns:
+    - list of str: the entity MIDs.
+    - int: total number of entities, a lower bound (the limit) when capped and not exact_count.
+    """
     if head:
-        tail_entities_extract = sparql_tail_entities_extract% (entity, relation)
-        entities = execurte_sparql(tail_entities_extract)
+        pattern = sparql_tail_entities_extract % (entity, relation)
     else:
-        head_entities_extract = sparql_head_entities_extract% (entity, relation)
-        entities = execurte_sparql(head_entities_extract)
+        pattern = sparql_head_entities_extract % (relation, entity)
 
+    if limit is None:
+        modifiers = ""
+    else:
+        modifiers = sparql_entities_order[sampling] % seed if sampling == "seeded" else sparql_entities_order[sampling]
+        modifiers += "LIMIT %d" % limit
+    entities = execurte_sparql(sparql_entities % (pattern, modifiers))
+    new_entity = replace_entities_prefix(entities)
 
-    entity_ids = replace_entities_prefix(entities)
-    new_entity = [entity for entity in entity_ids if entity.startswith("m.")]
-    return new_entity
+    total = len(new_entity)
+    if limit is not None and total >= limit and exact_count:
+        total = int(execurte_sparql(sparql_entities_count % pattern)[0]['total']['value'])
+    return new_entity, total
 
 
 def entity_score(question, entity_candidates_id, score, relation, args):
-    entity_candidates = [id2entity_name_or_type(entity_id) for entity_id in entity_candidates_id]
+    id2name = ids2names(entity_candidates_id)
+    entity_candidates = [id2name[entity_id] for entity_id in entity_candidates_id]
     if all_unknown_entity(entity_candidates):
         return [1/len(entity_candidates) * score] * len(entity_candidates), entity_candidates, entity_candidates_id
     entity_candidates = del_unknown_entity(entity_candidates)
@@ -210,16 +231,15 @@ def entity_score(question, entity_candidates_id, score, relation, args):
     entity_candidates = list(entity_candidates)
     entity_candidates_id = list(entity_candidates_id)
     if args.prune_tools == "llm":
-        prompt = construct_entity_score_prompt(question, relation, entity_candidates, score)
+        prefix, prompt = construct_entity_score_prompt(question, relation, entity_candidates)
 
-        result = run_llm(prompt, args.temperature_exploration, args.max_length, args.opeani_api_keys, args.LLM_type)
+        result = run_llm(prompt, args.temperature_exploration, args.max_length, args.opeani_api_keys, args.LLM_type, prefix)
         return [float(x) * score for x in clean_scores(result, entity_candidates)], entity_candidates, entity_candidates_id
 
     elif args.prune_tools == "bm25":
         topn_entities, topn_scores = compute_bm25_similarity(question, entity_candidates, args.width)
     else:
-        model = SentenceTransformer('sentence-transformers/msmarco-distilbert-base-tas-b')
-        topn_entities, topn_scores = retrieve_top_docs(question, entity_candidates, model, args.width)
+        topn_entities, topn_scores = retrieve_top_docs(question, entity_candidates, args.width)
     if if_all_zero(topn_scores):
         topn_scores = [float(1/len(topn_scores))] * len(topn_scores)
     return [float(x) * score for x in topn_scores], topn_entities, entity_candidates_id
@@ -260,18 +280,16 @@ def update_history(entity_candidates, entity, scores, entity_candidates_id, tota
 
 
 def generate_answer(question, cluster_chain_of_entities, args): 
-    prompt = answer_prompt + question + '\n'
+    prompt = 'Q: ' + question
     chain_prompt = '\n'.join([', '.join([str(x) for x in chain]) for sublist in cluster_chain_of_entities for chain in sublist])
-    prompt += "\nKnowledge Triplets: " + chain_prompt + 'A: '
-    result = run_llm(prompt, args.temperature_reasoning, args.max_length, args.opeani_api_keys, args.LLM_type)
+    prompt += "\nKnowledge Triplets: " + chain_prompt + '\nA: '
+    result = run_llm(prompt, args.temperature_reasoning, args.max_length, args.opeani_api_keys, args.LLM_type, answer_prompt)
     return result
 
 
 def save_2_jsonl(question, answer, cluster_chain_of_entities, file_name):
     dict = {"question":question, "results": answer, "reasoning_chains": cluster_chain_of_entities}
-    with open("ToG_{}.jsonl".format(file_name), "a") as outfile:
-        json_str = json.dumps(dict)
-        outfile.write(json_str + "\n")
+    get_result_writer("ToG_{}.jsonl".format(file_name)).write(dict)
 
 
 def entity_prune(total_entities_id, total_relations, total_candidates, total_topic_entities, total_head, total_scores, args):
@@ -286,17 +304,18 @@ def entity_prune(total_entities_id, total_relations, total_candidates, total_top
         return False, [], [], [], []
     entities_id, relations, candidates, tops, heads, scores = map(list, zip(*filtered_list))
 
-    tops = [id2entity_name_or_type(entity_id) for entity_id in tops]
+    id2name = ids2names(tops)
+    tops = [id2name[entity_id] for entity_id in tops]
     cluster_chain_of_entities = [[(tops[i], relations[i], candidates[i]) for i in range(len(candidates))]]
     return True, cluster_chain_of_entities, entities_id, relations, heads
 
 
 def reasoning(question, cluster_chain_of_entities, args):
-    prompt = prompt_evaluate + question
+    prompt = 'Q: ' + question
     chain_prompt = '\n'.join([', '.join([str(x) for x in chain]) for sublist in cluster_chain_of_entities for chain in sublist])
-    prompt += "\nKnowledge Triplets: " + chain_prompt + 'A: '
+    prompt += "\nKnowledge Triplets: " + chain_prompt + '\nA: '
 
-    response = run_llm(prompt, args.temperature_reasoning, args.max_length, args.opeani_api_keys, args.LLM_type)
+    response = run_llm(prompt, args.temperature_reasoning, args.max_length, args.opeani_api_keys, args.LLM_type, prompt_evaluate)
     
     result = extract_answer(response)
     if if_true(result):
@@ -320,7 +339,7 @@ def if_true(prompt):
 def half_stop(question, cluster_chain_of_entities, args):
     print("No new knowledge added during search depth %d, stop searching." % args.depth)
     answer = generate_answer(question, cluster_chain_of_entities, args)
-    save_2_jsonl(question, answer, cluster_chain_of_entities, file_name=args.dataset)
+    return answer
 
 
 def generate_without_explored_paths(question, args):
@@ -1,9 +1,11 @@
-from CoT.cot_io import question_string
 from prompt_list import *
+from llm_cache import get_llm_cache
+from llm_client import build_messages, get_llm_client
+from batcher import batch_mode, get_prompt_batcher
+from result_writer import get_result_writer
+from tracing import count, span
 import json
-import openai
 import re
-import time
 
 def clean_relations(string, entity_id, head_relations):
     pattern = r"{\s*(?P<relation>[^()]+)\s+\(Score:\s+(?P<score>[0-9.]+)\)}"
@@ -29,37 +31,46 @@ def clean_relations(string, entity_id, head_relations):
 
 
 
-def run_llm(prompt, temperature, max_tokens, opeani_api_keys, engine="gpt-3.5-turbo"):
-    if "llama" not in engine.lower():
-        openai.api_key = "EMPTY"
-        openai.api_base = "http://localhost:8000/v1"  # your local llama server port
-        engine = openai.Model.list()["data"][0]["id"]
-    else:
-        openai.api_key = opeani_api_keys
+def run_llm(prompt, temperature, max_tokens, opeani_api_keys, engine="gpt-3.5-turbo", prefix=""):
+    messages = build_messages(prompt, prefix)
+    cache = get_llm_cache()
+    if cache is not None:
+        # key on the requested engine so replay works without the server
+        result = cache.get(engine, messages, temperature, max_tokens)
+        if result is not None:
+            count(llm_cache_hits=1)
+            return result
 
-    messages = [{"role":"system","content":"You are an AI assistant that helps people find information."}]
-    message_prompt = {"role":"user","content":prompt}
-    messages.append(message_prompt)
-    print("start openai")
-    while(f == 0):
-        try:
-            response = openai.ChatCompletion.create(
-                    model=engine,
-                    messages = messages,
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    frequency_penalty=0,
-                    presence_penalty=0)
-            result = response["choices"][0]['message']['content']
-            f = 1
-        except:
-            print("openai error, retry")
-            time.sleep(2)
-    print("end openai")
+    count(llm_calls=1)
+    result = get_llm_client(engine, opeani_api_keys).chat(messages, temperature, max_tokens)
+    if cache is not None:
+        cache.put(engine, messages, temperature, max_tokens, result)
+    return result
+
+def run_llm_batched(prompt, temperature, max_tokens, opeani_api_keys, engine="gpt-3.5-turbo", prefix=""):
+    """run_llm through the cross-question micro-batcher, plain run_llm when batching is disabled."""
+    batcher = get_prompt_batcher(engine, opeani_api_keys, temperature, max_tokens)
+    if batcher is None:
+        return run_llm(prompt, temperature, max_tokens, opeani_api_keys, engine, prefix)
+    messages = build_messages(prompt, prefix)
+    # raw /completions answers differ from chat ones, keep them apart in the cache
+    cache_engine = engine if batch_mode() == "concurrent" else engine + ":completions"
+    cache = get_llm_cache()
+    if cache is not None:
+        result = cache.get(cache_engine, messages, temperature, max_tokens)
+        if result is not None:
+            count(llm_cache_hits=1)
+            return result
+
+    count(llm_calls=1)
+    result = batcher.submit(messages).result()
+    if cache is not None:
+        cache.put(cache_engine, messages, temperature, max_tokens, result)
     return result
 
 def construct_relation_prune_prompt(question, entity_name, total_relations, args):
-    return extract_relation_prompt_wiki % (args.width, args.width)+question+'\nTopic Entity: '+entity_name+ '\nRelations:\n'+'\n'.join([f"{i}. {item}" for i, item in enumerate(total_relations, start=1)])+'A:'
+    """Return the static few-shot prefix and the question part of the prompt."""
+    return extract_relation_prompt_wiki % (args.width, args.width), 'Q: '+question+'\nTopic Entity: '+entity_name+ '\nRelations:\n'+'\n'.join([f"{i}. {item}" for i, item in enumerate(total_relations, start=1)])+'A:'
 
 
 def check_end_word(s):
@@ -73,12 +84,16 @@ def abandon_rels(relation):
     return False
 
 def construct_entity_score_prompt(question, relation, entity_candidates):
-    return score_entity_candidates_prompt_wiki.format(question, relation) + "; ".join(entity_candidates) + '\nScore: '
+    """Return the static few-shot prefix and the question part of the prompt."""
+    return score_entity_candidates_prompt_wiki, 'Q: {}\nRelation: {}\nEntites: '.format(question, relation) + "; ".join(entity_candidates) + '\nScore: '
 
-def relation_search_prune(entity_id, entity_name, pre_relations, pre_head, question, args, wiki_client):
-    relations = wiki_client.query_all("get_all_relations_of_an_entity", entity_id)
-    head_relations = relations['head']
-    tail_relations = relations['tail']
+def relation_search_prune(entity_id, entity_name, pre_relations, pre_head, question, args, wiki_client, relations=None):
+    if relations is None:
+        with span("relation_discovery"):
+            relations = wiki_client.query_all("get_all_relations_of_an_entity", entity_id)
+    # the server returns {"pid", "label"} structs, the prompts work on labels
+    head_relations = [relation['label'] for relation in relations['head']]
+    tail_relations = [relation['label'] for relation in relations['tail']]
 
     if args.remove_unnecessary_rel:
         head_relations = [relation for relation in head_relations if not abandon_rels(relation)]
@@ -93,9 +108,10 @@ def relation_search_prune(entity_id, entity_name, pre_relations, pre_head, quest
     total_relations = head_relations+tail_relations
     total_relations.sort()  # make sure the order in prompt is always equal
     
-    prompt = construct_relation_prune_prompt(question, entity_name, total_relations, args)
+    prefix, prompt = construct_relation_prune_prompt(question, entity_name, total_relations, args)
 
-    result = run_llm(prompt, args.temperature_exploration, args.max_length, args.opeani_api_keys, args.LLM_type)
+    with span("relation_prune"):
+        result = run_llm_batched(prompt, args.temperature_exploration, args.max_length, args.opeani_api_keys, args.LLM_type, prefix)
     flag, retrieve_relations_with_scores = clean_relations(result, entity_id, head_relations) 
 
     if flag:
@@ -119,15 +135,37 @@ def del_all_unknown_entity(entity_candidates_id, entity_candidates_name):
 def all_zero(topn_scores):
     return all(score == 0 for score in topn_scores)
 
-def entity_search(entity, relation, wiki_client, head):
+def prefetch_entity_search(entity_relations, wiki_client):
+    """
+    The relation pids, tail entities and values of every (entity, relation, head)
+    searched at one depth, fetched with three batched lookups for entity_search.
+    """
+    relations = sorted({relation for _, relation, _ in entity_relations})
+    rids = wiki_client.query_many("label2pid", [(relation,) for relation in relations])
+    pids = {relation: rid.pop() for relation, rid in zip(relations, rids) if rid and rid != "Not Found!"}
+    pairs = sorted({(entity, pids[relation]) for entity, relation, _ in entity_relations if relation in pids})
+    entities = dict(zip(pairs, wiki_client.query_many("get_tail_entities_given_head_and_relation", pairs)))
+    # the values are only looked up when there is no entity on the searched side
+    value_pairs = sorted({(entity, pids[relation]) for entity, relation, head in entity_relations
+                          if relation in pids and not entities[(entity, pids[relation])]['tail' if head else 'head']})
+    values = dict(zip(value_pairs, wiki_client.query_many("get_tail_values_given_head_and_relation", value_pairs)))
+    return {"pids": pids, "entities": entities, "values": values}
+
+def entity_search(entity, relation, wiki_client, head, prefetched=None):
+
+    if prefetched is not None:
+        rid_str = prefetched["pids"].get(relation)
+        if rid_str is None:
+            return [], []
+        entities = prefetched["entities"][(entity, rid_str)]
+    else:
+        rid = wiki_client.query_all("label2pid", relation)
+        if not rid or rid == "Not Found!":
+            return [], []
 
-    rid = wiki_client.query_all("label2pid", relation)
-    if not rid or rid == "Not Found!":
-        return [], []
-    
-    rid_str = rid.pop()
+        rid_str = rid.pop()
 
-    entities = wiki_client.query_all("get_tail_entities_given_head_and_relation", entity, rid_str)
+        entities = wiki_client.query_all("get_tail_entities_given_head_and_relation", entity, rid_str)
     
     if head:
         entities_set = entities['tail']
@@ -135,7 +173,10 @@ def entity_search(entity, relation, wiki_client, head):
         entities_set = entities['head']
 
     if not entities_set:
-        values = wiki_client.query_all("get_tail_values_given_head_and_relation", entity, rid_str)
+        if prefetched is not None:
+            values = prefetched["values"][(entity, rid_str)]
+        else:
+            values = wiki_client.query_all("get_tail_values_given_head_and_relation", entity, rid_str)
         return [], list(values)
 
     id_list = [item['qid'] for item in entities_set]
@@ -164,9 +205,9 @@ def entity_score(question, entity_candidates_id, entity_candidates, score, relat
     entity_candidates = list(entity_candidates)
     entity_candidates_id = list(entity_candidates_id)
 
-    prompt = construct_entity_score_prompt(question, relation, entity_candidates, score)
+    prefix, prompt = construct_entity_score_prompt(question, relation, entity_candidates)
 
-    result = run_llm(prompt, args.temperature_exploration, args.max_length, args.opeani_api_keys, args.LLM_type)
+    result = run_llm(prompt, args.temperature_exploration, args.max_length, args.opeani_api_keys, args.LLM_type, prefix)
     entity_scores = clean_scores(result, entity_candidates)
     if all_zero(entity_scores):
         return [1/len(entity_candidates) * score] * len(entity_candidates), entity_candidates, entity_candidates_id
@@ -202,18 +243,16 @@ def update_history(entity_candidates, entity, scores, entity_candidates_id, tota
 
 
 def generate_answer(question, cluster_chain_of_entities, args): 
-    prompt = answer_prompt_wiki + question + '\n'
+    prompt = 'Q: ' + question
     chain_prompt = '\n'.join([', '.join([str(x) for x in chain]) for sublist in cluster_chain_of_entities for chain in sublist])
-    prompt += "\nKnowledge Triplets: " + chain_prompt + 'A: '
-    result = run_llm(prompt, args.temperature_reasoning, args.max_length, args.opeani_api_keys, args.LLM_type)
+    prompt += "\nKnowledge Triplets: " + chain_prompt + '\nA: '
+    result = run_llm(prompt, args.temperature_reasoning, args.max_length, args.opeani_api_keys, args.LLM_type, answer_prompt_wiki)
     return result
 
 
 def save_2_jsonl(question, answer, cluster_chain_of_entities, file_name):
     dict = {"question":question, "turbo_results": answer, "chains": cluster_chain_of_entities}
-    with open("ToG_{}.jsonl".format(file_name), "a") as outfile:
-        json_str = json.dumps(dict)
-        outfile.write(json_str + "\n")
+    get_result_writer("ToG_{}.jsonl".format(file_name)).write(dict)
 
 
 def entity_prune(total_entities_id, total_relations, total_candidates, total_topic_entities, total_head, total_scores, args, wiki_client):
@@ -227,16 +266,16 @@ def entity_prune(total_entities_id, total_relations, total_candidates, total_top
     if len(filtered_list) ==0:
         return False, [], [], [], []
     entities_id, relations, candidates, tops, heads, scores = map(list, zip(*filtered_list))
-    tops = [wiki_client.query_all("qid2label", entity_id).pop() if (entity_name := wiki_client.query_all("qid2label", entity_id)) != "Not Found!" else "Unname_Entity" for entity_id in tops]
+    tops = [entity_name.pop() if entity_name != "Not Found!" else "Unname_Entity" for entity_name in wiki_client.query_many("qid2label", [(entity_id,) for entity_id in tops])]
     cluster_chain_of_entities = [[(tops[i], relations[i], candidates[i]) for i in range(len(candidates))]]
     return True, cluster_chain_of_entities, entities_id, relations, heads
 
 def reasoning(question, cluster_chain_of_entities, args):
-    prompt = prompt_evaluate_wiki + question
+    prompt = 'Q: ' + question
     chain_prompt = '\n'.join([', '.join([str(x) for x in chain]) for sublist in cluster_chain_of_entities for chain in sublist])
-    prompt += "\nKnowledge Triplets: " + chain_prompt + 'A: '
+    prompt += "\nKnowledge Triplets: " + chain_prompt + '\nA: '
 
-    response = run_llm(prompt, args.temperature_reasoning, args.max_length, args.opeani_api_keys, args.LLM_type)
+    response = run_llm(prompt, args.temperature_reasoning, args.max_length, args.opeani_api_keys, args.LLM_type, prompt_evaluate_wiki)
     
     result = extract_answer(response)
     if if_true(result):
@@ -260,7 +299,7 @@ def if_true(prompt):
 def half_stop(question, cluster_chain_of_entities, args):
     print("No new knowledge added during search depth %d, stop searching." % args.depth)
     answer = generate_answer(question, cluster_chain_of_entities, args)
-    save_2_jsonl(question, answer, cluster_chain_of_entities, file_name=args.dataset)
+    return answer
 
 
 def generate_without_explored_paths(question, args):
@@ -0,0 +1,378 @@
+"""
+Memory-mapped binary index of one Wikidata chunk.
+
+A chunk is a directory of .npy arrays that the server opens with
+`np.load(mmap_mode="r")`, so starting a server only maps the files: pages are
+read on first use and shared between all processes serving the same chunk.
+
+- String tables (entities, properties, labels, values) hold their UTF-8 strings
+  back to back in one uint8 array, with an int64 offsets array of n + 1 entries.
+  The entity, property and mid tables are sorted by their UTF-8 bytes and
+  looked up by binary search.
+- Adjacency is stored in CSR form keyed by the integer entity id: row i of
+  `out` holds the (pid, tail) pairs of entity i, sorted by pid, so the tails of
+  one (head, pid) pair are a contiguous slice found by binary search. `in` holds
+  the (pid, head) pairs of incoming edges, `values` / `external_ids` the pids
+  of the literal values and external ids, whose strings follow the same order.
+- meta.json is written last, a chunk directory without it is incomplete.
+"""
+import json
+import os
+import typing as tp
+from array import array
+
+import numpy as np
+
+from Wikidata.simple_wikidata_db.db_deploy.vocab import StringPool
+
+FORMAT_VERSION = 1
+
+
+def chunk_dir(index_dir: str, chunk_number: int) -> str:
+    """Directory of a binary chunk, numbered like the pickle chunk files."""
+    return os.path.join(index_dir, f"index_chunk_{chunk_number}")
+
+
+def _load(directory: str, name: str) -> np.ndarray:
+    # a plain ndarray over the mapping, slicing a np.memmap is several times slower
+    return np.load(os.path.join(directory, name + ".npy"), mmap_mode="r").view(np.ndarray)
+
+
+def _save(directory: str, name: str, values: np.ndarray):
+    np.save(os.path.join(directory, name + ".npy"), values)
+
+
+class StringTable:
+    def __init__(self, directory: str, name: str):
+        self.data = _load(directory, name + ".data")
+        self.offsets = _load(directory, name + ".offsets")
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def raw(self, i: int) -> bytes:
+        return self.data[self.offsets[i] : self.offsets[i + 1]].tobytes()
+
+    def __getitem__(self, i: int) -> str:
+        return self.raw(i).decode("utf-8")
+
+    def find(self, string: str) -> int:
+        """Position of a string in a sorted table, -1 if missing."""
+        key = string.encode("utf-8")
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.raw(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(self) and self.raw(lo) == key else -1
+
+    @staticmethod
+    def write(directory: str, name: str, strings: tp.Iterable[str]):
+        encoded = [string.encode("utf-8") for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(raw) for raw in encoded], out=offsets[1:])
+        _save(directory, name + ".offsets", offsets)
+        _save(
+            directory,
+            name + ".data",
+            np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        )
+
+
+class Adjacency:
+    """CSR rows of (pid, target) pairs sorted by pid, targets are optional."""
+
+    def __init__(self, directory: str, name: str, targets: bool = True):
+        self.offsets = _load(directory, name + ".offsets")
+        self.pids = _load(directory, name + ".pids")
+        self.targets = _load(directory, name + ".targets") if targets else None
+
+    def row(self, i: int) -> tp.Tuple[int, int]:
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+    def span(self, i: int, pid: int) -> tp.Tuple[int, int]:
+        """Positions of the pairs of row i with the given pid."""
+        start, end = self.row(i)
+        pids = self.pids[start:end]
+        return (
+            start + int(np.searchsorted(pids, pid, side="left")),
+            start + int(np.searchsorted(pids, pid, side="right")),
+        )
+
+    @staticmethod
+    def write(
+        directory: str,
+        name: str,
+        num_rows: int,
+        rows: np.ndarray,
+        pids: np.ndarray,
+        targets: tp.Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """Write the pairs grouped by row and pid, return the order they were written in."""
+        keys = (pids, rows) if targets is None else (targets, pids, rows)
+        order = np.lexsort(keys)
+        offsets = np.zeros(num_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=num_rows), out=offsets[1:])
+        _save(directory, name + ".offsets", offsets)
+        _save(directory, name + ".pids", pids[order])
+        if targets is not None:
+            _save(directory, name + ".targets", targets[order])
+        return order
+
+
+def _sorted_ids(strings: tp.List[str]) -> tp.Tuple[tp.List[str], np.ndarray]:
+    """Strings sorted by their UTF-8 bytes and the new id of every old id."""
+    order = sorted(range(len(strings)), key=lambda i: strings[i].encode("utf-8"))
+    remap = np.empty(len(strings), dtype=np.uint32)
+    remap[order] = np.arange(len(strings), dtype=np.uint32)
+    return [strings[i] for i in order], remap
+
+
+class BinaryIndexWriter:
+    """
+    Collects the edges, values and external ids of a chunk and writes them in
+    the binary format. Entities and properties get dense integer ids as they
+    are added, the ids are renumbered in sorted order when writing.
+    """
+
+    def __init__(self):
+        self.entities = StringPool()
+        self.properties = StringPool()
+        self.edges = (array("I"), array("I"), array("I"), array("B"))
+        self.values = (array("I"), array("I"), [])
+        self.external_ids = (array("I"), array("I"), [])
+        self.mids = {}
+
+    def _entity(self, qid: str) -> int:
+        return self.entities.add(qid)
+
+    def _property(self, pid: str) -> int:
+        return self.properties.add(pid)
+
+    def add_edge(
+        self,
+        head_qid: str,
+        pid: str,
+        tail_qid: str,
+        outgoing: bool = True,
+        incoming: bool = True,
+    ):
+        """Add an edge to the rows of its head (outgoing) and / or of its tail (incoming)."""
+        self.edges[0].append(self._entity(head_qid))
+        self.edges[1].append(self._property(pid))
+        self.edges[2].append(self._entity(tail_qid))
+        self.edges[3].append(outgoing | incoming << 1)
+
+    def add_value(self, head_qid: str, pid: str, value: str):
+        self.values[0].append(self._entity(head_qid))
+        self.values[1].append(self._property(pid))
+        self.values[2].append(value)
+
+    def add_external_id(self, qid: str, pid: str, value: str):
+        self.external_ids[0].append(self._entity(qid))
+        self.external_ids[1].append(self._property(pid))
+        self.external_ids[2].append(value)
+
+    def add_mid(self, mid: str, qid: str):
+        """Map an external id value (e.g. a Freebase mid) to an entity having it."""
+        self.mids.setdefault(mid, array("I")).append(self._entity(qid))
+
+    def write(
+        self,
+        directory: str,
+        entity_labels: tp.Mapping[str, str],
+        property_labels: tp.Mapping[str, str],
+    ):
+        os.makedirs(directory, exist_ok=True)
+        meta_path = os.path.join(directory, "meta.json")
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+        qids, entity_ids = _sorted_ids(self.entities.strings)
+        pids, property_ids = _sorted_ids(self.properties.strings)
+        StringTable.write(directory, "entities", qids)
+        StringTable.write(
+            directory, "entity_labels", (entity_labels.get(qid, "N/A") for qid in qids)
+        )
+        StringTable.write(directory, "properties", pids)
+        StringTable.write(
+            directory,
+            "property_labels",
+            (property_labels.get(pid, "N/A") for pid in pids),
+        )
+
+        def columns(table):
+            return (
+                entity_ids[np.frombuffer(table[0], dtype=np.uint32)],
+                property_ids[np.frombuffer(table[1], dtype=np.uint32)],
+            )
+
+        heads, edge_pids = columns(self.edges)
+        tails = entity_ids[np.frombuffer(self.edges[2], dtype=np.uint32)]
+        sides = np.frombuffer(self.edges[3], dtype=np.uint8)
+        out = (sides & 1).astype(bool)
+        Adjacency.write(directory, "out", len(qids), heads[out], edge_pids[out], tails[out])
+        inc = (sides & 2).astype(bool)
+        Adjacency.write(directory, "in", len(qids), tails[inc], edge_pids[inc], heads[inc])
+
+        for name, table in (("values", self.values), ("external_ids", self.external_ids)):
+            rows, table_pids = columns(table)
+            order = Adjacency.write(directory, name, len(qids), rows, table_pids)
+            StringTable.write(directory, name + "_strings", (table[2][i] for i in order))
+
+        # every external id value (e.g. a Freebase mid) -> the entities having it
+        mid_strings, _ = _sorted_ids(list(self.mids))
+        StringTable.write(directory, "mids", mid_strings)
+        mid_offsets = np.zeros(len(mid_strings) + 1, dtype=np.int64)
+        np.cumsum([len(self.mids[mid]) for mid in mid_strings], out=mid_offsets[1:])
+        _save(directory, "mid_qids.offsets", mid_offsets)
+        _save(
+            directory,
+            "mid_qids.targets",
+            entity_ids[np.array([qid for mid in mid_strings for qid in self.mids[mid]], dtype=np.int64)],
+        )
+
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "entities": len(qids),
+            "properties": len(pids),
+            "edges": len(heads),
+            "outgoing_edges": int(out.sum()),
+            "incoming_edges": int(inc.sum()),
+            "values": len(self.values[2]),
+            "external_ids": len(self.external_ids[2]),
+            "mids": len(mid_strings),
+        }
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+        return meta
+
+
+class BinaryIndex:
+    """
+    Read-only view of a binary chunk, answering the same lookups as the pickle
+    index with the same shapes: relations and entities as {"pid"/"qid", "label"}
+    dicts, and empty results instead of missing keys.
+    """
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["format_version"] != FORMAT_VERSION:
+            raise ValueError(
+                f"{directory} has index format {self.meta['format_version']}, expected {FORMAT_VERSION}"
+            )
+        self.entities = StringTable(directory, "entities")
+        self.entity_labels = StringTable(directory, "entity_labels")
+        # a few thousand properties, kept as Python objects
+        properties = StringTable(directory, "properties")
+        property_labels = StringTable(directory, "property_labels")
+        self.pid_ids = {properties[i]: i for i in range(len(properties))}
+        self.relations = [
+            {"pid": properties[i], "label": property_labels[i]}
+            for i in range(len(properties))
+        ]
+        self.out_edges = Adjacency(directory, "out")
+        self.in_edges = Adjacency(directory, "in")
+        self.values = Adjacency(directory, "values", targets=False)
+        self.value_strings = StringTable(directory, "values_strings")
+        self.external_ids = Adjacency(directory, "external_ids", targets=False)
+        self.external_id_strings = StringTable(directory, "external_ids_strings")
+        self.mids = StringTable(directory, "mids")
+        self.mid_offsets = _load(directory, "mid_qids.offsets")
+        self.mid_qids = _load(directory, "mid_qids.targets")
+
+    def _entity(self, i: int) -> tp.Dict[str, str]:
+        return {"qid": self.entities[i], "label": self.entity_labels[i]}
+
+    def _pair(self, qid: str, pid: str) -> tp.Tuple[int, int]:
+        return self.entities.find(qid), self.pid_ids.get(pid, -1)
+
+    def relations_of(self, qid: str) -> tp.Dict[str, tp.List]:
+        """One relation per edge or value where the entity is the head, and per edge where it is the tail."""
+        result = {"head": [], "tail": []}
+        entity = self.entities.find(qid)
+        if entity < 0:
+            return result
+        for adjacency, side in (
+            (self.out_edges, "head"),
+            (self.values, "head"),
+            (self.in_edges, "tail"),
+        ):
+            start, end = adjacency.row(entity)
+            result[side].extend(self.relations[pid] for pid in adjacency.pids[start:end])
+        return result
+
+    def tail_entities_of(self, qid: str, pid: str) -> tp.Dict[str, tp.List]:
+        """Entities linked to `qid` by `pid`, as tails ("tail") or as heads ("head")."""
+        result = {"head": [], "tail": []}
+        entity, relation = self._pair(qid, pid)
+        if entity < 0 or relation < 0:
+            return result
+        for adjacency, side in ((self.out_edges, "tail"), (self.in_edges, "head")):
+            start, end = adjacency.span(entity, relation)
+            result[side] = [self._entity(i) for i in adjacency.targets[start:end]]
+        return result
+
+    def _strings(self, adjacency: Adjacency, strings: StringTable, qid: str, pid: str) -> tp.List[str]:
+        entity, relation = self._pair(qid, pid)
+        if entity < 0 or relation < 0:
+            return []
+        start, end = adjacency.span(entity, relation)
+        return [strings[i] for i in range(start, end)]
+
+    def tail_values_of(self, qid: str, pid: str) -> tp.List[str]:
+        return self._strings(self.values, self.value_strings, qid, pid)
+
+    def external_ids_of(self, qid: str, pid: str) -> tp.List[str]:
+        return self._strings(self.external_ids, self.external_id_strings, qid, pid)
+
+    def qids_of_mid(self, mid: str) -> tp.List[str]:
+        i = self.mids.find(mid)
+        if i < 0:
+            return []
+        return [self.entities[qid] for qid in self.mid_qids[self.mid_offsets[i] : self.mid_offsets[i + 1]]]
+
+
+def convert_pickle_chunk(index_dir: str, chunk_number: int) -> tp.Dict[str, int]:
+    """Write the binary chunk of an existing pickle chunk, labels are taken from its entries."""
+    from Wikidata.simple_wikidata_db.db_deploy.pickle_index import open_pickle_index
+
+    index = open_pickle_index(index_dir, chunk_number)
+    writer = BinaryIndexWriter()
+    for head_qid, pid, tail_qid in index.edges():
+        writer.add_edge(head_qid, pid, tail_qid)
+    for head_qid, pid, value in index.values():
+        writer.add_value(head_qid, pid, value)
+    for qid, pid, value in index.external_id_items():
+        writer.add_external_id(qid, pid, value)
+    for mid, qid in index.mids():
+        writer.add_mid(mid, qid)
+    entity_labels, property_labels = index.labels()
+    return writer.write(chunk_dir(index_dir, chunk_number), entity_labels, property_labels)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Convert pickle index chunks to the binary format"
+    )
+    parser.add_argument(
+        "--index_dir",
+        type=str,
+        required=True,
+        help="Directory of the *_chunk_N.pickle files",
+    )
+    parser.add_argument(
+        "--chunk_number",
+        type=int,
+        nargs="+",
+        required=True,
+        help="Chunk numbers to convert, as in the pickle file names (from 1)",
+    )
+    args = parser.parse_args()
+    for chunk_number in args.chunk_number:
+        print(f"Chunk {chunk_number}: {convert_pickle_chunk(args.index_dir, chunk_number)}")
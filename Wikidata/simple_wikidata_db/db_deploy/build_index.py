@@ -17,12 +17,20 @@ from Wikidata.simple_wikidata_db.db_deploy.utils import (
     read_relation_label,
     read_entity_label,
 )
+from Wikidata.simple_wikidata_db.db_deploy.binary_index import BinaryIndexWriter, chunk_dir
+from Wikidata.simple_wikidata_db.db_deploy.vocab import IndexVocabulary, id_lists, pair_key
+from Wikidata.simple_wikidata_db.db_deploy.partition import Shard, write_partition
+from Wikidata.simple_wikidata_db.db_deploy.label_index import write_label_index
 import typing as tp
 
 
-def read_relation_entities(filename):
+def read_relation_entities(filename, shard=None):
     relation_entities = []
     for item in jsonl_generator(filename):
+        if shard is not None and not (
+            shard.owns(item["qid"]) or shard.owns(item["value"])
+        ):
+            continue
         relation_entities.append(
             {
                 "head_qid": item["qid"],
@@ -33,9 +41,11 @@ def read_relation_entities(filename):
     return relation_entities
 
 
-def read_tail_values(filename):
+def read_tail_values(filename, shard=None):
     relation_entities = []
     for item in jsonl_generator(filename):
+        if shard is not None and not shard.owns(item["qid"]):
+            continue
         relation_entities.append(
             {
                 "head_qid": item["qid"],
@@ -46,9 +56,13 @@ def read_tail_values(filename):
     return relation_entities
 
 
-def read_external_ids(filename):
+def read_external_ids(filename, shard=None):
     relation_entities = []
     for item in jsonl_generator(filename):
+        if shard is not None and not (
+            shard.owns(item["qid"]) or shard.owns(item["value"])
+        ):
+            continue
         relation_entities.append(
             {
                 "qid": item["qid"],
@@ -182,104 +196,139 @@ def main(args):
     # missing_qids = []
     # missing_pids = []
 
+    # The label tables are shared by all chunks, written once next to them
+    if args.chunk_idx in (-1, 0):
+        print("Writing label tables ...")
+        print(write_label_index(args.output_dir, qid_to_name, pid_to_name))
+
     # Step 3: Read entity_rels, entity_values, and external_ids
+    if args.partition == "hash":
+        write_partition(args.output_dir, num_chunks)
     for i in range(num_chunks):
         if args.chunk_idx != -1 and i != args.chunk_idx:
             continue
-        start = i * chunk_size_entity_rels
-        end = start + chunk_size_entity_rels
-        chunk_files = files_index["entity_rels"][start:end]
-
-        relations_linked_to_entities = defaultdict(a_factory)
-        entities_related_to_relent_pair = defaultdict(a_factory)
+        # hash: every chunk reads all files and keeps the keys it owns,
+        # files: every chunk reads its own slice of the files
+        shard = Shard(i, num_chunks) if args.partition == "hash" else None
+        owns = shard.owns if shard is not None else lambda key: True
+
+        def chunk_slice(table, chunk_size):
+            if shard is not None:
+                return files_index[table]
+            return files_index[table][i * chunk_size : (i + 1) * chunk_size]
+
+        chunk_files = chunk_slice("entity_rels", chunk_size_entity_rels)
+
+        # keyed by entity id / pair_key(head id, pid id), holding lists of ids
+        vocab = IndexVocabulary()
+        relations_linked_to_entities = defaultdict(id_lists)
+        entities_related_to_relent_pair = defaultdict(id_lists)
         tail_values = defaultdict(list)
+        writer = BinaryIndexWriter() if args.index_format == "binary" else None
 
         print(f"Processing `entity_rels` of chunk {i+1} ...")
         for output in tqdm(
             pool.imap_unordered(
-                read_relation_entities,
+                partial(read_relation_entities, shard=shard),
                 chunk_files,
                 chunksize=1,
             )
         ):
             for item in output:
+                outgoing = owns(item["head_qid"])
+                incoming = owns(item["tail_qid"])
+                if writer is not None:
+                    writer.add_edge(
+                        item["head_qid"],
+                        item["pid"],
+                        item["tail_qid"],
+                        outgoing=outgoing,
+                        incoming=incoming,
+                    )
+                    continue
                 # if item["pid"] not in pid_to_name:
                 #     missing_pids.append(item["pid"])
                 # if item["tail_qid"] not in qid_to_name:
                 #     missing_qids.append(item["tail_qid"])
-                rel = Relation(
-                    pid=item["pid"],
-                    label=pid_to_name.get(item["pid"], "N/A"),
-                )
-                relations_linked_to_entities[item["head_qid"]]["head"].append(
-                    rel
-                )
-                relations_linked_to_entities[item["tail_qid"]]["tail"].append(
-                    rel
-                )
-
-                entities_related_to_relent_pair[
-                    f'{item["head_qid"]}@{item["pid"]}'
-                ]["tail"].append(
-                    Entity(
-                        qid=item["tail_qid"],
-                        label=qid_to_name.get(item["tail_qid"], "N/A"),
-                    )
-                )
-                entities_related_to_relent_pair[
-                    f'{item["tail_qid"]}@{item["pid"]}'
-                ]["head"].append(
-                    Entity(
-                        qid=item["head_qid"],
-                        label=qid_to_name.get(item["head_qid"], "N/A"),
-                    )
-                )
+                head = vocab.entity(item["head_qid"])
+                tail = vocab.entity(item["tail_qid"])
+                rel = vocab.property(item["pid"])
+                if outgoing:
+                    relations_linked_to_entities[head]["head"].append(rel)
+                    entities_related_to_relent_pair[pair_key(head, rel)][
+                        "tail"
+                    ].append(tail)
+                if incoming:
+                    relations_linked_to_entities[tail]["tail"].append(rel)
+                    entities_related_to_relent_pair[pair_key(tail, rel)][
+                        "head"
+                    ].append(head)
 
         print(f"Processing `entity_values` of chunk {i+1} ...")
-        start = i * chunk_size_entity_values
-        end = start + chunk_size_entity_values
-        chunk_files = files_index["entity_values"][start:end]
+        chunk_files = chunk_slice("entity_values", chunk_size_entity_values)
         for output in tqdm(
             pool.imap_unordered(
-                read_tail_values,
+                partial(read_tail_values, shard=shard),
                 chunk_files,
                 chunksize=1,
             )
         ):
             for item in output:
+                if writer is not None:
+                    writer.add_value(item["head_qid"], item["pid"], item["tail_value"])
+                    continue
                 # if item["pid"] not in pid_to_name:
                 #     missing_pids.append(item["pid"])
-                relations_linked_to_entities[item["head_qid"]]["head"].append(
-                    Relation(
-                        pid=item["pid"],
-                        label=pid_to_name.get(item["pid"], "N/A"),
-                    )
-                )
-                tail_values[f'{item["head_qid"]}@{item["pid"]}'].append(
-                    item["tail_value"]
-                )
+                head = vocab.entity(item["head_qid"])
+                rel = vocab.property(item["pid"])
+                relations_linked_to_entities[head]["head"].append(rel)
+                tail_values[pair_key(head, rel)].append(item["tail_value"])
 
         external_ids = defaultdict(list)
         mid_to_qid = defaultdict(list)
         print(f"Processing `external_ids` of chunk {i+1} ...")
-        start = i * chunk_size_external_ids
-        end = start + chunk_size_external_ids
-        chunk_files = files_index["external_ids"][start:end]
+        chunk_files = chunk_slice("external_ids", chunk_size_external_ids)
         for output in tqdm(
-            pool.imap_unordered(read_external_ids, chunk_files, chunksize=1)
+            pool.imap_unordered(
+                partial(read_external_ids, shard=shard), chunk_files, chunksize=1
+            )
         ):
             for item in output:
-                external_ids[f'{item["qid"]}@{item["pid"]}'].append(
-                    item["value"]
-                )
-                mid_to_qid[f'{item["value"]}'].append(item["qid"])
+                # the external ids belong to the qid's shard, mid_to_qid to the value's
+                if writer is not None:
+                    if owns(item["qid"]):
+                        writer.add_external_id(item["qid"], item["pid"], item["value"])
+                    if owns(item["value"]):
+                        writer.add_mid(item["value"], item["qid"])
+                    continue
+                qid = vocab.entity(item["qid"])
+                if owns(item["qid"]):
+                    external_ids[
+                        pair_key(qid, vocab.property(item["pid"]))
+                    ].append(item["value"])
+                if owns(item["value"]):
+                    mid_to_qid[f'{item["value"]}'].append(qid)
+
+        if writer is not None:
+            print(f"Writing binary index of chunk {i+1} ...")
+            meta = writer.write(
+                chunk_dir(args.output_dir, i + 1), qid_to_name, pid_to_name
+            )
+            print(meta)
+            continue
+
+        # Labels are stored once per id in the vocabulary, the dicts are
+        # dumped as plain dicts so loading them needs no factory function
+        vocab.attach_labels(qid_to_name, pid_to_name)
+        with open(f"{args.output_dir}/vocab_chunk_{i+1}.pickle", "wb") as handle:
+            pickle.dump(vocab, handle, protocol=pickle.HIGHEST_PROTOCOL)
 
         # Dump 3 index files
         with open(
             f"{args.output_dir}/relation_entities_chunk_{i+1}.pickle", "wb"
         ) as handle:
             pickle.dump(
-                relations_linked_to_entities,
+                dict(relations_linked_to_entities),
                 handle,
                 protocol=pickle.HIGHEST_PROTOCOL,
             )
@@ -287,7 +336,7 @@ def main(args):
             f"{args.output_dir}/tail_entities_chunk_{i+1}.pickle", "wb"
         ) as handle:
             pickle.dump(
-                entities_related_to_relent_pair,
+                dict(entities_related_to_relent_pair),
                 handle,
                 protocol=pickle.HIGHEST_PROTOCOL,
             )
@@ -295,17 +344,17 @@ def main(args):
         with open(
             f"{args.output_dir}/tail_values_chunk_{i+1}.pickle", "wb"
         ) as handle:
-            pickle.dump(tail_values, handle, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(dict(tail_values), handle, protocol=pickle.HIGHEST_PROTOCOL)
 
         with open(
             f"{args.output_dir}/external_ids_chunk_{i+1}.pickle", "wb"
         ) as handle:
-            pickle.dump(external_ids, handle, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(dict(external_ids), handle, protocol=pickle.HIGHEST_PROTOCOL)
             
         with open(
             f"{args.output_dir}/mid_to_qid_chunk_{i+1}.pickle", "wb"
         ) as handle:
-            pickle.dump(mid_to_qid, handle, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(dict(mid_to_qid), handle, protocol=pickle.HIGHEST_PROTOCOL)
 
         # print(
         #     f"Missing QIDs: {len(missing_qids)}, total: {len(qid_to_name)}, ratio: {len(missing_qids)/len(qid_to_name)}"
@@ -334,6 +383,20 @@ if __name__ == "__main__":
     parser.add_argument("--num_chunks", type=int, default=2)
     parser.add_argument("--num_workers", type=int, default=4)
     parser.add_argument("--chunk_idx", type=int, default=-1)
+    parser.add_argument(
+        "--partition",
+        type=str,
+        choices=["hash", "files"],
+        default="hash",
+        help="hash: chunk by crc32 of the head QID, so a lookup needs one server, files: chunk by input file order",
+    )
+    parser.add_argument(
+        "--index_format",
+        type=str,
+        choices=["binary", "pickle"],
+        default="binary",
+        help="binary: memory-mapped arrays in index_chunk_N/, pickle: dictionary-encoded dict files",
+    )
 
     args = parser.parse_args()
     main(args)
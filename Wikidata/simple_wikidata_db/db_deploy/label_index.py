@@ -0,0 +1,226 @@
+"""
+The QID / PID <=> label tables, stored once for the whole index.
+
+Label lookups don't depend on the chunk, so instead of every chunk server
+reading all label files into dicts, build_index.py writes them once to
+`index_dir/labels/` as memory-mapped arrays (see binary_index.py):
+
+- `qids` / `pids` are sorted string tables, `qid_names` / `pid_names` hold the
+  id of the label of every entry in `names`, the sorted table of distinct labels.
+- `name_qids` / `name_pids` are CSR rows of qid / pid ids per name, for the
+  reverse lookups.
+
+Either a dedicated label server maps them (`server.py --role labels`), or the
+chunk servers of one host do and share the pages.
+"""
+import itertools
+import json
+import os
+import typing as tp
+from collections import defaultdict
+
+import numpy as np
+from tqdm import tqdm
+
+from Wikidata.simple_wikidata_db.db_deploy.binary_index import (
+    StringTable,
+    _load,
+    _save,
+    _sorted_ids,
+)
+from Wikidata.simple_wikidata_db.db_deploy.utils import (
+    get_batch_files,
+    read_entity_label,
+    read_relation_label,
+)
+
+FORMAT_VERSION = 1
+
+
+def label_dir(index_dir: str) -> str:
+    return os.path.join(index_dir, "labels")
+
+
+def merge_list_of_list(dd1, dd2):
+    """
+    Optimized function to merge two defaultdict(list) instances.
+    For common keys, lists will be concatenated.
+    """
+    merged_dd = dd1
+
+    # Using dictionary comprehension to merge
+    for key in dd2.keys():
+        merged_dd[key].append(dd2[key])
+
+    return merged_dd
+
+
+class DictLabels:
+    """The label tables as in-memory dicts, read from the `labels` / `plabels` files of the dump."""
+
+    def __init__(self, data_dir: str, pool):
+        self.qid_to_name = {}
+        self.name_to_qid = defaultdict(list)
+        self.pid_to_name = {}
+        self.name_to_pid = defaultdict(list)
+        print("Reading relation labels ...")
+        for output in tqdm(
+            pool.imap_unordered(
+                read_relation_label,
+                get_batch_files(os.path.join(data_dir, "plabels")),
+                chunksize=1,
+            )
+        ):
+            self.pid_to_name.update(output[0])
+            self.name_to_pid = merge_list_of_list(self.name_to_pid, output[1])
+        for k, v in self.name_to_pid.items():
+            self.name_to_pid[k] = list(itertools.chain(*v))
+
+        print("Reading entity labels ...")
+        for output in tqdm(
+            pool.imap_unordered(
+                read_entity_label,
+                get_batch_files(os.path.join(data_dir, "labels")),
+                chunksize=1,
+            )
+        ):
+            self.qid_to_name.update(output[0])
+            self.name_to_qid = merge_list_of_list(self.name_to_qid, output[1])
+        for k, v in self.name_to_qid.items():
+            self.name_to_qid[k] = list(itertools.chain(*v))
+
+    def __len__(self) -> int:
+        return len(self.qid_to_name)
+
+    def distinct_entity_labels(self) -> int:
+        return len(self.name_to_qid)
+
+    def qid2label(self, qid: str) -> tp.Optional[str]:
+        return self.qid_to_name.get(qid)
+
+    def pid2label(self, pid: str) -> tp.Optional[str]:
+        return self.pid_to_name.get(pid)
+
+    def label2qid(self, label: str) -> tp.List[str]:
+        return self.name_to_qid.get(label, [])
+
+    def label2pid(self, label: str) -> tp.List[str]:
+        return self.name_to_pid.get(label, [])
+
+
+def _write_side(
+    directory: str,
+    kind: str,
+    id_to_name: tp.Mapping[str, str],
+    name_ids: tp.Dict[str, int],
+):
+    ids, _ = _sorted_ids(list(id_to_name))
+    StringTable.write(directory, kind + "s", ids)
+    names = np.array([name_ids[id_to_name[i]] for i in ids], dtype=np.uint32)
+    _save(directory, kind + "_names", names)
+    # ids per name: stable sort of the positions by name id
+    order = np.argsort(names, kind="stable").astype(np.uint32)
+    offsets = np.zeros(len(name_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(names, minlength=len(name_ids)), out=offsets[1:])
+    _save(directory, f"name_{kind}s.offsets", offsets)
+    _save(directory, f"name_{kind}s.targets", order)
+
+
+def write_label_index(
+    index_dir: str,
+    qid_to_name: tp.Mapping[str, str],
+    pid_to_name: tp.Mapping[str, str],
+) -> tp.Dict[str, int]:
+    directory = label_dir(index_dir)
+    os.makedirs(directory, exist_ok=True)
+    names, _ = _sorted_ids(
+        list(set(qid_to_name.values()) | set(pid_to_name.values()))
+    )
+    StringTable.write(directory, "names", names)
+    name_ids = {name: i for i, name in enumerate(names)}
+    _write_side(directory, "qid", qid_to_name, name_ids)
+    _write_side(directory, "pid", pid_to_name, name_ids)
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "entities": len(qid_to_name),
+        "properties": len(pid_to_name),
+        "names": len(names),
+    }
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return meta
+
+
+class LabelIndex:
+    """Read-only view of a label directory written by write_label_index."""
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["format_version"] != FORMAT_VERSION:
+            raise ValueError(
+                f"{directory} has format version {self.meta['format_version']}, expected {FORMAT_VERSION}"
+            )
+        self.names = StringTable(directory, "names")
+        self.qids = StringTable(directory, "qids")
+        self.qid_names = _load(directory, "qid_names")
+        self.name_qid_offsets = _load(directory, "name_qids.offsets")
+        self.name_qids = _load(directory, "name_qids.targets")
+        self.pids = StringTable(directory, "pids")
+        self.pid_names = _load(directory, "pid_names")
+        self.name_pid_offsets = _load(directory, "name_pids.offsets")
+        self.name_pids = _load(directory, "name_pids.targets")
+
+    def __len__(self) -> int:
+        return len(self.qids)
+
+    def distinct_entity_labels(self) -> int:
+        return int(np.count_nonzero(np.diff(self.name_qid_offsets)))
+
+    def qid2label(self, qid: str) -> tp.Optional[str]:
+        i = self.qids.find(qid)
+        return self.names[int(self.qid_names[i])] if i >= 0 else None
+
+    def pid2label(self, pid: str) -> tp.Optional[str]:
+        i = self.pids.find(pid)
+        return self.names[int(self.pid_names[i])] if i >= 0 else None
+
+    def label2qid(self, label: str) -> tp.List[str]:
+        i = self.names.find(label)
+        if i < 0:
+            return []
+        rows = self.name_qids[self.name_qid_offsets[i] : self.name_qid_offsets[i + 1]]
+        return [self.qids[int(j)] for j in rows]
+
+    def label2pid(self, label: str) -> tp.List[str]:
+        i = self.names.find(label)
+        if i < 0:
+            return []
+        rows = self.name_pids[self.name_pid_offsets[i] : self.name_pid_offsets[i + 1]]
+        return [self.pids[int(j)] for j in rows]
+
+
+if __name__ == "__main__":
+    import argparse
+    from multiprocessing import Pool
+
+    parser = argparse.ArgumentParser(
+        description="Write the label tables of a preprocessed dump for an existing index"
+    )
+    parser.add_argument(
+        "--data_dir",
+        type=str,
+        required=True,
+        help="The preprocessed wikidata dump dir with the labels and plabels folders",
+    )
+    parser.add_argument(
+        "--index_dir",
+        type=str,
+        required=True,
+        help="The index dir, the tables are written to its labels subfolder",
+    )
+    parser.add_argument("--num_workers", type=int, default=4)
+    args = parser.parse_args()
+    with Pool(processes=args.num_workers) as pool:
+        labels = DictLabels(args.data_dir, pool)
+    print(write_label_index(args.index_dir, labels.qid_to_name, labels.pid_to_name))
@@ -0,0 +1,42 @@
+"""
+Hash partitioning of the Wikidata index.
+
+Chunk i of a hash-partitioned index holds every key whose shard_of is i: the
+outgoing edges, values and external ids of the entities it owns, their incoming
+edges, and the mids it owns. A lookup therefore only needs the server of the
+key's shard. ToG/client.py routes with the same function.
+"""
+import json
+import os
+import typing as tp
+import zlib
+from dataclasses import dataclass
+
+SCHEME = "crc32"
+
+
+def shard_of(key: str, num_shards: int) -> int:
+    return zlib.crc32(key.encode("utf-8")) % num_shards
+
+
+@dataclass
+class Shard:
+    index: int
+    num_shards: int
+
+    def owns(self, key: str) -> bool:
+        return shard_of(key, self.num_shards) == self.index
+
+
+def write_partition(index_dir: str, num_shards: int):
+    with open(os.path.join(index_dir, "partition.json"), "w") as f:
+        json.dump({"scheme": SCHEME, "num_shards": num_shards}, f)
+
+
+def read_partition(index_dir: str) -> tp.Optional[tp.Dict]:
+    """Partitioning of an index, None for an index chunked by input file order."""
+    path = os.path.join(index_dir, "partition.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
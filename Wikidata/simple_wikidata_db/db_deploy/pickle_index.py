@@ -0,0 +1,152 @@
+import os
+import pickle
+import typing as tp
+
+from Wikidata.simple_wikidata_db.db_deploy.utils import Entity, Relation, a_factory
+from Wikidata.simple_wikidata_db.db_deploy.vocab import id_lists
+
+
+def _load(index_dir: str, name: str, chunk_number: int):
+    path = f"{index_dir}/{name}_chunk_{chunk_number}.pickle"
+    print(f"Reading {path}")
+    with open(path, "rb") as handle:
+        return pickle.load(handle)
+
+
+class PickleIndex:
+    """The dict index of one chunk with "Q1@P2" keys and per-edge dataclasses, as written by older versions."""
+
+    def __init__(self, index_dir: str, chunk_number: int):
+        self.relation_entities = _load(index_dir, "relation_entities", chunk_number)
+        self.tail_entities = _load(index_dir, "tail_entities", chunk_number)
+        self.tail_values = _load(index_dir, "tail_values", chunk_number)
+        self.external_ids = _load(index_dir, "external_ids", chunk_number)
+        self.mid_to_qid = _load(index_dir, "mid_to_qid", chunk_number)
+
+    # .get() so that missing keys are not added to the defaultdicts
+    def relations_of(self, qid: str) -> tp.Dict[str, tp.List[Relation]]:
+        return self.relation_entities.get(qid) or a_factory()
+
+    def tail_entities_of(self, qid: str, pid: str) -> tp.Dict[str, tp.List[Entity]]:
+        return self.tail_entities.get(f"{qid}@{pid}") or a_factory()
+
+    def tail_values_of(self, qid: str, pid: str) -> tp.List[str]:
+        return self.tail_values.get(f"{qid}@{pid}", [])
+
+    def external_ids_of(self, qid: str, pid: str) -> tp.List[str]:
+        return self.external_ids.get(f"{qid}@{pid}", [])
+
+    def qids_of_mid(self, mid: str) -> tp.List[str]:
+        return self.mid_to_qid.get(mid, [])
+
+    def labels(self) -> tp.Tuple[tp.Dict[str, str], tp.Dict[str, str]]:
+        entity_labels, property_labels = {}, {}
+        for relations in self.relation_entities.values():
+            for relation in relations["head"] + relations["tail"]:
+                property_labels[relation.pid] = relation.label
+        for entities in self.tail_entities.values():
+            for entity in entities["head"] + entities["tail"]:
+                entity_labels[entity.qid] = entity.label
+        return entity_labels, property_labels
+
+    def _items(self, table):
+        for key, values in table.items():
+            qid, pid = key.split("@", 1)
+            for value in values:
+                yield qid, pid, value
+
+    def edges(self) -> tp.Iterator[tp.Tuple[str, str, str]]:
+        # every edge is listed once as a tail of its head
+        for key, entities in self.tail_entities.items():
+            head_qid, pid = key.split("@", 1)
+            for entity in entities["tail"]:
+                yield head_qid, pid, entity.qid
+
+    def values(self) -> tp.Iterator[tp.Tuple[str, str, str]]:
+        return self._items(self.tail_values)
+
+    def external_id_items(self) -> tp.Iterator[tp.Tuple[str, str, str]]:
+        return self._items(self.external_ids)
+
+    def mids(self) -> tp.Iterator[tp.Tuple[str, str]]:
+        for mid, qids in self.mid_to_qid.items():
+            for qid in qids:
+                yield mid, qid
+
+
+class EncodedPickleIndex:
+    """
+    The dict index of one chunk in dictionary-encoded form: integer keys, and
+    arrays of entity / property ids decoded through the chunk's vocabulary.
+    """
+
+    def __init__(self, index_dir: str, chunk_number: int):
+        self.vocab = _load(index_dir, "vocab", chunk_number)
+        self.relation_entities = _load(index_dir, "relation_entities", chunk_number)
+        self.tail_entities = _load(index_dir, "tail_entities", chunk_number)
+        self.tail_values = _load(index_dir, "tail_values", chunk_number)
+        self.external_ids = _load(index_dir, "external_ids", chunk_number)
+        self.mid_to_qid = _load(index_dir, "mid_to_qid", chunk_number)
+
+    def relations_of(self, qid: str) -> tp.Dict[str, tp.List[tp.Dict[str, str]]]:
+        relations = self.relation_entities.get(self.vocab.entities.get(qid)) or id_lists()
+        return {
+            side: [self.vocab.decode_relation(pid) for pid in pids]
+            for side, pids in relations.items()
+        }
+
+    def tail_entities_of(self, qid: str, pid: str) -> tp.Dict[str, tp.List[tp.Dict[str, str]]]:
+        entities = self.tail_entities.get(self.vocab.pair(qid, pid)) or id_lists()
+        return {
+            side: [self.vocab.decode_entity(i) for i in ids]
+            for side, ids in entities.items()
+        }
+
+    def tail_values_of(self, qid: str, pid: str) -> tp.List[str]:
+        return self.tail_values.get(self.vocab.pair(qid, pid), [])
+
+    def external_ids_of(self, qid: str, pid: str) -> tp.List[str]:
+        return self.external_ids.get(self.vocab.pair(qid, pid), [])
+
+    def qids_of_mid(self, mid: str) -> tp.List[str]:
+        return [self.vocab.entities[i] for i in self.mid_to_qid.get(mid, ())]
+
+    def labels(self) -> tp.Tuple[tp.Dict[str, str], tp.Dict[str, str]]:
+        vocab = self.vocab
+        return (
+            {qid: vocab.entity_label(i) for i, qid in enumerate(vocab.entities.strings)},
+            {pid: vocab.property_label(i) for i, pid in enumerate(vocab.properties.strings)},
+        )
+
+    def _split(self, key: int) -> tp.Tuple[str, str]:
+        return self.vocab.entities[key >> 32], self.vocab.properties[key & 0xFFFFFFFF]
+
+    def _items(self, table):
+        for key, values in table.items():
+            qid, pid = self._split(key)
+            for value in values:
+                yield qid, pid, value
+
+    def edges(self) -> tp.Iterator[tp.Tuple[str, str, str]]:
+        for key, entities in self.tail_entities.items():
+            head_qid, pid = self._split(key)
+            for i in entities["tail"]:
+                yield head_qid, pid, self.vocab.entities[i]
+
+    def values(self) -> tp.Iterator[tp.Tuple[str, str, str]]:
+        return self._items(self.tail_values)
+
+    def external_id_items(self) -> tp.Iterator[tp.Tuple[str, str, str]]:
+        return self._items(self.external_ids)
+
+    def mids(self) -> tp.Iterator[tp.Tuple[str, str]]:
+        for mid, qids in self.mid_to_qid.items():
+            for i in qids:
+                yield mid, self.vocab.entities[i]
+
+
+def open_pickle_index(index_dir: str, chunk_number: int):
+    """The pickle index of a chunk, encoded if it has a vocabulary file."""
+    if os.path.exists(f"{index_dir}/vocab_chunk_{chunk_number}.pickle"):
+        return EncodedPickleIndex(index_dir, chunk_number)
+    return PickleIndex(index_dir, chunk_number)
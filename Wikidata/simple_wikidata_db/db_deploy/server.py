@@ -18,159 +18,129 @@ from Wikidata.simple_wikidata_db.db_deploy.utils import (
     read_entity_label,
     read_relation_label,
 )
+from Wikidata.simple_wikidata_db.db_deploy.binary_index import BinaryIndex, chunk_dir
+from Wikidata.simple_wikidata_db.db_deploy.pickle_index import open_pickle_index
+from Wikidata.simple_wikidata_db.db_deploy.partition import read_partition
+from Wikidata.simple_wikidata_db.db_deploy.serving import (
+    MethodStats,
+    ThreadingXMLRPCServer,
+    report_every,
+    serve,
+)
+from Wikidata.simple_wikidata_db.db_deploy.label_index import (
+    DictLabels,
+    LabelIndex,
+    label_dir,
+)
 import ujson as json
 from tqdm import tqdm
 import itertools
 
 
-def merge_list_of_list(dd1, dd2):
-    """
-    Optimized function to merge two defaultdict(list) instances.
-    For common keys, lists will be concatenated.
-    """
-    merged_dd = dd1
-
-    # Using dictionary comprehension to merge
-    for key in dd2.keys():
-        merged_dd[key].append(dd2[key])
-
-    return merged_dd
-
-
 class WikidataQueryServer:
     def __init__(
         self,
         chunk_number: int,
         data_dir: str,
+        index_dir: str,
         num_workers: int = 4,
+        serve_labels: bool = True,
+        serve_links: bool = True,
     ):
-        self.num_workers = num_workers
-        self.pool = Pool(processes=self.num_workers)
-
-        self.files_index = {
-            "labels": get_batch_files(os.path.join(data_dir, "labels")),
-            "plabels": get_batch_files(os.path.join(data_dir, "plabels")),
-        }
+        self.serve_labels = serve_labels
+        self.serve_links = serve_links
+        self.partition = read_partition(index_dir)
+        self.chunk_number = chunk_number
 
-        self.qid_to_name = {}
-        self.name_to_qid = defaultdict(list)
-        self.pid_to_name = {}
-        self.name_to_pid = defaultdict(list)
-        print("Reading relation labels ...")
-        for output in tqdm(
-            self.pool.imap_unordered(
-                read_relation_label, self.files_index["plabels"], chunksize=1
-            )
-        ):
-            self.pid_to_name.update(output[0])
-            self.name_to_pid = merge_list_of_list(self.name_to_pid, output[1])
-        for k, v in self.name_to_pid.items():
-            self.name_to_pid[k] = list(itertools.chain(*v))
-
-        print("Reading entity labels ...")
-        for output in tqdm(
-            self.pool.imap_unordered(
-                read_entity_label, self.files_index["labels"], chunksize=1
+        if serve_labels:
+            labels_dir = label_dir(index_dir)
+            if os.path.exists(os.path.join(labels_dir, "meta.json")):
+                print(f"Mapping {labels_dir}")
+                self.labels = LabelIndex(labels_dir)
+            else:
+                self.num_workers = num_workers
+                with Pool(processes=self.num_workers) as pool:
+                    self.labels = DictLabels(data_dir, pool)
+            # See the number of conflict names by making differences in length
+            dup_entity_names = len(self.labels) - self.labels.distinct_entity_labels()
+            print(
+                f"Total entities = {len(self.labels)}, duplicate names = {dup_entity_names}"
             )
-        ):
-            self.qid_to_name.update(output[0])
-            self.name_to_qid = merge_list_of_list(self.name_to_qid, output[1])
 
-        for k, v in self.name_to_qid.items():
-            self.name_to_qid[k] = list(itertools.chain(*v))
+        if serve_links:
+            print("Reading links ...")
+            chunk_number = chunk_number + 1
+            binary_dir = chunk_dir(index_dir, chunk_number)
+            if os.path.exists(os.path.join(binary_dir, "meta.json")):
+                print(f"Mapping {binary_dir}")
+                self.index = BinaryIndex(binary_dir)
+            else:
+                self.index = open_pickle_index(index_dir, chunk_number)
 
-        print("Reading links ...")
-        chunk_number = chunk_number + 1
-        print(
-            f"Reading {args.data_output_dir}/relation_entities_chunk_{chunk_number}.pickle"
-        )
-        with open(
-            f"{args.data_output_dir}/relation_entities_chunk_{chunk_number}.pickle",
-            "rb",
-        ) as handle:
-            self.relation_entities = pickle.load(handle)
-        print(
-            f"Reading {args.data_output_dir}/tail_entities_chunk_{chunk_number}.pickle"
-        )
-        with open(
-            f"{args.data_output_dir}/tail_entities_chunk_{chunk_number}.pickle",
-            "rb",
-        ) as handle:
-            self.tail_entities = pickle.load(handle)
-        print(
-            f"Reading {args.data_output_dir}/tail_values_chunk_{chunk_number}.pickle"
-        )
-        with open(
-            f"{args.data_output_dir}/tail_values_chunk_{chunk_number}.pickle",
-            "rb",
-        ) as handle:
-            self.tail_values = pickle.load(handle)
-        print(
-            f"Reading {args.data_output_dir}/external_ids_chunk_{chunk_number}.pickle"
-        )
-        with open(
-            f"{args.data_output_dir}/external_ids_chunk_{chunk_number}.pickle",
-            "rb",
-        ) as handle:
-            self.external_ids = pickle.load(handle)
-        with open(
-            f"{args.data_output_dir}/mid_to_qid_chunk_{chunk_number}.pickle",
-            "rb",
-        ) as handle:
-            self.mid_to_qid = pickle.load(handle)
-
-        # See the number of conflict names by making differences in length
-        dup_entity_names = len(self.qid_to_name) - len(self.name_to_qid)
-        print(
-            f"Total entities = {len(self.qid_to_name)}, duplicate names = {dup_entity_names}"
-        )
+    def shard_info(self) -> tp.Dict[str, tp.Any]:
+        """Which keys this server holds, so that clients can send each lookup to one server only."""
+        info = {
+            "scheme": "files",
+            "shard": self.chunk_number,
+            "num_shards": 0,
+            "labels": self.serve_labels,
+            "links": self.serve_links,
+        }
+        if self.partition is not None:
+            info["scheme"] = self.partition["scheme"]
+            info["num_shards"] = self.partition["num_shards"]
+        return info
+
+    def label2qid(self, label: str) -> tp.List[str]:
+        return self.labels.label2qid(label) or "Not Found!"
 
-    def label2qid(self, label: str) -> tp.List[Entity]:
-        return self.name_to_qid.get(label, "Not Found!")
+    def label2pid(self, label: str) -> tp.List[str]:
+        return self.labels.label2pid(label) or "Not Found!"
 
-    def label2pid(self, label: str) -> tp.List[Relation]:
-        return self.name_to_pid.get(label, "Not Found!")
+    def qid2label(self, qid: str) -> str:
+        label = self.labels.qid2label(qid)
+        return label if label is not None else "Not Found!"
 
-    def qid2label(self, qid: str) -> tp.List[Entity]:
-        return self.qid_to_name.get(qid, "Not Found!")
+    def pid2label(self, pid: str) -> str:
+        label = self.labels.pid2label(pid)
+        return label if label is not None else "Not Found!"
 
-    def pid2label(self, pid: str) -> tp.List[Relation]:
-        return self.pid_to_name.get(pid, "Not Found!")
+    def qid2label_many(self, qids: tp.List[str]) -> tp.List[str]:
+        return [self.qid2label(qid) for qid in qids]
 
     def mid2qid(self, mid: str) -> tp.List[str]:
-        return self.mid_to_qid.get(mid, "Not Found!")
+        return self.index.qids_of_mid(mid) or "Not Found!"
 
     def get_all_relations_of_an_entity(
         self, entity_qid: str
     ) -> tp.Dict[str, tp.List[Relation]]:
-        try:
-            return self.relation_entities[entity_qid]
-        except KeyError:
-            return "Not Found!"
+        return self.index.relations_of(entity_qid)
 
     def get_tail_entities_given_head_and_relation(
         self, head_qid: str, relation_pid: str
     ) -> tp.Dict[str, tp.List[Entity]]:
-        try:
-            return self.tail_entities[f"{head_qid}@{relation_pid}"]
-        except KeyError:
-            return "Not Found!"
+        return self.index.tail_entities_of(head_qid, relation_pid)
+
+    def get_all_relations_many(
+        self, entity_qids: tp.List[str]
+    ) -> tp.List[tp.Dict[str, tp.List[Relation]]]:
+        return [self.index.relations_of(qid) for qid in entity_qids]
+
+    def get_tail_entities_many(
+        self, pairs: tp.List[tp.Tuple[str, str]]
+    ) -> tp.List[tp.Dict[str, tp.List[Entity]]]:
+        """Tail entities of every [head_qid, relation_pid] pair."""
+        return [self.index.tail_entities_of(qid, pid) for qid, pid in pairs]
 
     def get_tail_values_given_head_and_relation(
         self, head_qid: str, relation_pid: str
     ) -> tp.List[str]:
-        try:
-            return self.tail_values[f"{head_qid}@{relation_pid}"]
-        except KeyError:
-            return "Not Found!"
+        return self.index.tail_values_of(head_qid, relation_pid)
 
     def get_external_id_given_head_and_relation(
         self, head_qid: str, relation_pid: str
     ) -> tp.List[str]:
-        try:
-            return self.external_ids[f"{head_qid}@{relation_pid}"]
-        except KeyError:
-            return "Not Found!"
+        return self.index.external_ids_of(head_qid, relation_pid)
 
 
 class RequestHandler(SimpleXMLRPCRequestHandler):
@@ -180,28 +150,59 @@ class RequestHandler(SimpleXMLRPCRequestHandler):
 class XMLRPCWikidataQueryServer(WikidataQueryServer):
     def __init__(self, addr, server_args, requestHandler=RequestHandler):
         super().__init__(
-            chunk_number=server_args.chunk_number, data_dir=server_args.data_dir
+            chunk_number=server_args.chunk_number,
+            data_dir=server_args.data_dir,
+            index_dir=server_args.data_output_dir,
+            serve_labels=server_args.role in ("all", "labels"),
+            serve_links=server_args.role in ("all", "links"),
         )
-        self.server = SimpleXMLRPCServer(addr, requestHandler=requestHandler)
+        self.num_procs = server_args.num_procs
+        self.server = ThreadingXMLRPCServer(addr, requestHandler=requestHandler)
         self.server.register_introspection_functions()
-        self.server.register_function(self.get_all_relations_of_an_entity)
-        self.server.register_function(
-            self.get_tail_entities_given_head_and_relation
-        )
-        self.server.register_function(self.label2pid)
-        self.server.register_function(self.label2qid)
-        self.server.register_function(self.pid2label)
-        self.server.register_function(self.qid2label)
-        self.server.register_function(
-            self.get_tail_values_given_head_and_relation
+        # system.multicall batches the methods that have no *_many variant
+        self.server.register_multicall_functions()
+        methods = [self.shard_info]
+        if self.serve_links:
+            methods += [
+                self.get_all_relations_of_an_entity,
+                self.get_tail_entities_given_head_and_relation,
+                self.get_tail_values_given_head_and_relation,
+                self.get_external_id_given_head_and_relation,
+                self.mid2qid,
+                self.get_all_relations_many,
+                self.get_tail_entities_many,
+            ]
+        if self.serve_labels:
+            methods += [
+                self.label2pid,
+                self.label2qid,
+                self.pid2label,
+                self.qid2label,
+                self.qid2label_many,
+            ]
+        self.stats = MethodStats(
+            [method.__name__ for method in methods] + ["system.multicall"]
         )
-        self.server.register_function(
-            self.get_external_id_given_head_and_relation
+        for method in methods:
+            self.server.register_function(
+                self.stats.timed(method.__name__, method), method.__name__
+            )
+        self.server.funcs["system.multicall"] = self.stats.timed(
+            "system.multicall", self.server.system_multicall
         )
-        self.server.register_function(self.mid2qid)
+        self.server.register_function(self.server_stats)
+
+    def server_stats(self) -> tp.Dict[str, tp.Dict[str, float]]:
+        """Latency of every method, over all worker processes."""
+        return self.stats.snapshot()
 
-    def serve_forever(self):
-        self.server.serve_forever()
+    def serve_forever(self, stats_interval: float = 0):
+        if stats_interval > 0:
+            report_every(self.stats, stats_interval)
+        try:
+            serve(self.server, self.num_procs)
+        finally:
+            self.stats.report()
 
 
 if __name__ == "__main__":
@@ -226,6 +227,25 @@ if __name__ == "__main__":
         help="Chunk number",
         default=0
     )
+    parser.add_argument(
+        "--role",
+        type=str,
+        choices=["all", "links", "labels"],
+        default="all",
+        help="links: serve the chunk's edges only, labels: serve the label tables only, all: both",
+    )
+    parser.add_argument(
+        "--num_procs",
+        type=int,
+        default=1,
+        help="Worker processes accepting on the port, each serving requests on threads. The index is loaded once before forking",
+    )
+    parser.add_argument(
+        "--stats_interval",
+        type=float,
+        default=0,
+        help="Print the per-method latency every this many seconds, 0 to only print it on exit",
+    )
     parser.add_argument("--port", type=int, default=23546, help="Port number")
     parser.add_argument("--host_ip", type=str, help="Host IP", default="192.168.1.68")
     args = parser.parse_args()
@@ -235,5 +255,7 @@ if __name__ == "__main__":
     )
     with open("server_urls_new.txt", "a") as f:
         f.write(f"http://{args.host_ip}:{args.port}\n")
-    print(f"XMLRPC WDQS server ready and listening on 0.0.0.0:{args.port}")
-    server.serve_forever()
+    print(
+        f"XMLRPC WDQS server ready and listening on 0.0.0.0:{args.port} with {args.num_procs} processes"
+    )
+    server.serve_forever(stats_interval=args.stats_interval)
@@ -0,0 +1,143 @@
+"""
+Concurrent serving of the XML-RPC query server.
+
+All lookups are read-only, so one server can answer many requests at once:
+
+- ThreadingXMLRPCServer handles every connection on its own thread.
+- serve forks worker processes that accept on the same listening
+  socket, so lookups run on several cores despite the GIL. The index is loaded
+  before the fork, its pages are shared (mapped binary chunks) or copy-on-write
+  (pickle dicts).
+
+MethodStats keeps the per-method call counts and latency histograms in shared
+memory, so its report covers every worker process.
+"""
+import functools
+import multiprocessing
+import os
+import signal
+import socketserver
+import threading
+import time
+import typing as tp
+from xmlrpc.server import SimpleXMLRPCServer
+
+# upper bounds of the latency buckets: 10us * sqrt(2)^i, up to ~7s
+BUCKETS = [1e-5 * 2 ** (i / 2) for i in range(40)]
+# calls, total seconds, max seconds, then one count per bucket and an overflow bucket
+_FIELDS = 3 + len(BUCKETS) + 1
+
+
+class ThreadingXMLRPCServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+class MethodStats:
+    def __init__(self, methods: tp.List[str]):
+        self.index = {method: i for i, method in enumerate(methods)}
+        # raw shared memory created before the fork, guarded by one lock
+        self.values = multiprocessing.RawArray("d", len(methods) * _FIELDS)
+        self.lock = multiprocessing.Lock()
+
+    def add(self, method: str, seconds: float):
+        base = self.index[method] * _FIELDS
+        bucket = next((i for i, bound in enumerate(BUCKETS) if seconds <= bound), len(BUCKETS))
+        with self.lock:
+            self.values[base] += 1
+            self.values[base + 1] += seconds
+            self.values[base + 2] = max(self.values[base + 2], seconds)
+            self.values[base + 3 + bucket] += 1
+
+    def timed(self, method: str, func: tp.Callable) -> tp.Callable:
+        @functools.wraps(func)
+        def wrapper(*args):
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                self.add(method, time.perf_counter() - start)
+
+        return wrapper
+
+    def snapshot(self) -> tp.Dict[str, tp.Dict[str, float]]:
+        """calls, total_s, mean_ms, p50_ms, p99_ms and max_ms of every method called so far."""
+        with self.lock:
+            values = self.values[:]
+        stats = {}
+        for method, i in self.index.items():
+            row = values[i * _FIELDS : (i + 1) * _FIELDS]
+            calls, total, longest, buckets = row[0], row[1], row[2], row[3:]
+            if not calls:
+                continue
+
+            def percentile(q):
+                # upper bound of the bucket holding the q-th call
+                seen = 0
+                for bound, n in zip(BUCKETS + [longest], buckets):
+                    seen += n
+                    if seen >= q * calls:
+                        return 1000 * min(bound, longest)
+                return 1000 * longest
+
+            stats[method] = {
+                "calls": int(calls),
+                "total_s": total,
+                "mean_ms": 1000 * total / calls,
+                "p50_ms": percentile(0.5),
+                "p99_ms": percentile(0.99),
+                "max_ms": 1000 * longest,
+            }
+        return stats
+
+    def report(self):
+        print("Method latency (calls, total s, mean ms, p50 ms, p99 ms, max ms):")
+        for method, s in sorted(self.snapshot().items(), key=lambda item: -item[1]["total_s"]):
+            print(
+                "  %-45s %8d %10.2f %10.2f %10.2f %10.2f %10.1f"
+                % (method, s["calls"], s["total_s"], s["mean_ms"], s["p50_ms"], s["p99_ms"], s["max_ms"])
+            )
+
+
+def report_every(stats: MethodStats, seconds: float):
+    """Print the stats report every `seconds` from a daemon thread."""
+
+    def loop():
+        while True:
+            time.sleep(seconds)
+            stats.report()
+
+    threading.Thread(target=loop, daemon=True).start()
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def serve(server: SimpleXMLRPCServer, num_procs: int = 1):
+    """
+    Serve from num_procs processes sharing the bound socket of server, this one
+    included, until SIGTERM or Ctrl-C.
+    """
+    children = []
+    for _ in range(num_procs - 1):
+        pid = os.fork()
+        if pid == 0:
+            # children are stopped by the parent, never return to the caller
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        for pid in children:
+            os.waitpid(pid, 0)
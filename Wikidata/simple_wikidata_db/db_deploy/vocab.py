@@ -0,0 +1,106 @@
+"""
+Dictionary encoding of the Wikidata index.
+
+QIDs and PIDs are mapped to dense integer ids and every label string is stored
+once in a StringPool. The index stores integer ids per edge instead of
+`Relation` / `Entity` dataclasses carrying a copy of their label. (head, pid)
+keys are one packed integer instead of a "Q1@P2" string.
+"""
+import typing as tp
+from array import array
+
+
+class StringPool:
+    """Dense ids of distinct strings. Only the string list is pickled, the reverse dict is rebuilt on load."""
+
+    def __init__(self, strings: tp.Iterable[str] = ()):
+        self.strings = []
+        self.ids = {}
+        for string in strings:
+            self.add(string)
+
+    def add(self, string: str) -> int:
+        i = self.ids.get(string)
+        if i is None:
+            i = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return i
+
+    def get(self, string: str) -> int:
+        """Id of a string, -1 if it is not in the pool."""
+        return self.ids.get(string, -1)
+
+    def __getitem__(self, i: int) -> str:
+        return self.strings[i]
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def __getstate__(self):
+        return self.strings
+
+    def __setstate__(self, strings):
+        self.strings = strings
+        self.ids = {string: i for i, string in enumerate(strings)}
+
+
+def pair_key(head_id: int, pid_id: int) -> int:
+    """Integer key of a (head, pid) pair."""
+    return head_id << 32 | pid_id
+
+
+def id_lists() -> tp.Dict[str, tp.List[int]]:
+    """Encoded counterpart of utils.a_factory. Lists of ints pickle smaller than many short arrays."""
+    return {"head": [], "tail": []}
+
+
+class IndexVocabulary:
+    """
+    The entities and properties of one index chunk as dense ids, each with the id
+    of its label in a shared label pool.
+    """
+
+    def __init__(self):
+        self.entities = StringPool()
+        self.properties = StringPool()
+        self.labels = StringPool()
+        self.entity_labels = array("I")
+        self.property_labels = array("I")
+
+    def entity(self, qid: str) -> int:
+        return self.entities.add(qid)
+
+    def property(self, pid: str) -> int:
+        return self.properties.add(pid)
+
+    def pair(self, qid: str, pid: str) -> tp.Optional[int]:
+        """Key of an existing (head, pid) pair, None if either id is unknown."""
+        head_id, pid_id = self.entities.get(qid), self.properties.get(pid)
+        if head_id < 0 or pid_id < 0:
+            return None
+        return pair_key(head_id, pid_id)
+
+    def attach_labels(
+        self,
+        qid_to_name: tp.Mapping[str, str],
+        pid_to_name: tp.Mapping[str, str],
+    ):
+        """Look up the labels of every id added so far, "N/A" when unknown."""
+        for ids, labels, names in (
+            (self.entities, self.entity_labels, qid_to_name),
+            (self.properties, self.property_labels, pid_to_name),
+        ):
+            for string in ids.strings[len(labels) :]:
+                labels.append(self.labels.add(names.get(string, "N/A")))
+
+    def entity_label(self, i: int) -> str:
+        return self.labels[self.entity_labels[i]]
+
+    def property_label(self, i: int) -> str:
+        return self.labels[self.property_labels[i]]
+
+    def decode_entity(self, i: int) -> tp.Dict[str, str]:
+        return {"qid": self.entities[i], "label": self.entity_label(i)}
+
+    def decode_relation(self, i: int) -> tp.Dict[str, str]:
+        return {"pid": self.properties[i], "label": self.property_label(i)}